@@ -6,11 +6,14 @@ import logging
 from pydantic import BaseModel
 import tempfile
 from fastapi import Body
+from fastapi.responses import StreamingResponse
+import json
 
 from app.core.config import settings
 from app.services.msg_parser import parse_msg_file
 from app.services.jira_service import get_jira_ticket
 from app.services.vector_service import add_issue_to_vectordb, delete_issue, get_all_chroma_collections_data
+from app.services.vector_service import get_collection_summaries, get_collection_records_page, parse_record_fields
 from app.models import  IssueResponse, SearchQuery
 from pydantic import BaseModel
 from app.services.vector_service import clear_collection
@@ -55,6 +58,8 @@ class ConfluenceSearchRequest(BaseModel):
     query_text: str
     limit: int = 10
     use_llm: bool = False
+    exact_phrase: bool = False
+    full_history: bool = False
 
 class StackOverflowIngestRequest(BaseModel):
     stackoverflow_urls: List[str]
@@ -67,10 +72,23 @@ class StackOverflowSearchRequest(BaseModel):
     query_text: str
     limit: int = 10
     use_llm: bool = False
+    exact_phrase: bool = False
+    full_history: bool = False
 
 class LLMTopResultsCountRequest(BaseModel):
     llm_top_results_count: int
 
+class CollectionRebuildRequest(BaseModel):
+    # FAISS index options to change, e.g. {"index_type": "hnsw", "storage": "int8", "shards": 4}
+    options: Dict[str, Any] = {}
+
+class CollectionGenerationRequest(BaseModel):
+    # copy: filled from the active generation in the background; empty: filled by re-ingesting, then activated
+    source: str = "copy"
+    reembed: bool = False # Re-embed the documents with the configured model instead of copying the stored embeddings
+    activate: bool = True # Switch to the new generation as soon as a copy completes
+    metadata: Dict[str, Any] = {} # Options of the new collection, e.g. {"hnsw:space": "cosine"} or {"faiss:index_type": "hnsw"}
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -252,7 +270,7 @@ async def search_stackoverflow_qa(payload: StackOverflowSearchRequest):
     Search for similar Stack Overflow Q&A based on a query.
     """
     try:
-        results = search_similar_stackoverflow_content(payload.query_text, payload.limit, payload.use_llm)
+        results = search_similar_stackoverflow_content(payload.query_text, payload.limit, payload.use_llm, payload.exact_phrase, payload.full_history)
         if not results or not results.get("ids"):
             return {
                 "status": "success",
@@ -291,7 +309,7 @@ async def search_confluence_pages(payload: ConfluenceSearchRequest):
     Search for similar Confluence pages based on a query.
     """
     try:
-        results = confluence_search(payload.query_text, payload.limit, payload.use_llm)
+        results = confluence_search(payload.query_text, payload.limit, payload.use_llm, payload.exact_phrase, payload.full_history)
         if not results or not results.get("ids"):
             return {
                 "status": "success",
@@ -345,13 +363,13 @@ async def search_issues(query: SearchQuery):
         # Use a ThreadPoolExecutor with proper cleanup
         with ThreadPoolExecutor(max_workers=3) as executor:
             vector_task = asyncio.get_event_loop().run_in_executor(
-                executor, search_similar_issues, query.query_text, query.jira_ticket_id, query.limit, query.use_llm
+                executor, search_similar_issues, query.query_text, query.jira_ticket_id, query.limit, query.use_llm, query.exact_phrase, query.full_history
             )
             confluence_task = asyncio.get_event_loop().run_in_executor(
-                executor, confluence_search, query.query_text, query.limit, query.use_llm
+                executor, confluence_search, query.query_text, query.limit, query.use_llm, query.exact_phrase, query.full_history
             )
             stackoverflow_task = asyncio.get_event_loop().run_in_executor(
-                executor, search_similar_stackoverflow_content, query.query_text, query.limit, query.use_llm
+                executor, search_similar_stackoverflow_content, query.query_text, query.limit, query.use_llm, query.exact_phrase, query.full_history
             )
 
             vector_issues, confluence_results, stackoverflow_results = await asyncio.gather(
@@ -464,6 +482,8 @@ async def get_issue(issue_id: str):
 async def clear_chroma_collection(collection_name: str):
     """
     Delete all data from the specified ChromaDB collection.
+    Searches return nothing until it is re-ingested; POST /chroma-collections/{collection_name}/generations
+    rebuilds a collection beside the live one instead.
     """
     try:
         result = clear_collection(collection_name)
@@ -472,7 +492,7 @@ async def clear_chroma_collection(collection_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 from app.core.config import settings
-from app.services.faiss_client import FaissClient # Add import for FaissClient
+from app.services.chroma_client import get_vector_db_client
 
 @router.get("/chroma-collections")
 async def get_chroma_collections():
@@ -484,8 +504,8 @@ async def get_chroma_collections():
             # Ensure FAISS_INDEX_PATH is configured
             if not settings.FAISS_INDEX_PATH:
                 raise HTTPException(status_code=500, detail="FAISS_INDEX_PATH is not configured in settings.")
-            faiss_client = FaissClient(base_path=settings.FAISS_INDEX_PATH)
-            data = faiss_client.get_collections_with_records()
+            # The shared client: the workers' own collections, or the FAISS index server's (FAISS_SERVER_URL)
+            data = get_vector_db_client().get_collections_with_records()
             logger.info(f"Retrieved FAISS collections: {len(data)}")
         except Exception as e:
             logger.error(f"Error accessing FAISS collections: {e}")
@@ -501,6 +521,181 @@ async def get_chroma_collections():
             raise HTTPException(status_code=500, detail=f"Error accessing ChromaDB collections: {str(e)}")
 
     return {"collections": data if isinstance(data, list) else []}
+
+@router.get("/chroma-collections/summary")
+async def get_chroma_collection_summaries():
+    """
+    Name and record count of every collection (plus index details for FAISS), without any records.
+    Use /chroma-collections/{collection_name}/records to page through the records themselves.
+    """
+    try:
+        return {"collections": get_collection_summaries()}
+    except Exception as e:
+        logger.error(f"Error reading collection summaries: {e}")
+        raise HTTPException(status_code=500, detail=f"Error reading collection summaries: {str(e)}")
+
+@router.get("/chroma-collections/{collection_name}/records")
+async def stream_chroma_collection_records(
+    collection_name: str,
+    cursor: str = Query(None, description="next_cursor returned by the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    fields: str = Query("ids,metadata,documents", description="Comma-separated projection: ids, metadata, documents, embeddings")
+):
+    """
+    Stream one page of a collection's records as NDJSON: one {"id", ...} object per line, then a final
+    {"next_cursor": ...} line (null after the last page).
+    """
+    try:
+        include = parse_record_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        page = get_collection_records_page(collection_name, cursor=cursor, limit=limit, include=include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+    except Exception as e:
+        logger.error(f"Error reading records of collection {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail=f"Collection {collection_name} not found")
+    records, next_cursor = page
+
+    def ndjson_lines():
+        for record in records:
+            yield json.dumps(record, default=str) + "\n"
+        yield json.dumps({"next_cursor": next_cursor}) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@router.get("/chroma-collections/stats")
+async def get_chroma_collection_stats():
+    """
+    Per-collection index stats. FAISS collections report tombstoned (deleted, not yet compacted) vectors
+    and background compaction counters; ChromaDB collections report their record count.
+    """
+    try:
+        client = get_vector_db_client()
+        if settings.USE_FAISS:
+            stats = client.collection_stats()
+        else:
+            stats = []
+            for col in client.list_collections():
+                col_name = col.name if hasattr(col, 'name') else col
+                stats.append({"collection_name": col_name, "live": client.get_collection(col_name).count()})
+    except Exception as e:
+        logger.error(f"Error reading collection stats: {e}")
+        raise HTTPException(status_code=500, detail=f"Error reading collection stats: {str(e)}")
+    return {"collections": stats}
+
+@router.post("/chroma-collections/{collection_name}/compact")
+async def compact_chroma_collection(collection_name: str):
+    """
+    Start a background compaction of a FAISS collection, dropping its tombstoned vectors from the index.
+    """
+    if not settings.USE_FAISS:
+        raise HTTPException(status_code=400, detail="Compaction is only available for FAISS collections.")
+    collection = get_vector_db_client().get_collection(collection_name)
+    if collection is None:
+        raise HTTPException(status_code=404, detail=f"Collection {collection_name} not found")
+    try:
+        collection.compact(background=True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "started", "stats": collection.compaction_stats()}
+
+@router.post("/chroma-collections/{collection_name}/reindex")
+async def reindex_chroma_collection(collection_name: str):
+    """
+    Start re-embedding a FAISS collection's stored documents with the configured embedding model, e.g. after
+    EMBEDDING_MODEL changed. The new index is built beside the live one and swapped in when complete.
+    """
+    if not settings.USE_FAISS:
+        raise HTTPException(status_code=400, detail="Reindexing is only available for FAISS collections.")
+    try:
+        return get_vector_db_client().reindex_collection(collection_name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Collection {collection_name} not found")
+    except Exception as e:
+        logger.error(f"Error starting reindex of collection {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chroma-collections/{collection_name}/rebuild")
+async def rebuild_chroma_collection(collection_name: str, payload: CollectionRebuildRequest = Body(...)):
+    """
+    Start rebuilding a FAISS collection with other index options (index type, storage, metric, shard count, ...)
+    from its embedding archive, without re-running the embedding model. Progress is reported by GET .../reindex.
+    """
+    if not settings.USE_FAISS:
+        raise HTTPException(status_code=400, detail="Rebuilding is only available for FAISS collections.")
+    try:
+        return get_vector_db_client().rebuild_collection(collection_name, payload.options)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Collection {collection_name} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error starting rebuild of collection {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/chroma-collections/{collection_name}/reindex")
+async def get_chroma_collection_reindex_status(collection_name: str):
+    """ Progress of the latest reindex or rebuild job of a FAISS collection (status, phase, processed / total documents). """
+    if not settings.USE_FAISS:
+        raise HTTPException(status_code=400, detail="Reindexing is only available for FAISS collections.")
+    status = get_vector_db_client().reindex_status(collection_name)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No reindex job for collection {collection_name}")
+    return status
+
+@router.get("/chroma-collections/{collection_name}/generations")
+async def get_chroma_collection_generations(collection_name: str):
+    """ Generations of a collection (active, previous, being built) and the progress of its latest build. """
+    return get_vector_db_client().generation_status(collection_name)
+
+@router.post("/chroma-collections/{collection_name}/generations")
+async def build_chroma_collection_generation(collection_name: str, payload: CollectionGenerationRequest = Body(...)):
+    """
+    Start a new generation of a collection (ChromaDB or FAISS) while the active one keeps serving searches.
+    source="copy" fills it from the active generation in the background and switches to it when complete;
+    source="empty" creates it empty: re-ingest the sources (writes go to both generations), then activate it.
+    """
+    try:
+        return get_vector_db_client().build_generation(collection_name, payload.source, payload.reembed, payload.activate, payload.metadata)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Collection {collection_name} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error starting a generation build of collection {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chroma-collections/{collection_name}/generations/{generation}/activate")
+async def activate_chroma_collection_generation(collection_name: str, generation: int):
+    """ Atomically switch a collection to one of its generations; the one it replaces is kept for rollback. """
+    try:
+        return get_vector_db_client().activate_generation(collection_name, generation)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/chroma-collections/{collection_name}/rollback")
+async def rollback_chroma_collection_generation(collection_name: str):
+    """ Switch a collection back to its previous generation. """
+    try:
+        return get_vector_db_client().rollback_generation(collection_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/chroma-collections/{collection_name}/generations/{generation}")
+async def discard_chroma_collection_generation(collection_name: str, generation: int):
+    """ Delete a generation that is not active, cancelling its build if one is running. """
+    try:
+        return get_vector_db_client().discard_generation(collection_name, generation)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
 @router.delete("/issues/{issue_id}")
 async def delete_production_issue(issue_id: str):
@@ -63,7 +63,73 @@ class Settings(BaseSettings):
     CHROMA_USE_HTTP: bool = os.getenv("CHROMA_USE_HTTP", "false").lower() == "true"
     USE_FAISS: bool = os.getenv("USE_FAISS", "false").lower() == "true"
     FAISS_INDEX_PATH: str = os.getenv("FAISS_INDEX_PATH", "./data/faiss")
-    
+    # Collections are rebuilt as a new generation beside the live one (Chroma or FAISS), then switched to atomically;
+    # copy builds move GENERATION_BUILD_BATCH_SIZE records at a time
+    GENERATION_BUILD_BATCH_SIZE: int = int(os.getenv("GENERATION_BUILD_BATCH_SIZE", 500))
+    # Default index layout for new FAISS collections (flat, ivf_flat, ivf_pq, hnsw); per-collection overrides are persisted in index_config.json
+    FAISS_INDEX_TYPE: str = os.getenv("FAISS_INDEX_TYPE", "flat")
+    # Distance metric for new FAISS collections: l2, cosine (normalized vectors in an inner-product index) or ip
+    FAISS_METRIC: str = os.getenv("FAISS_METRIC", "l2")
+    # Vector storage for the first-stage search: float32, float16, int8 or binary; quantized collections keep
+    # full-precision vectors on disk and rescore FAISS_RESCORE_FACTOR * n_results candidates exactly
+    FAISS_STORAGE: str = os.getenv("FAISS_STORAGE", "float32")
+    FAISS_RESCORE_FACTOR: int = int(os.getenv("FAISS_RESCORE_FACTOR", 4))
+    FAISS_NLIST: int = int(os.getenv("FAISS_NLIST", 1024))
+    FAISS_NPROBE: int = int(os.getenv("FAISS_NPROBE", 16))
+    FAISS_PQ_M: int = int(os.getenv("FAISS_PQ_M", 16))
+    FAISS_HNSW_M: int = int(os.getenv("FAISS_HNSW_M", 32))
+    FAISS_EF_SEARCH: int = int(os.getenv("FAISS_EF_SEARCH", 64))
+    FAISS_TRAIN_SAMPLE_SIZE: int = int(os.getenv("FAISS_TRAIN_SAMPLE_SIZE", 100000))
+    FAISS_MIN_TRAIN_SIZE: int = int(os.getenv("FAISS_MIN_TRAIN_SIZE", 10000))
+    # New collections can be split into FAISS_SHARDS sub-indexes, searched in parallel; documents are placed by
+    # a hash of their id or, with FAISS_SHARD_BY=time, by the timestamp in their metadata
+    FAISS_SHARDS: int = int(os.getenv("FAISS_SHARDS", 1))
+    FAISS_SHARD_BY: str = os.getenv("FAISS_SHARD_BY", "hash")
+    # New collections can instead keep records dated within FAISS_HOT_TIER_DAYS (or hit FAISS_TIER_PROMOTE_HITS times)
+    # in an in-memory hot tier, and older ones in a memory-mapped cold tier searched only when the hot tier falls short
+    FAISS_TIERING: bool = os.getenv("FAISS_TIERING", "false").lower() == "true"
+    FAISS_HOT_TIER_DAYS: int = int(os.getenv("FAISS_HOT_TIER_DAYS", 180))
+    FAISS_TIER_PROMOTE_HITS: int = int(os.getenv("FAISS_TIER_PROMOTE_HITS", 3))
+    FAISS_TIER_REBALANCE_SECONDS: float = float(os.getenv("FAISS_TIER_REBALANCE_SECONDS", 3600))
+    # Metadata keys with an in-memory hash index for get(where=...) / filtered queries
+    FAISS_METADATA_INDEX_KEYS: List[str] = [k.strip() for k in os.getenv("FAISS_METADATA_INDEX_KEYS", "content_hash,jira_ticket_id,msg_jira_id,source").split(",") if k.strip()]
+    # Trigram index over stored documents for where_document $contains / $phrase (built on the first such filter)
+    FAISS_TRIGRAM_INDEX: bool = os.getenv("FAISS_TRIGRAM_INDEX", "true").lower() == "true"
+    # Every embedding written is archived (float32 or float16) per collection, so index layouts are rebuilt without the model
+    FAISS_EMBEDDING_ARCHIVE: bool = os.getenv("FAISS_EMBEDDING_ARCHIVE", "true").lower() == "true"
+    FAISS_EMBEDDING_ARCHIVE_DTYPE: str = os.getenv("FAISS_EMBEDDING_ARCHIVE_DTYPE", "float32")
+    # Index mutations go to a write-ahead log; index.faiss is rewritten only at checkpoints
+    FAISS_CHECKPOINT_MAX_VECTORS: int = int(os.getenv("FAISS_CHECKPOINT_MAX_VECTORS", 5000))
+    FAISS_CHECKPOINT_MAX_BYTES: int = int(os.getenv("FAISS_CHECKPOINT_MAX_BYTES", 64 * 1024 * 1024))
+    FAISS_CHECKPOINT_INTERVAL_SECONDS: float = float(os.getenv("FAISS_CHECKPOINT_INTERVAL_SECONDS", 300))
+    FAISS_WAL_FSYNC: bool = os.getenv("FAISS_WAL_FSYNC", "true").lower() == "true"
+    # Deletes only tombstone vectors; a background compaction rebuilds the index without them once they make up
+    # FAISS_COMPACTION_TOMBSTONE_RATIO of it and number at least FAISS_COMPACTION_MIN_TOMBSTONES
+    FAISS_COMPACTION_TOMBSTONE_RATIO: float = float(os.getenv("FAISS_COMPACTION_TOMBSTONE_RATIO", 0.2))
+    FAISS_COMPACTION_MIN_TOMBSTONES: int = int(os.getenv("FAISS_COMPACTION_MIN_TOMBSTONES", 1000))
+    # IVF collections are checked in the background every FAISS_OPTIMIZER_INTERVAL_SECONDS (growth since training, list
+    # imbalance, recall@10 on FAISS_OPTIMIZER_SAMPLE_SIZE stored vectors); their centroids are retrained off the request
+    # path once the collection grew FAISS_RETRAIN_GROWTH times, or imbalance or recall cross their thresholds
+    FAISS_OPTIMIZER: bool = os.getenv("FAISS_OPTIMIZER", "true").lower() == "true"
+    FAISS_OPTIMIZER_INTERVAL_SECONDS: float = float(os.getenv("FAISS_OPTIMIZER_INTERVAL_SECONDS", 3600))
+    FAISS_OPTIMIZER_SAMPLE_SIZE: int = int(os.getenv("FAISS_OPTIMIZER_SAMPLE_SIZE", 200))
+    FAISS_RETRAIN_GROWTH: float = float(os.getenv("FAISS_RETRAIN_GROWTH", 2.0))
+    FAISS_RETRAIN_IMBALANCE: float = float(os.getenv("FAISS_RETRAIN_IMBALANCE", 3.0))
+    FAISS_RETRAIN_MIN_RECALL: float = float(os.getenv("FAISS_RETRAIN_MIN_RECALL", 0.9))
+    # Memory-map index.faiss instead of copying it, so worker processes share page-cache pages;
+    # read-only workers never write and pick up the writer's checkpoints every FAISS_READ_ONLY_REFRESH_SECONDS
+    FAISS_MMAP: bool = os.getenv("FAISS_MMAP", "false").lower() == "true"
+    FAISS_READ_ONLY: bool = os.getenv("FAISS_READ_ONLY", "false").lower() == "true"
+    FAISS_READ_ONLY_REFRESH_SECONDS: float = float(os.getenv("FAISS_READ_ONLY_REFRESH_SECONDS", 5))
+    # Serve FAISS collections from one standalone index server (python -m app.services.faiss_server) that API workers
+    # reach over unix:///path/to.sock or tcp://127.0.0.1:PORT; empty keeps the collections in each worker process
+    FAISS_SERVER_URL: str = os.getenv("FAISS_SERVER_URL", "")
+    FAISS_SERVER_TIMEOUT_SECONDS: float = float(os.getenv("FAISS_SERVER_TIMEOUT_SECONDS", 30))
+    # Reindex jobs (after an embedding model change) encode stored documents in batches of FAISS_REINDEX_BATCH_SIZE,
+    # FAISS_REINDEX_WORKERS batches at a time
+    FAISS_REINDEX_BATCH_SIZE: int = int(os.getenv("FAISS_REINDEX_BATCH_SIZE", 256))
+    FAISS_REINDEX_WORKERS: int = int(os.getenv("FAISS_REINDEX_WORKERS", 2))
+
     # OpenRouter LLM API settings
     OPENROUTER_API_KEY: str = os.getenv("OPENROUTER_API_KEY", "")
     OPENROUTER_API_URL: str = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1")
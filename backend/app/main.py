@@ -27,6 +27,14 @@ app.add_middleware(
 # Include API routes
 app.include_router(api_router, prefix="/api")
 
+@app.on_event("shutdown")
+def checkpoint_vector_indexes():
+    """Fold pending FAISS write-ahead logs into the index files on a clean shutdown."""
+    from app.services import chroma_client
+    client = chroma_client._vector_db_client
+    if client is not None and hasattr(client, "checkpoint"):
+        client.checkpoint()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Support Buddy API"}
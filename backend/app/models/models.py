@@ -35,6 +35,8 @@ class SearchQuery(BaseModel):
     jira_ticket_id: Optional[str] = None
     limit: int = Field(default=10, ge=1, le=100)
     use_llm: bool = False
+    exact_phrase: bool = False # Only match documents containing query_text verbatim (case and whitespace aside)
+    full_history: bool = False # Also search the cold tier of tiered collections (older records), not only as a fallback
 
 class JiraTicket(BaseModel):
     """Schema for Jira ticket data"""
@@ -3,6 +3,7 @@ import logging
 import os
 from app.core.config import settings
 from chromadb.config import Settings
+from app.services.collection_generations import ALIASES_FILENAME, AliasedVectorDBClient, GenerationRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -11,10 +12,10 @@ _vector_db_client = None # Global cache for the client
 def get_vector_db_client(db_path: str = None):
     """
     Returns a ChromaDB PersistentClient (ChromaDB 0.4.x+) or HttpClient if CHROMA_USE_HTTP is true,
-    OR a FaissClient if USE_FAISS is true.
+    OR a FaissClient if USE_FAISS is true (a RemoteFaissClient when FAISS_SERVER_URL points at an index server).
     Uses settings.VECTOR_DB_PATH or settings.FAISS_INDEX_PATH based on the chosen client.
     Logs the persist directory and current working directory for debugging.
-    Caches the client instance.
+    Caches the client instance, wrapped so each collection is served from its active generation (see collection_generations).
     """
     global _vector_db_client
     if _vector_db_client is not None:
@@ -23,39 +24,48 @@ def get_vector_db_client(db_path: str = None):
     try:
         use_faiss = os.getenv("USE_FAISS", "false").lower() == "true"
 
-        if use_faiss:
+        if use_faiss and settings.FAISS_SERVER_URL:
+            logger.info(f"Using FAISS index server at {settings.FAISS_SERVER_URL}.")
+            from app.services.faiss_remote import RemoteFaissClient
+            _vector_db_client = _with_generations(RemoteFaissClient(settings.FAISS_SERVER_URL), settings.FAISS_INDEX_PATH)
+            return _vector_db_client
+        elif use_faiss:
             logger.info("Using FAISS client.")
             from app.services.faiss_client import FaissClient # Import locally to avoid circular dependency if FaissClient uses settings
             faiss_path = settings.FAISS_INDEX_PATH
             logger.debug(f"FAISS Base Path: {faiss_path}")
-            _vector_db_client = FaissClient(base_path=faiss_path)
+            _vector_db_client = _with_generations(FaissClient(base_path=faiss_path), faiss_path)
             return _vector_db_client
         else:
             chroma_use_http = os.getenv("CHROMA_USE_HTTP", "false").lower() == "true"
             if chroma_use_http:
                 # Default to localhost:8000, can be extended to support env config
                 logger.info("Using ChromaDB HttpClient (server mode)")
-                _vector_db_client = chromadb.HttpClient(
+                _vector_db_client = _with_generations(chromadb.HttpClient(
                     host="localhost",
                     port=8000,
                     settings=Settings(anonymized_telemetry=False)
-                )
+                ), settings.VECTOR_DB_PATH)
                 return _vector_db_client
             else:
                 persist_dir = db_path or settings.VECTOR_DB_PATH
                 logger.info(f"Using ChromaDB PersistentClient. Path: {persist_dir}")
                 logger.debug(f"Current Working Directory: {os.getcwd()}")
-                _vector_db_client = chromadb.PersistentClient(
+                _vector_db_client = _with_generations(chromadb.PersistentClient(
                     path=persist_dir,
                     settings=Settings(
                         anonymized_telemetry=False,
                     )
-                )
+                ), persist_dir)
                 return _vector_db_client
     except Exception as e:
         logger.error(f"Error initializing vector database client: {str(e)}")
         raise
 
+def _with_generations(client, base_path: str) -> AliasedVectorDBClient:
+    # The HTTP client keeps its aliases in the local VECTOR_DB_PATH; index server workers share FAISS_INDEX_PATH with the server
+    return AliasedVectorDBClient(client, GenerationRegistry(os.path.join(base_path, ALIASES_FILENAME)))
+
 def get_collection(collection_name: str):
     """
     Gets or creates a collection from the configured vector database (ChromaDB or FAISS).
@@ -0,0 +1,551 @@
+import os
+import copy
+import json
+import time
+import logging
+import threading
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from app.core.config import settings
+from app.services.embedding_service import get_embedding_model
+
+logger = logging.getLogger(__name__)
+
+# Alias file kept next to the collections (FAISS_INDEX_PATH or VECTOR_DB_PATH)
+ALIASES_FILENAME = "collection_aliases.json"
+# Generation n > 0 of collection "issues" is stored as the collection "issues__gen<n>"; generation 0 is "issues" itself
+GENERATION_SUFFIX = "__gen"
+# copy: filled in the background from the active generation; empty: filled by re-ingesting into it
+BUILD_SOURCES = ("copy", "empty")
+
+def generation_collection_name(name: str, generation: int) -> str:
+    return name if generation == 0 else f"{name}{GENERATION_SUFFIX}{generation}"
+
+class GenerationRegistry:
+    """
+    Which generation of each collection is live: an alias from the collection name to its active generation, with
+    the previous generation (kept for rollback) and the one being built. The aliases are one JSON file replaced
+    with a rename, so a switch is atomic, and re-read whenever another process has replaced it.
+    Collections without an entry are served from the collection of the same name (generation 0).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._aliases: Dict[str, Dict[str, Any]] = {}
+        self._mtime: Optional[int] = None
+        self._lock = threading.RLock()
+        self._refresh()
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            if mtime is None:
+                self._aliases = {}
+            else:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._aliases = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Error reading collection aliases from {self.path}: {e}")
+                    return
+            self._mtime = mtime
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._aliases, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def state(self, name: str) -> Dict[str, Any]:
+        """ {"active", "previous", "building", "generations": {generation: details}} of a collection. """
+        self._refresh()
+        with self._lock:
+            entry = self._aliases.get(name)
+            if entry is None:
+                return {"active": 0, "previous": None, "building": None, "generations": {"0": {"status": "active"}}}
+            return copy.deepcopy(entry)
+
+    def resolve(self, name: str) -> str:
+        """ Stored collection serving name: its active generation. """
+        return generation_collection_name(name, self.state(name)["active"])
+
+    def building(self, name: str) -> Optional[str]:
+        """ Stored collection of the generation being built for name, if any. """
+        building = self.state(name)["building"]
+        return generation_collection_name(name, building) if building is not None else None
+
+    def generations(self) -> Dict[str, Tuple[str, bool]]:
+        """ Stored collection name -> (collection name, whether it is the active generation), for every registered generation. """
+        self._refresh()
+        with self._lock:
+            return {generation_collection_name(name, int(generation)): (name, int(generation) == entry["active"])
+                    for name, entry in self._aliases.items() for generation in entry["generations"]}
+
+    def _update(self, name: str, change) -> Any:
+        with self._lock:
+            self._refresh()
+            entry = self.state(name)
+            result = change(entry)
+            self._aliases[name] = entry
+            self._save()
+            return result
+
+    def begin_build(self, name: str, source: str) -> int:
+        def change(entry):
+            if entry["building"] is not None:
+                raise ValueError(f"Generation {entry['building']} of collection '{name}' is already being built.")
+            generation = max(int(g) for g in entry["generations"]) + 1
+            entry["generations"][str(generation)] = {"status": "building", "source": source, "created_at": time.time()}
+            entry["building"] = generation
+            return generation
+        return self._update(name, change)
+
+    def end_build(self, name: str, generation: int, status: str, **details):
+        """ Record the outcome of a build (ready or failed); a failed generation is dropped from the registry. """
+        def change(entry):
+            if entry["building"] == generation:
+                entry["building"] = None
+            if status == "failed":
+                entry["generations"].pop(str(generation), None)
+            elif str(generation) in entry["generations"]:
+                entry["generations"][str(generation)].update(status=status, finished_at=time.time(), **details)
+        self._update(name, change)
+
+    def activate(self, name: str, generation: int) -> List[str]:
+        """
+        Point name at generation; the active generation becomes the previous one. Returns the stored collections
+        of the generations no longer kept (neither active, previous nor being built), for the caller to delete.
+        """
+        def change(entry):
+            details = entry["generations"].get(str(generation))
+            if details is None:
+                raise KeyError(f"Collection '{name}' has no generation {generation}.")
+            if entry["active"] == generation:
+                return []
+            if entry["building"] == generation:
+                entry["building"] = None
+            entry["generations"][str(entry["active"])]["status"] = "previous"
+            details.update(status="active", activated_at=time.time())
+            entry["previous"], entry["active"] = entry["active"], generation
+            retired = [int(g) for g in entry["generations"] if int(g) not in (entry["active"], entry["previous"], entry["building"])]
+            for g in retired:
+                del entry["generations"][str(g)]
+            return [generation_collection_name(name, g) for g in retired]
+        return self._update(name, change)
+
+    def rollback(self, name: str) -> int:
+        """ Swap the active and previous generations (rolling back again rolls forward). Returns the active generation. """
+        def change(entry):
+            if entry["previous"] is None:
+                raise ValueError(f"Collection '{name}' has no previous generation to roll back to.")
+            entry["generations"][str(entry["active"])]["status"] = "previous"
+            entry["generations"][str(entry["previous"])].update(status="active", activated_at=time.time())
+            entry["previous"], entry["active"] = entry["active"], entry["previous"]
+            return entry["active"]
+        return self._update(name, change)
+
+    def discard(self, name: str, generation: int) -> str:
+        """ Forget a generation other than the active one. Returns its stored collection, for the caller to delete. """
+        def change(entry):
+            if entry["active"] == generation:
+                raise ValueError(f"Generation {generation} is the active generation of collection '{name}'.")
+            if entry["generations"].pop(str(generation), None) is None:
+                raise KeyError(f"Collection '{name}' has no generation {generation}.")
+            if entry["building"] == generation:
+                entry["building"] = None
+            if entry["previous"] == generation:
+                entry["previous"] = None
+            return generation_collection_name(name, generation)
+        return self._update(name, change)
+
+    def forget(self, name: str) -> List[str]:
+        """ Drop a collection's entry. Returns the stored collections of all its generations. """
+        with self._lock:
+            self._refresh()
+            entry = self._aliases.pop(name, None)
+            if entry is None:
+                return [name]
+            self._save()
+            return [generation_collection_name(name, int(g)) for g in entry["generations"]]
+
+def _pages(collection, batch_size: int, include: List[str]) -> Iterator[Tuple[List[str], List[Any], List[Any], List[Any]]]:
+    """ (ids, metadatas, documents, embeddings) of a collection's records, a page at a time. """
+    if hasattr(collection, "browse"):
+        # FAISS: cursor pages over the metadata store
+        cursor = None
+        while True:
+            records, cursor = collection.browse(cursor=cursor, limit=batch_size, include=include)
+            if records:
+                yield ([r["id"] for r in records], [r.get("metadata") for r in records],
+                       [r.get("document") for r in records], [r.get("embedding") for r in records])
+            if cursor is None:
+                return
+    offset = 0
+    while True:
+        data = collection.get(limit=batch_size, offset=offset, include=include)
+        ids = data.get("ids") or []
+        if ids:
+            yield ids, _column(data, "metadatas", len(ids)), _column(data, "documents", len(ids)), _column(data, "embeddings", len(ids))
+        if len(ids) < batch_size:
+            return
+        offset += len(ids)
+
+def _column(data: Dict[str, Any], field: str, n: int) -> List[Any]:
+    values = data.get(field)
+    return list(values) if values is not None else [None] * n
+
+class GenerationBuild:
+    """
+    Fills a new generation of a collection in the background from the active one. Records are copied a page at
+    a time with their stored embeddings, or re-embedded from their documents with the configured model (reembed).
+    Writes made meanwhile reach the new generation directly (see DualWriteCollection), so records already there
+    are not copied over and deleted ones are not copied back; a last pass picks up records the paging missed.
+    The new generation is activated once complete, unless activate is False.
+    """
+    def __init__(self, client: 'AliasedVectorDBClient', name: str, generation: int, reembed: bool = False,
+                 activate: bool = True, metadata: Optional[Dict[str, Any]] = None):
+        self.client = client
+        self.name = name
+        self.generation = generation
+        self.reembed = reembed
+        self.activate = activate
+        self.metadata = metadata or None
+        self.source_name = client.registry.resolve(name)
+        self.target_name = generation_collection_name(name, generation)
+        self.status = "pending"
+        self.total = 0
+        self.processed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._deleted: set = set()
+        self._deleted_lock = threading.Lock()
+        self._cancelled = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"generation-build-{self.name}", daemon=True)
+        self._thread.start()
+
+    def is_running(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def record_deletes(self, ids: List[str]):
+        with self._deleted_lock:
+            self._deleted.update(ids)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "collection_name": self.name,
+            "generation": self.generation,
+            "source_collection": self.source_name,
+            "status": self.status,
+            "reembed": self.reembed,
+            "total": self.total,
+            "processed": self.processed,
+            "progress": round(self.processed / self.total, 4) if self.total else (1.0 if self.status in ("ready", "activated") else 0.0),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+    def _run(self):
+        self.status, self.started_at = "running", time.time()
+        client = self.client.raw_client
+        include = ['metadatas', 'documents'] + ([] if self.reembed else ['embeddings'])
+        batch_size = max(1, settings.GENERATION_BUILD_BATCH_SIZE)
+        try:
+            source = client.get_collection(self.source_name)
+            target = client.get_or_create_collection(self.target_name, metadata=self.metadata) if self.metadata else client.get_or_create_collection(self.target_name)
+            self.total = source.count()
+            for ids, metadatas, documents, embeddings in _pages(source, batch_size, include):
+                if self._cancelled:
+                    break
+                self._copy(source, target, ids, metadatas, documents, embeddings)
+            if not self._cancelled:
+                # Records shifted past the paging by concurrent deletes (offset pages) or re-inserts (FAISS cursors)
+                copied = set(target.get(include=[])["ids"])
+                missed = [doc_id for doc_id in source.get(include=[])["ids"] if doc_id not in copied]
+                for start in range(0, len(missed), batch_size):
+                    data = source.get(ids=missed[start:start + batch_size], include=include)
+                    n = len(data["ids"])
+                    self._copy(source, target, data["ids"], _column(data, "metadatas", n), _column(data, "documents", n), _column(data, "embeddings", n))
+            if self._cancelled:
+                self.status = "cancelled"
+                logger.info(f"[{self.name}] Build of generation {self.generation} cancelled.")
+                return
+            record_count = target.count()
+            self.client.registry.end_build(self.name, self.generation, "ready", record_count=record_count)
+            self.status = "ready"
+            logger.info(f"[{self.name}] Generation {self.generation} built: {record_count} records ({self.processed} copied).")
+            if self.activate:
+                self.client.activate_generation(self.name, self.generation)
+                self.status = "activated"
+        except Exception as e:
+            logger.error(f"[{self.name}] Build of generation {self.generation} failed: {e}")
+            self.status, self.error = "failed", str(e)
+            try:
+                self.client.registry.end_build(self.name, self.generation, "failed")
+                client.delete_collection(self.target_name)
+            except Exception as cleanup_error:
+                logger.error(f"[{self.name}] Dropping failed generation {self.generation}: {cleanup_error}")
+        finally:
+            self.finished_at = time.time()
+
+    def _copy(self, source, target, ids: List[str], metadatas: List[Any], documents: List[Any], embeddings: List[Any]):
+        """ Add the records of one page that the target does not have yet (written meanwhile) and that were not deleted. """
+        with self._deleted_lock:
+            keep = [i for i, doc_id in enumerate(ids) if doc_id not in self._deleted]
+        existing = set(target.get(ids=[ids[i] for i in keep], include=[])["ids"]) if keep else set()
+        keep = [i for i in keep if ids[i] not in existing]
+        if keep:
+            if self.reembed:
+                # Records without a document cannot be re-embedded; they keep their stored vector
+                texts = [i for i in keep if documents[i]]
+                vectors = dict(zip(texts, get_embedding_model().encode([documents[i] for i in texts]).tolist())) if texts else {}
+                missing = [i for i in keep if i not in vectors]
+                if missing:
+                    stored = source.get(ids=[ids[i] for i in missing], include=['embeddings'])
+                    vectors.update(zip(missing, _column(stored, "embeddings", len(missing))))
+                embeddings = [vectors.get(i) for i in range(len(ids))]
+            target.add(ids=[ids[i] for i in keep], embeddings=[np.asarray(embeddings[i], dtype='float32').tolist() for i in keep],
+                       metadatas=[metadatas[i] for i in keep], documents=[documents[i] for i in keep])
+        self.processed += len(ids)
+
+class DualWriteCollection:
+    """
+    The active generation of a collection with its writes mirrored into the generation being built, so the new
+    generation misses nothing written during the build. Reads are served by the active generation alone.
+    Deletes by filter are resolved to ids on the active generation first; clear() is refused during a build.
+    """
+    def __init__(self, active, building, build: Optional[GenerationBuild] = None):
+        self._active = active
+        self._building = building
+        self._build = build
+
+    def __getattr__(self, attr):
+        return getattr(self._active, attr)
+
+    def _mirror(self, method: str, *args, **kwargs):
+        result = getattr(self._active, method)(*args, **kwargs)
+        try:
+            getattr(self._building, method)(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Mirroring {method} into generation '{self._building.name}' failed: {e}")
+        return result
+
+    def add(self, *args, **kwargs):
+        return self._mirror("add", *args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return self._mirror("upsert", *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._mirror("update", *args, **kwargs)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, where_document: Optional[Dict[str, Any]] = None):
+        if where or where_document:
+            # The build must know which records went, or its page copy would bring them back
+            ids = self._active.get(ids=ids, where=where or None, where_document=where_document or None, include=[])["ids"]
+            if not ids:
+                return []
+        if self._build is not None and ids:
+            self._build.record_deletes(ids)
+        return self._mirror("delete", ids=ids)
+
+    def clear(self, *args, **kwargs):
+        raise ValueError(f"Collection '{self._active.name}' has a generation being built ('{self._building.name}'); "
+                         "discard it, or let it finish, before clearing the collection.")
+
+def unwrap_collection(collection):
+    """ The collection a DualWriteCollection serves reads from; any other collection as it is. """
+    return collection._active if isinstance(collection, DualWriteCollection) else collection
+
+def serving_key(client, name: str) -> Any:
+    """
+    Identifies what serves collection name through client. It changes when the collection is switched to another
+    generation, rolled back or deleted, so a caller caching the collection (or a pipeline built on it) fetches it again.
+    """
+    return client.serving_key(name) if isinstance(client, AliasedVectorDBClient) else name
+
+class AliasedVectorDBClient:
+    """
+    Vector DB client (ChromaDB, FAISS or the FAISS index server's) serving every collection from its active
+    generation, so a collection can be rebuilt beside the live one and switched to, or back, atomically.
+    Collections are looked up by name as before; while a generation is being built, collections returned by
+    get_collection / get_or_create_collection mirror their writes into it. Listings show the active generation
+    of each collection under its name. Everything else passes through to the client.
+    """
+    def __init__(self, client, registry: GenerationRegistry):
+        self.raw_client = client
+        self.registry = registry
+        # Build jobs by collection name; the latest job of each collection is kept for its status
+        self._builds: Dict[str, GenerationBuild] = {}
+        self._builds_lock = threading.Lock()
+        # Activations, rollbacks and deletes made through this client, by collection name (see serving_key)
+        self._switches: Dict[str, int] = {}
+
+    def __getattr__(self, attr):
+        return getattr(self.raw_client, attr)
+
+    def _with_build(self, name: str, collection):
+        building = self.registry.building(name)
+        if collection is None or building is None:
+            return collection
+        return DualWriteCollection(collection, self.raw_client.get_or_create_collection(building), self._builds.get(name))
+
+    def serving_key(self, name: str) -> Tuple[str, int]:
+        """ The stored collection serving name, and how often it was switched or deleted through this client. """
+        return self.registry.resolve(name), self._switches.get(name, 0)
+
+    def _switched(self, name: str):
+        with self._builds_lock:
+            self._switches[name] = self._switches.get(name, 0) + 1
+
+    def get_collection(self, name: str, *args, **kwargs):
+        return self._with_build(name, self.raw_client.get_collection(self.registry.resolve(name), *args, **kwargs))
+
+    def get_or_create_collection(self, name: str, *args, **kwargs):
+        return self._with_build(name, self.raw_client.get_or_create_collection(self.registry.resolve(name), *args, **kwargs))
+
+    def create_collection(self, name: str, *args, **kwargs):
+        return self.raw_client.create_collection(self.registry.resolve(name), *args, **kwargs)
+
+    def delete_collection(self, name: str):
+        """ Delete every generation of a collection. """
+        with self._builds_lock:
+            job = self._builds.pop(name, None)
+        if job is not None:
+            job.cancel()
+        active = self.registry.resolve(name)
+        self._switched(name)
+        for stored_name in self.registry.forget(name):
+            if stored_name == active:
+                self.raw_client.delete_collection(stored_name)
+            else:
+                self._drop(stored_name)
+
+    def _drop(self, stored_name: str):
+        try:
+            self.raw_client.delete_collection(stored_name)
+        except Exception as e:
+            logger.warning(f"Could not delete collection '{stored_name}': {e}")
+
+    # FAISS collection jobs address the stored collection of the active generation
+    def reindex_collection(self, name: str, *args, **kwargs):
+        return self.raw_client.reindex_collection(self.registry.resolve(name), *args, **kwargs)
+
+    def rebuild_collection(self, name: str, *args, **kwargs):
+        return self.raw_client.rebuild_collection(self.registry.resolve(name), *args, **kwargs)
+
+    def reindex_status(self, name: str):
+        return self.raw_client.reindex_status(self.registry.resolve(name))
+
+    def _by_collection_name(self, items: List[Any]) -> List[Any]:
+        """ A listing with each active generation under its collection's name and other generations left out. """
+        generations = self.registry.generations()
+        listed = []
+        for item in items:
+            key = ("name" if "name" in item else "collection_name") if isinstance(item, dict) else None
+            stored_name = item[key] if key else getattr(item, "name", item)
+            if stored_name not in generations:
+                listed.append(item)
+                continue
+            name, active = generations[stored_name]
+            if active:
+                listed.append({**item, key: name} if key else name)
+        return listed
+
+    def list_collections(self, *args, **kwargs):
+        return self._by_collection_name(self.raw_client.list_collections(*args, **kwargs))
+
+    def collection_summaries(self):
+        return self._by_collection_name(self.raw_client.collection_summaries())
+
+    def collection_stats(self):
+        return self._by_collection_name(self.raw_client.collection_stats())
+
+    def get_collections_with_records(self):
+        return self._by_collection_name(self.raw_client.get_collections_with_records())
+
+    def build_generation(self, name: str, source: str = "copy", reembed: bool = False, activate: bool = True,
+                         metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Start a new generation of a collection while the active one keeps serving. "copy" fills it in the background
+        from the active generation (see GenerationBuild); "empty" creates it empty, to be filled by re-ingesting the
+        sources and activated with activate_generation. metadata sets the new collection's options (e.g. hnsw:space).
+        """
+        if source not in BUILD_SOURCES:
+            raise ValueError(f"Unknown generation source '{source}'. Expected one of {BUILD_SOURCES}.")
+        with self._builds_lock:
+            job = self._builds.get(name)
+            if job is not None and job.is_running():
+                raise ValueError(f"Generation {job.generation} of collection '{name}' is already being built.")
+            if source == "copy":
+                try:
+                    exists = self.raw_client.get_collection(self.registry.resolve(name)) is not None
+                except Exception:
+                    exists = False # Chroma raises for unknown collections
+                if not exists:
+                    raise KeyError(f"Collection '{name}' does not exist.")
+            generation = self.registry.begin_build(name, source)
+            if source == "empty":
+                stored_name = generation_collection_name(name, generation)
+                if metadata:
+                    self.raw_client.get_or_create_collection(stored_name, metadata=metadata)
+                else:
+                    self.raw_client.get_or_create_collection(stored_name)
+                logger.info(f"[{name}] Generation {generation} created empty; writes to the collection are mirrored into it until it is activated.")
+                return self.generation_status(name)
+            job = GenerationBuild(self, name, generation, reembed=reembed, activate=activate, metadata=metadata)
+            self._builds[name] = job
+        job.start()
+        logger.info(f"[{name}] Building generation {generation} from '{job.source_name}'.")
+        return self.generation_status(name)
+
+    def activate_generation(self, name: str, generation: int) -> Dict[str, Any]:
+        """ Switch a collection to a built generation; the active one is kept as the previous generation for rollback. """
+        job = self._builds.get(name)
+        if job is not None and job.generation == generation and job.is_running():
+            raise ValueError(f"Generation {generation} of collection '{name}' is still being built.")
+        retired = self.registry.activate(name, generation)
+        self._switched(name)
+        for stored_name in retired:
+            self._drop(stored_name)
+        logger.info(f"[{name}] Generation {generation} is now active.")
+        return self.generation_status(name)
+
+    def rollback_generation(self, name: str) -> Dict[str, Any]:
+        """ Switch a collection back to its previous generation. """
+        generation = self.registry.rollback(name)
+        self._switched(name)
+        logger.info(f"[{name}] Rolled back to generation {generation}.")
+        return self.generation_status(name)
+
+    def discard_generation(self, name: str, generation: int) -> Dict[str, Any]:
+        """ Delete a generation that is not active, cancelling its build if one is running. """
+        job = self._builds.get(name)
+        if job is not None and job.generation == generation:
+            job.cancel()
+            job.wait(30)
+        self._drop(self.registry.discard(name, generation))
+        logger.info(f"[{name}] Generation {generation} discarded.")
+        return self.generation_status(name)
+
+    def generation_status(self, name: str) -> Dict[str, Any]:
+        """ The collection's generations (active, previous, being built) and its latest build job. """
+        job = self._builds.get(name)
+        return {"collection_name": name, **self.registry.state(name), "build": job.to_dict() if job is not None else None}
@@ -6,13 +6,14 @@ import os
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 from app.services.chroma_client import get_vector_db_client
+from app.services.collection_generations import serving_key
 from app.services.embedding_service import get_embedding_model
 from app.utils.rag_utils import load_components, create_bm25_index, create_retrievers, create_rag_pipeline, index_vector_data
 from app.utils.similarity import compute_similarity_score, compute_text_similarity_score
 from app.utils.llm_augmentation import llm_summarize
 from app.models.models import ConfluencePage
 from app.utils.dspy_utils import get_openrouter_llm
-from app.services.faiss_client import FaissCollection # Add this import if not already present
+from app.services.faiss_client import is_faiss_collection
 
 logger = logging.getLogger(__name__)
 
@@ -39,13 +40,16 @@ def log_search_failure(error):
 # --- LOGGING INSTRUMENTATION END ---
 
 
-# Cache pipeline at module level to avoid reloading every call
+# Cache pipeline at module level to avoid reloading every call; it is rebuilt once the collection
+# is served by another generation (see collection_generations.serving_key)
 _rag_pipeline = None
 _corpus = None
+_pipeline_key = None
 
 def _get_rag_pipeline(use_llm: bool = False):
-    global _rag_pipeline, _corpus
-    if _rag_pipeline is not None:
+    global _rag_pipeline, _corpus, _pipeline_key
+    key = serving_key(get_vector_db_client(), COLLECTION_NAME)
+    if _rag_pipeline is not None and _pipeline_key == key:
         return _rag_pipeline
     from app.core.config import settings
     client = get_vector_db_client()
@@ -54,9 +58,10 @@ def _get_rag_pipeline(use_llm: bool = False):
     _corpus = all_docs_result.get("documents", [])
 
     # Determine db_type and db_path based on collection type
-    if isinstance(collection, FaissCollection):
+    if is_faiss_collection(collection):
         db_type = 'faiss'
-        db_path = os.path.dirname(collection.index_path) if collection.index_path else None
+        index_path = getattr(collection, 'index_path', None)
+        db_path = os.path.dirname(index_path) if index_path else None
         logger.info(f"Detected FAISS collection. Type: {db_type}, Path: {db_path}")
     elif hasattr(collection, '_client'):
         db_type = 'chroma'
@@ -86,6 +91,7 @@ def _get_rag_pipeline(use_llm: bool = False):
     bm25_processor = create_bm25_index(_corpus)
     vector_retriever, bm25_retriever = create_retrievers(collection, embedder, bm25_processor, _corpus)
     _rag_pipeline = create_rag_pipeline(vector_retriever, bm25_retriever, reranker, llm)
+    _pipeline_key = key
     return _rag_pipeline
 
 def fetch_confluence_content(confluence_url: str) -> Optional[dict]:
@@ -194,15 +200,17 @@ def add_confluence_page_to_vectordb(
         log_ingest_failure(e)
         return None
 
-def confluence_search(query_text: str, limit: int = 10, use_llm: bool = False) -> List[Dict[str, Any]]:
+def confluence_search(query_text: str, limit: int = 10, use_llm: bool = False, exact_phrase: bool = False, full_history: bool = False) -> List[Dict[str, Any]]:
     """
     Hybrid RAG search for Confluence pages.
     Returns fused, reranked, and LLM-augmented results.
+    With exact_phrase=True only pages containing the query text itself are returned (e.g. an error string).
+    With full_history=True a tiered collection searches its older (cold) pages too.
     """
     log_search_start(query_text, limit)
     try:
         rag_pipeline = _get_rag_pipeline(use_llm=use_llm)
-        rag_result = rag_pipeline.forward(query_text, use_llm=use_llm)
+        rag_result = rag_pipeline.forward(query_text, use_llm=use_llm, exact_phrase=exact_phrase, full_history=full_history)
         formatted = []
         for idx, context in enumerate(rag_result.context):
             # Prioritize score directly from RAG context if available
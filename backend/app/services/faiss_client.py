@@ -1,88 +1,351 @@
 import faiss
 import numpy as np
 import os
+import time
 import logging
-import pickle
-from typing import List, Tuple, Optional, Dict, Any
+import threading
+from typing import List, Tuple, Optional, Dict, Any, Mapping
 from app.core.config import settings
 from app.services.embedding_service import get_embedding_model
+from app.services.faiss_index_factory import (
+    EXACT_FILTER_MAX_CANDIDATES, INDEX_CONFIG_FILENAME, FaissIndexConfig, build_exclusion_selector, build_id_selector, build_index,
+    exact_search_subset, extract_vectors, index_kind, load_index_config, prepare_vectors, range_search_top_k, read_index, reconstruct_ids,
+    sample_vectors, save_index_config, search_parameters, storage_kind, to_distances, to_search_radius, write_index_atomic
+)
+from app.services.faiss_metadata_store import (
+    LEGACY_METADATA_FILENAME, METADATA_DB_FILENAME, FaissMetadataStore, StoreFieldView
+)
+from app.services.faiss_wal import OP_ADD, WAL_FILENAME, IndexWriteAheadLog
+from app.services.faiss_vector_store import VECTORS_FILENAME, FullPrecisionVectorStore
+from app.services.faiss_rwlock import ReadWriteLock
+from app.services.faiss_manifest import MANIFEST_FILENAME, CollectionManifest, current_model_name, load_manifest, save_manifest
+from app.services.faiss_filters import MetadataIndex, matches_where, matches_where_document
+from app.services.faiss_idmap import CompactIdMap
+from app.services.faiss_trigram import TrigramIndex
+from app.services.faiss_embedding_archive import EmbeddingArchive, embed_documents
+from app.services.faiss_reindex import ReindexJob, recover_interrupted_reindex
+from app.services.faiss_optimizer import TRAINED_ON_INFO_KEY, IndexOptimizer, ivf_of
+from app.services.collection_generations import unwrap_collection
 
 logger = logging.getLogger(__name__)
 
 class FaissCollection:
     """ Represents a single collection within the FAISS client. """
-    def __init__(self, name: str, index_path: str, metadata_path: str, dimension: int):
+    def __init__(self, name: str, index_path: str, metadata_path: str, dimension: int, index_config: Optional[FaissIndexConfig] = None,
+                 read_only: Optional[bool] = None, use_mmap: Optional[bool] = None):
         self.name = name
         self.index_path = index_path
         self.metadata_path = metadata_path
         self.dimension = dimension
+        self.collection_path = os.path.dirname(index_path)
+        # Read-only collections serve queries from the files written by another (writer) process
+        self.read_only = settings.FAISS_READ_ONLY if read_only is None else read_only
+        self.use_mmap = settings.FAISS_MMAP if use_mmap is None else use_mmap
+        self._mmapped = False
+        self._loaded_state = None
+        self._last_refresh_check = time.monotonic()
+        self.index_config = self._resolve_index_config(index_config)
         self.index = None
-        self.metadata_store: Dict[str, Dict[str, Any]] = {}
-        self.doc_store: Dict[str, str] = {}
-        self.faiss_id_to_doc_id: Dict[int, str] = {}
-        self.doc_id_to_faiss_id: Dict[str, int] = {}
+        # Metadata and documents live in the SQLite sidecar; the views keep dict-style read access
+        self.store = FaissMetadataStore(metadata_path, read_only=self.read_only)
+        self.metadata_store = StoreFieldView(self.store, "metadata")
+        self.doc_store = StoreFieldView(self.store, "document")
+        # Index mutations are logged here and folded into index.faiss at checkpoints
+        self.wal = IndexWriteAheadLog(os.path.join(self.collection_path, WAL_FILENAME), fsync=settings.FAISS_WAL_FSYNC)
+        self._last_checkpoint = time.monotonic()
+        # Full-precision vectors on disk, kept for quantized collections to rescore candidates exactly
+        self.vector_store = FullPrecisionVectorStore(os.path.join(self.collection_path, VECTORS_FILENAME), dimension)
+        # Doc id <-> internal id map in NumPy arrays; faiss_id_to_doc_id / doc_id_to_faiss_id are dict-style views of it
+        self.id_map = CompactIdMap()
+        # Columnar indexes on selected metadata keys, so get(where=...) does not scan every record
+        self.metadata_index = MetadataIndex(self.index_config.metadata_index_keys, self.id_map)
+        # Trigram index for where_document $contains / $phrase, built from the store on the first such filter
+        self.trigram_index: Optional[TrigramIndex] = None
+        self._trigram_lock = threading.Lock()
         self.next_internal_id: int = 0
+        # Deleted or superseded vectors stay in the index as tombstones until compaction rebuilds it
+        self._tombstones: set = set()
+        self._tombstone_selector = None
+        # Queries and gets share the read lock; mutations, checkpoints and index swaps take the write lock,
+        # so readers always see the index, id maps and tombstones of one consistent version
+        self._lock = ReadWriteLock()
+        self._index_generation = 0 # Bumped whenever the index object is replaced, so a stale compaction is dropped
+        self._compacting = False
+        self._compaction_delta: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._compactions = 0
+        self._direct_map_lock = threading.Lock()
+        self._last_compaction: Optional[Dict[str, Any]] = None
+        self.manifest: Optional[CollectionManifest] = load_manifest(self.collection_path)
+        # Embeddings as written, from which the index is rebuilt in any layout; only the writer process keeps it
+        self.embedding_archive: Optional[EmbeddingArchive] = None
+        # Retrains IVF centroids in the background as the collection outgrows them
+        self.optimizer = IndexOptimizer(self)
         self._load()
+        self._open_embedding_archive()
+        self._apply_index_config()
+        self._write_manifest(if_changed=True)
+
+    def _resolve_index_config(self, requested: Optional[FaissIndexConfig]) -> FaissIndexConfig:
+        """ Pick the index config: explicit request, then persisted config, then settings defaults. """
+        persisted = load_index_config(self.collection_path)
+        self._persisted_metric = persisted.metric if persisted else None
+        config = requested or persisted or FaissIndexConfig.from_settings()
+        if config != persisted and not self.read_only:
+            save_index_config(self.collection_path, config)
+        return config
+
+    def _open_embedding_archive(self):
+        if not settings.FAISS_EMBEDDING_ARCHIVE or self.read_only:
+            return
+        model_name = self.manifest.model_name if self.manifest and self.manifest.model_name else current_model_name()
+        self.embedding_archive = EmbeddingArchive(self.collection_path, self.dimension, settings.FAISS_EMBEDDING_ARCHIVE_DTYPE, model_name)
+        if not len(self.id_map) and len(self.embedding_archive):
+            self.embedding_archive.clear() # Left over from records that were reset; their internal ids will be handed out again
+
+    def _new_index(self, training_vectors: Optional[np.ndarray] = None):
+        return build_index(self.index_config, self.dimension, training_vectors)
+
+    def _apply_index_config(self):
+        """ Rebuild the loaded index if its layout or metric does not match the configured ones. """
+        if self.index is None:
+            return
+        current = index_kind(self.index)
+        metric_changed = (self.index.metric_type != self.index_config.faiss_metric
+                          or self._persisted_metric not in (None, self.index_config.metric))
+        storage_changed = storage_kind(self.index) != self.index_config.storage
+        if current == self.index_config.index_type and not metric_changed and not storage_changed:
+            return
+        if (not metric_changed and not storage_changed and current == "flat"
+                and self.index_config.requires_training and not self._needs_training()):
+            return # Still collecting vectors in the flat staging index
+        if self.read_only:
+            logger.warning(f"[{self.name}] Index type differs from the config ({current} vs {self.index_config.index_type}); the writer process rebuilds it.")
+            return
+        logger.info(f"[{self.name}] Index layout changed ({current} -> {self.index_config.index_type}, metric {self.index_config.metric}, storage {self.index_config.storage}). Rebuilding.")
+        if metric_changed and self._persisted_metric == "cosine" and self.embedding_archive is None:
+            logger.warning(f"[{self.name}] Vectors were stored normalized for cosine; their original norms cannot be restored.")
+        self._rebuild_index(exact=True)
+        self._persisted_metric = self.index_config.metric
+
+    def _write_manifest(self, if_changed: bool = False):
+        """ Refresh manifest.json after a write, so FaissClient can list this collection without loading it. """
+        if self.read_only:
+            return
+        previous = self.manifest
+        manifest = CollectionManifest(
+            name=self.name,
+            dimension=self.dimension,
+            count=self.count(),
+            index_type=self.index_config.index_type,
+            metric=self.index_config.metric,
+            storage=self.index_config.storage,
+            model_name=previous.model_name if previous and previous.model_name else current_model_name(),
+            version=previous.version if previous else 0,
+        )
+        if if_changed and previous is not None and manifest.model_dump(exclude={"updated_at"}) == previous.model_dump(exclude={"updated_at"}):
+            return
+        manifest.version += 1
+        save_manifest(self.collection_path, manifest)
+        self.manifest = manifest
+
+    def _needs_training(self) -> bool:
+        """ True once an IVF collection still served by its flat staging index has enough vectors to train on. """
+        return (self.index_config.requires_training
+                and index_kind(self.index) == "flat"
+                and self.index.ntotal >= self.index_config.min_train_size)
+
+    def _rebuild_index(self, exact: bool = False):
+        """
+        Re-create the index with the configured type and storage, training on a sample of the stored vectors.
+        Quantized indexes are rebuilt from the full-precision vector store, not from their lossy codes.
+        With exact=True the vectors come from the embedding archive as they were written (see _live_vectors).
+        Tombstoned vectors are dropped.
+        """
+        self._ensure_writable()
+        vectors, ids = self._live_vectors(exact=exact)
+        training_vectors = None
+        if len(vectors) and (not self.index_config.requires_training or len(vectors) >= self.index_config.min_train_size):
+            training_vectors = sample_vectors(vectors, self.index_config.train_sample_size)
+        previous_index = self.index
+        self.index = self._new_index(training_vectors)
+        try:
+            if len(ids):
+                self._add_to_index(vectors, ids)
+        except Exception:
+            self.index = previous_index
+            raise
+        self._index_generation += 1
+        self._set_tombstones(set())
+        if ivf_of(self.index) is not None:
+            self.store.set_info(TRAINED_ON_INFO_KEY, len(ids))
+        logger.info(f"[{self.name}] Rebuilt FAISS index as {index_kind(self.index)}/{storage_kind(self.index)} ({self.index.ntotal} vectors).")
+        self._save()
+        self._write_manifest()
+
+    def _live_vectors(self, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Prepared vectors and internal ids of the non-tombstoned entries of the index.
+        With exact=True, and always for ivf_pq (whose codes only decode to approximations), the vectors are read from
+        the embedding archive, before normalization or quantization; the index's own copies are the fallback when
+        the archive does not hold every live vector (e.g. records written before it existed).
+        """
+        if self.embedding_archive is not None and (exact or index_kind(self.index) == "ivf_pq"):
+            ids = self._live_ids()
+            vectors, found = self.embedding_archive.get(self.id_map.doc_ids_for(ids), ids)
+            if found.all():
+                return prepare_vectors(self.index_config, vectors), ids
+            logger.warning(f"[{self.name}] {int((~found).sum())} of {len(ids)} vectors are not in the embedding archive; using the index's copies.")
+        if storage_kind(self.index) == "float32":
+            vectors, ids = extract_vectors(self.index)
+        else:
+            ids = faiss.vector_to_array(self.index.id_map).astype('int64')
+            vectors = None
+        if self._tombstones:
+            live = ~np.isin(ids, np.fromiter(self._tombstones, dtype='int64', count=len(self._tombstones)))
+            ids = ids[live]
+            vectors = vectors[live] if vectors is not None else None
+        if vectors is None:
+            vectors = self.vector_store.read(ids)
+        return prepare_vectors(self.index_config, vectors), ids
+
+    def _live_ids(self) -> np.ndarray:
+        """ Internal ids of the non-tombstoned entries of the index. """
+        ids = faiss.vector_to_array(self.index.id_map).astype('int64')
+        if self._tombstones:
+            ids = ids[~np.isin(ids, np.fromiter(self._tombstones, dtype='int64', count=len(self._tombstones)))]
+        return ids
+
+    def _vectors_of(self, internal_ids: np.ndarray) -> np.ndarray:
+        """
+        Prepared vectors of ids taken earlier from _live_ids, read while the index generation is still the one they
+        were taken in (deletes only tombstone, so they all remain in the index). Runs under the read lock;
+        ivf_pq reads the embedding archive, like _live_vectors, when it holds every one of them.
+        """
+        if self.embedding_archive is not None and index_kind(self.index) == "ivf_pq":
+            vectors, found = self.embedding_archive.get(self.id_map.doc_ids_for(internal_ids), internal_ids)
+            if found.all():
+                return prepare_vectors(self.index_config, vectors)
+        return prepare_vectors(self.index_config, self._stored_vectors(internal_ids))
+
+    def _add_to_index(self, vectors: np.ndarray, ids: np.ndarray):
+        """ Add prepared vectors to the index (training int8 storage on first use) and to the full-precision store. """
+        if not self.index.is_trained:
+            self.index.train(vectors)
+        self.index.add_with_ids(vectors, ids)
+        if self.index_config.quantized:
+            self.vector_store.write(ids, vectors)
+        if self._compaction_delta is not None:
+            self._compaction_delta.append((vectors, ids)) # Re-applied to the compacted index before it is swapped in
+
+    def _set_tombstones(self, tombstones: set):
+        self._tombstones = tombstones
+        self._tombstone_selector = None
+
+    def _derive_tombstones(self) -> set:
+        """ Internal ids in the index without a record in the store: deleted or superseded, not yet compacted away. """
+        if self.index is None or self.index.ntotal == 0:
+            return set()
+        indexed = faiss.vector_to_array(self.index.id_map)
+        return set(indexed[~np.isin(indexed, self.id_map.internal_ids())].tolist())
 
     def _load(self):
         """ Load index and metadata from disk. """
         loaded_index = False
+        self._loaded_state = self._disk_state()
+        self._index_generation += 1
+        self._mmapped = False
+        self.trigram_index = None
         if os.path.exists(self.index_path):
             try:
-                self.index = faiss.read_index(self.index_path)
+                # Map the file instead of copying it, unless logged mutations have to be replayed on top of it
+                mmapped = self.use_mmap and self.wal.size_bytes == 0
+                self.index = read_index(self.index_path, mmap=mmapped)
+                self._mmapped = mmapped
                 if not isinstance(self.index, faiss.IndexIDMap):
                      logger.warning(f"Loaded index for {self.name} is not IndexIDMap. Re-initializing.")
                      self.index = None # Force reinitialization
-                elif self.index.d != self.dimension:
-                    logger.warning(f"Index dimension mismatch for {self.name} (loaded {self.index.d}, expected {self.dimension}). Re-initializing.")
-                    self.index = None # Force reinitialization
                 else:
-                    logger.info(f"Loaded FAISS index for collection '{self.name}' from {self.index_path} ({self.index.ntotal} vectors)")
+                    if self.index.d != self.dimension:
+                        # Typically an embedding model change: keep the stored vectors rather than dropping the collection
+                        logger.warning(f"Index dimension mismatch for {self.name} (loaded {self.index.d}, expected {self.dimension}). "
+                                       f"Keeping the stored vectors; reindex the collection to re-embed it with the configured model.")
+                        self.dimension = self.index.d
+                        self.vector_store = FullPrecisionVectorStore(self.vector_store.path, self.dimension)
+                    logger.info(f"Loaded FAISS index for collection '{self.name}' from {self.index_path} ({self.index.ntotal} vectors{', memory-mapped' if mmapped else ''})")
                     loaded_index = True
+                    self._replay_wal()
             except Exception as e:
                 logger.error(f"Error loading FAISS index for {self.name} from {self.index_path}: {e}. Re-initializing.")
                 self.index = None
         else:
             # Only create a new index if the file does not exist
-            logger.info(f"Index file {self.index_path} does not exist. Creating new FAISS index.")
+            logger.info(f"Index file {self.index_path} does not exist. Creating new FAISS index ({self.index_config.index_type}).")
             try:
-                base_index = faiss.IndexFlatL2(self.dimension)
-                self.index = faiss.IndexIDMap(base_index)
+                self.index = self._new_index()
                 loaded_index = True
+                # A new collection may have logged mutations before its first checkpoint
+                self._replay_wal()
             except Exception as e:
                 logger.error(f"Error creating new FAISS index for {self.name}: {e}")
                 self.index = None
-        if os.path.exists(self.metadata_path):
-            try:
-                with open(self.metadata_path, 'rb') as f:
-                    saved_data = pickle.load(f)
-                    self.metadata_store = saved_data.get('metadata', {})
-                    self.doc_store = saved_data.get('documents', {})
-                    self.faiss_id_to_doc_id = saved_data.get('faiss_map', {})
-                    self.doc_id_to_faiss_id = {v: k for k, v in self.faiss_id_to_doc_id.items()} # Rebuild reverse map
-                    self.next_internal_id = saved_data.get('next_id', 0)
-                logger.info(f"Loaded metadata for collection '{self.name}' from {self.metadata_path}. Next ID: {self.next_internal_id}")
-                if not loaded_index:
-                     logger.warning(f"Index loading failed for {self.name}, resetting metadata.")
-                     self._reset_stores()
-            except Exception as e:
-                logger.error(f"Error loading metadata for {self.name} from {self.metadata_path}: {e}. Resetting metadata.")
-                self._reset_stores()
-                if loaded_index:
-                     logger.warning("Metadata loading failed but index loaded. Index will be reset.")
-                     self.index = None # Reset index too if metadata failed
+        try:
+            # One-time import of the pickle written by older versions
+            if not self.read_only:
+                self.store.migrate_from_pickle(os.path.join(self.collection_path, LEGACY_METADATA_FILENAME))
+            self.id_map.load(self.store.id_pairs())
+            stored_next_id = int(self.store.get_info("next_id", "0"))
+            self.next_internal_id = max(stored_next_id, self.id_map.max_internal_id() + 1)
+            logger.info(f"Loaded id map for collection '{self.name}' from {self.metadata_path} ({len(self.id_map)} records). Next ID: {self.next_internal_id}")
+            self._build_metadata_index()
+            self._set_tombstones(self._derive_tombstones())
+            if self._tombstones:
+                logger.info(f"[{self.name}] {len(self._tombstones)} tombstoned vectors are excluded from searches until compaction.")
+            if not loaded_index and len(self.id_map):
+                 logger.warning(f"Index loading failed for {self.name}, resetting metadata.")
+                 self._reset_stores()
+        except Exception as e:
+            logger.error(f"Error loading metadata for {self.name} from {self.metadata_path}: {e}. Resetting metadata.")
+            self._reset_stores()
+            if loaded_index:
+                 logger.warning("Metadata loading failed but index loaded. Index will be reset.")
+                 self.index = None # Reset index too if metadata failed
         if self.index is None:
-            logger.info(f"Creating new FAISS index (IndexFlatL2 + IndexIDMap) for collection '{self.name}' with dimension {self.dimension}.")
+            logger.info(f"Creating new FAISS index ({self.index_config.index_type}) for collection '{self.name}' with dimension {self.dimension}.")
             try:
-                base_index = faiss.IndexFlatL2(self.dimension)
-                self.index = faiss.IndexIDMap(base_index)
+                self.index = self._new_index()
             except Exception as e:
                 logger.error(f"Error creating new FAISS index for {self.name} during fallback: {e}")
                 self.index = None
             self._reset_stores()
+            self._set_tombstones(set())
+            if not self.read_only:
+                self.wal.reset()
+
+    def _replay_wal(self):
+        """
+        Re-apply index mutations logged since the last checkpoint. Replay is idempotent: ids already in the index are skipped.
+        Logged removals need no work: their records are gone from the store, so _load derives them as tombstones.
+        """
+        existing_ids = None
+        replayed = 0
+        for op, ids, vectors in self.wal.replay(truncate_tail=not self.read_only):
+            if op == OP_ADD:
+                if existing_ids is None:
+                    existing_ids = set(faiss.vector_to_array(self.index.id_map).tolist())
+                mask = np.array([internal_id not in existing_ids for internal_id in ids.tolist()], dtype=bool)
+                if mask.any():
+                    self._add_to_index(vectors[mask], ids[mask])
+                    existing_ids.update(ids[mask].tolist())
+            replayed += len(ids)
+        if replayed:
+            logger.info(f"[{self.name}] Replayed {self.wal.record_count} write-ahead log records ({replayed} ids). Index size: {self.index.ntotal}")
 
     def _save(self):
-        """ Save index and metadata to disk. """
+        """
+        Checkpoint the index: atomically replace index.faiss and truncate the write-ahead log.
+        Metadata and documents are already persisted per record by the store.
+        """
         if self.index is None:
             logger.warning(f"Attempted to save FAISS index for {self.name}, but it's not initialized.")
             return
@@ -91,158 +354,482 @@ class FaissCollection:
             parent_dir = os.path.dirname(self.index_path)
             if not os.path.exists(parent_dir):
                 os.makedirs(parent_dir, exist_ok=True)
-            logger.info(f"Saving FAISS index for {self.name} to {self.index_path} ({self.index.ntotal} vectors)")
-            faiss.write_index(self.index, self.index_path)
-            logger.info(f"Saving metadata for {self.name} to {self.metadata_path}")
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump({
-                    'metadata': self.metadata_store,
-                    'documents': self.doc_store,
-                    'faiss_map': self.faiss_id_to_doc_id,
-                    'next_id': self.next_internal_id
-                }, f)
-            logger.info(f"FAISS index and metadata for {self.name} saved successfully.")
-        except FileExistsError as fee:
-            logger.warning(f"File already exists when saving FAISS index for {self.name}: {fee}. Overwriting.")
-            try:
-                faiss.write_index(self.index, self.index_path)
-            except Exception as e:
-                logger.error(f"Error overwriting FAISS index for {self.name}: {e}")
+            logger.info(f"Checkpointing FAISS index for {self.name} to {self.index_path} ({self.index.ntotal} vectors)")
+            self.vector_store.flush()
+            if self.embedding_archive is not None:
+                self.embedding_archive.flush()
+            write_index_atomic(self.index, self.index_path)
+            self.wal.reset()
+            self._last_checkpoint = time.monotonic()
+            logger.info(f"FAISS index for {self.name} saved successfully.")
         except Exception as e:
-            logger.error(f"Error saving FAISS index or metadata for {self.name}: {e}")
+            logger.error(f"Error saving FAISS index for {self.name}: {e}")
+
+    def _maybe_checkpoint(self):
+        """ Checkpoint once the write-ahead log grows past the configured size or age. """
+        if self.wal.record_count == 0:
+            return
+        if (self.wal.vector_count >= settings.FAISS_CHECKPOINT_MAX_VECTORS
+                or self.wal.size_bytes >= settings.FAISS_CHECKPOINT_MAX_BYTES
+                or time.monotonic() - self._last_checkpoint >= settings.FAISS_CHECKPOINT_INTERVAL_SECONDS):
+            self._save()
+
+    def checkpoint(self):
+        """ Fold all logged mutations into index.faiss now (e.g. before shutdown or a backup). """
+        with self._lock.write():
+            if self.wal.record_count and not self.read_only:
+                self._save()
+
+    def _disk_state(self) -> Tuple[Optional[int], int]:
+        """ (index.faiss mtime, write-ahead log size): changes whenever the writer checkpoints or logs a mutation. """
+        try:
+            index_mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            index_mtime = None
+        return index_mtime, self.wal.size_bytes
+
+    def _maybe_refresh(self):
+        """ Read-only collections reload when the writer process has changed the files on disk. """
+        if not self.read_only:
+            return
+        now = time.monotonic()
+        if now - self._last_refresh_check < settings.FAISS_READ_ONLY_REFRESH_SECONDS:
+            return
+        self._last_refresh_check = now
+        if self._disk_state() != self._loaded_state:
+            with self._lock.write():
+                if self._disk_state() != self._loaded_state:
+                    logger.info(f"[{self.name}] Index files changed on disk. Reloading read-only collection.")
+                    self._load()
+
+    def _ensure_writable(self):
+        """
+        Refuse writes in read-only mode, and swap a memory-mapped index for a private in-memory
+        copy before the first write (FAISS cannot mutate mapped arrays).
+        """
+        if self.read_only:
+            raise RuntimeError(f"[{self.name}] FAISS collection is opened read-only (FAISS_READ_ONLY); writes must go through the writer process.")
+        if self._mmapped:
+            logger.info(f"[{self.name}] Loading memory-mapped index into memory before the first write.")
+            self.index = read_index(self.index_path)
+            self._mmapped = False
+
+    def release_memory(self):
+        """
+        Checkpoint and map the index from disk again, dropping the private in-memory copy that the first write made
+        of a memory-mapped index (see _ensure_writable).
+        """
+        with self._lock.write():
+            if self.read_only or not self.use_mmap or self._mmapped or self._compacting:
+                return
+            self._save()
+            self._load()
+
+    def _build_metadata_index(self):
+        self.metadata_index.clear()
+        for doc_id, values in self.store.metadata_values(self.metadata_index.keys):
+            self.metadata_index.add_values(doc_id, values)
+        logger.debug(f"[{self.name}] Built metadata indexes: {self.metadata_index.stats()}")
 
     def _reset_stores(self):
-        self.metadata_store = {}
-        self.doc_store = {}
-        self.faiss_id_to_doc_id = {}
-        self.doc_id_to_faiss_id = {}
+        self.metadata_index.clear()
+        self.trigram_index = None
+        if not self.read_only: # A reader must never wipe the writer's records
+            self.store.clear()
+        if self.embedding_archive is not None:
+            self.embedding_archive.clear()
+        self.id_map.clear()
         self.next_internal_id = 0
 
     def add(self, ids: List[str], embeddings: List[List[float]], metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
-        if not ids or not embeddings:
+        """ Add new records. Ids that already exist are skipped, as in ChromaDB; use upsert() to replace them. """
+        if not ids or embeddings is None or len(embeddings) == 0:
             logger.warning(f"[{self.name}] Add called with empty ids or embeddings.")
             return
+        self._validate_batch(ids, embeddings, metadatas, documents)
+        with self._lock.write():
+            self._write_records(ids, embeddings, metadatas, documents, replace=False)
+
+    def upsert(self, ids: List[str], embeddings: Optional[List[List[float]]] = None, metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
+        """
+        Mimics ChromaDB's upsert: new ids are added, existing ids get their vector, metadata and document
+        replaced, all in one batch. Without embeddings the documents are embedded with the configured model,
+        except those whose text is already in the embedding archive.
+        Fields that are not passed keep their stored values for existing ids.
+        """
+        if not ids:
+            logger.warning(f"[{self.name}] Upsert called with empty ids.")
+            return
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"[{self.name}] Upsert ids must be unique.")
+        if embeddings is None and documents is not None:
+            embeddings = embed_documents(list(documents), [self.embedding_archive], lambda texts: get_embedding_model().encode(texts), current_model_name())
+        self._validate_batch(ids, embeddings, metadatas, documents)
+
+        with self._lock.write():
+            existing_ids = [doc_id for doc_id in ids if doc_id in self.doc_id_to_faiss_id]
+            if existing_ids and (metadatas is None or documents is None):
+                stored = self.store.fetch(existing_ids)
+                if metadatas is None:
+                    metadatas = [stored.get(doc_id, {}).get("metadata") for doc_id in ids]
+                if documents is None:
+                    documents = [stored.get(doc_id, {}).get("document") for doc_id in ids]
 
-        if len(ids) != len(embeddings):
+            if embeddings is None:
+                # Metadata-only update: vectors and internal ids stay as they are
+                new_ids = [doc_id for doc_id in ids if doc_id not in self.doc_id_to_faiss_id]
+                if new_ids:
+                    raise ValueError(f"[{self.name}] Embeddings or documents are required to upsert new ids: {new_ids[:5]}")
+                self._ensure_writable()
+                previous = self.store.fetch(ids, ("metadata",))
+                records = [(self.doc_id_to_faiss_id[doc_id], doc_id, metadatas[i] if metadatas else None, documents[i] if documents else None)
+                           for i, doc_id in enumerate(ids)]
+                self.store.add_records(records)
+                for _, doc_id, metadata, _ in records:
+                    self.metadata_index.remove(doc_id, previous.get(doc_id, {}).get("metadata"))
+                    self.metadata_index.add(doc_id, metadata)
+                logger.info(f"[{self.name}] Updated metadata of {len(records)} items.")
+                self._write_manifest()
+                return
+            self._write_records(ids, embeddings, metadatas, documents, replace=True)
+
+    def _validate_batch(self, ids: List[str], embeddings: Optional[List[List[float]]], metadatas: Optional[List[Dict]], documents: Optional[List[str]]):
+        if embeddings is not None and len(ids) != len(embeddings):
             raise ValueError(f"[{self.name}] Number of ids ({len(ids)}) and embeddings ({len(embeddings)}) must match.")
         if metadatas and len(ids) != len(metadatas):
             raise ValueError(f"[{self.name}] Number of ids ({len(ids)}) and metadatas ({len(metadatas)}) must match.")
         if documents and len(ids) != len(documents):
             raise ValueError(f"[{self.name}] Number of ids ({len(ids)}) and documents ({len(documents)}) must match.")
 
+    def _write_records(self, ids: List[str], embeddings: List[List[float]], metadatas: Optional[List[Dict]], documents: Optional[List[str]], replace: bool):
+        """
+        Insert vectors and records for ids. Existing ids are skipped, or with replace=True get a fresh
+        internal id whose vector and record supersede the old ones (old vector removed after the write).
+        """
         embeddings_np = np.array(embeddings).astype('float32')
         if embeddings_np.shape[1] != self.dimension:
             raise ValueError(f"[{self.name}] Embedding dimension mismatch: expected {self.dimension}, got {embeddings_np.shape[1]}")
+        self._ensure_writable()
 
         faiss_ids_to_add = []
         embeddings_to_add = []
         added_doc_ids = []
+        new_records = []
+        replaced: Dict[str, int] = {} # doc_id -> internal id of the superseded vector
 
         for i, doc_id in enumerate(ids):
-            if doc_id in self.doc_id_to_faiss_id:
-                logger.debug(f"[{self.name}] ID '{doc_id}' already exists. Skipping add.")
-                # TODO: Implement update logic if needed?
-                continue
+            previous_id = self.doc_id_to_faiss_id.get(doc_id)
+            if previous_id is not None:
+                if not replace:
+                    logger.debug(f"[{self.name}] ID '{doc_id}' already exists. Skipping add.")
+                    continue
+                replaced[doc_id] = previous_id
 
             internal_id = self.next_internal_id
             faiss_ids_to_add.append(internal_id)
             embeddings_to_add.append(embeddings_np[i])
 
-            self.doc_id_to_faiss_id[doc_id] = internal_id
-            self.faiss_id_to_doc_id[internal_id] = doc_id
-            if metadatas:
-                self.metadata_store[doc_id] = metadatas[i]
-            if documents:
-                self.doc_store[doc_id] = documents[i]
+            self.id_map.assign(doc_id, internal_id) # Also frees the superseded mapping
+            new_records.append((
+                internal_id,
+                doc_id,
+                metadatas[i] if metadatas else None,
+                documents[i] if documents else None,
+            ))
 
             added_doc_ids.append(doc_id)
             self.next_internal_id += 1
 
-        if embeddings_to_add:
-            embeddings_to_add_np = np.array(embeddings_to_add).astype('float32')
-            faiss_ids_to_add_np = np.array(faiss_ids_to_add).astype('int64')
+        if not embeddings_to_add:
+            return
+        previous_metadata = self.store.fetch(list(replaced), ("metadata",)) if replaced else {}
+        # Cosine collections store L2-normalized vectors
+        embeddings_to_add_np = prepare_vectors(self.index_config, embeddings_to_add)
+        faiss_ids_to_add_np = np.array(faiss_ids_to_add).astype('int64')
+        try:
+            self._add_to_index(embeddings_to_add_np, faiss_ids_to_add_np)
+            self.wal.append_add(faiss_ids_to_add_np, embeddings_to_add_np)
+            # INSERT OR REPLACE also drops the superseded rows, which share the doc_id
+            self.store.add_records(new_records, next_id=self.next_internal_id)
+        except Exception as e:
+            logger.error(f"[{self.name}] Error adding embeddings to FAISS index: {e}")
+            # Rollback metadata/doc changes for failed adds
+            for doc_id in added_doc_ids:
+                self.id_map.remove_doc(doc_id)
+                if doc_id in replaced:
+                    self.id_map.restore(doc_id, replaced[doc_id])
+            self.store.delete_records([doc_id for doc_id in added_doc_ids if doc_id not in replaced])
+            # Note: Rolling back next_internal_id is tricky if partial success occurred
+            raise # Re-raise the exception
+
+        for doc_id, row in previous_metadata.items():
+            self.metadata_index.remove(doc_id, row.get("metadata"))
+        for _, doc_id, metadata, _ in new_records:
+            self.metadata_index.add(doc_id, metadata)
+        self.id_map.maybe_compact()
+        if self.trigram_index is not None:
+            self.trigram_index.remove(replaced.values())
+            self.trigram_index.add((internal_id, document) for internal_id, _, _, document in new_records)
+        if self.embedding_archive is not None:
             try:
-                self.index.add_with_ids(embeddings_to_add_np, faiss_ids_to_add_np)
-                logger.info(f"[{self.name}] Added {len(added_doc_ids)} new items. Index size: {self.index.ntotal}")
+                self.embedding_archive.put(added_doc_ids, faiss_ids_to_add_np, np.array(embeddings_to_add),
+                                           [document for _, _, _, document in new_records])
+            except Exception as e: # The index and store are written; rebuilds fall back to the index's copies
+                logger.error(f"[{self.name}] Error archiving embeddings: {e}")
+        if replaced:
+            self._tombstone_vectors(np.array(list(replaced.values()), dtype='int64'))
+        logger.info(f"[{self.name}] Added {len(added_doc_ids) - len(replaced)} new and replaced {len(replaced)} items. Index size: {self.index.ntotal}")
+        self._write_manifest()
+        if self._needs_training():
+            logger.info(f"[{self.name}] Collection reached {self.index.ntotal} vectors. Training {self.index_config.index_type} index.")
+            self._rebuild_index()
+        else:
+            self._maybe_checkpoint()
+            self._maybe_compact()
+            self.optimizer.maybe_check()
+
+    def _tombstone_vectors(self, internal_ids: np.ndarray):
+        """
+        Mark vectors as deleted instead of removing them (remove_ids shifts the whole storage array of flat
+        and IVF indexes). Searches skip tombstones; compaction drops them. Metadata records are handled by the caller.
+        """
+        self._set_tombstones(self._tombstones | set(internal_ids.tolist()))
+        try:
+            # Logged so read-only processes notice the change; replay itself has nothing to undo
+            self.wal.append_remove(internal_ids)
+        except Exception as e:
+            logger.error(f"[{self.name}] Error logging removal of IDs from FAISS index: {e}")
+        logger.info(f"[{self.name}] Tombstoned {len(internal_ids)} items. Live: {self.count()}, tombstones: {len(self._tombstones)}")
+
+    def _tombstone_filter(self) -> Optional[faiss.IDSelector]:
+        """ Cached selector excluding all tombstones from a search, or None when there are none. """
+        if not self._tombstones:
+            return None
+        if self._tombstone_selector is None:
+            tombstones = np.fromiter(self._tombstones, dtype='int64', count=len(self._tombstones))
+            self._tombstone_selector = build_exclusion_selector(np.sort(tombstones), self.next_internal_id)
+        return self._tombstone_selector
+
+    def _maybe_compact(self):
+        """ Start a background compaction once tombstones pass the configured share of the index. """
+        if self._compacting or self.read_only or len(self._tombstones) < settings.FAISS_COMPACTION_MIN_TOMBSTONES:
+            return
+        if len(self._tombstones) / max(self.index.ntotal, 1) >= settings.FAISS_COMPACTION_TOMBSTONE_RATIO:
+            self.compact(background=True)
+
+    def compact(self, background: bool = False, retrain: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Rebuild the index without its tombstones. The new index is built from a snapshot outside the write lock,
+        so writes and queries continue meanwhile; adds made during the build are re-applied before the swap.
+        With retrain=True the new index is trained afresh on a sample of the live vectors (IVF centroids and
+        an nlist sized for the current count) instead of reusing the current training; see IndexOptimizer.
+        With background=True the work runs in a daemon thread and None is returned.
+        """
+        if background:
+            with self._lock.write():
+                self._ensure_writable()
+                if self._compacting:
+                    return None
+                self._compaction_thread = threading.Thread(target=self.compact, kwargs={"retrain": retrain}, name=f"faiss-compact-{self.name}", daemon=True)
+                self._compaction_thread.start()
+            return None
+        with self._lock.write():
+            self._ensure_writable()
+            if self._compacting:
+                return None
+            started = time.monotonic()
+            removed = len(self._tombstones)
+            generation = self._index_generation
+            vectors, ids = self._live_vectors()
+            new_index = None if retrain else self._empty_like_index()
+            self._compacting = True
+            self._compaction_delta = []
+        try:
+            if new_index is None:
+                new_index = self._new_index(sample_vectors(vectors, self.index_config.train_sample_size))
+            if len(ids):
+                new_index.add_with_ids(vectors, ids)
+            with self._lock.write():
+                if generation != self._index_generation:
+                    logger.info(f"[{self.name}] Index was replaced during compaction; dropping the compacted copy.")
+                    return None
+                for delta_vectors, delta_ids in self._compaction_delta:
+                    new_index.add_with_ids(delta_vectors, delta_ids)
+                self.index = new_index
+                self._index_generation += 1
+                # Only vectors deleted while the copy was being built are still tombstones
+                self._set_tombstones(self._derive_tombstones())
+                if retrain:
+                    self.store.set_info(TRAINED_ON_INFO_KEY, len(ids))
                 self._save()
-            except Exception as e:
-                logger.error(f"[{self.name}] Error adding embeddings to FAISS index: {e}")
-                # Rollback metadata/doc changes for failed adds
-                for doc_id in added_doc_ids:
-                    internal_id = self.doc_id_to_faiss_id.pop(doc_id, None)
-                    if internal_id is not None:
-                        self.faiss_id_to_doc_id.pop(internal_id, None)
-                    self.metadata_store.pop(doc_id, None)
-                    self.doc_store.pop(doc_id, None)
-                # Note: Rolling back next_internal_id is tricky if partial success occurred
-                raise # Re-raise the exception
-
-    def query(self, query_embeddings: List[List[float]], n_results: int = 10, include: List[str] = ['metadatas', 'documents', 'distances'], where: Optional[Dict] = None, where_document: Optional[Dict] = None) -> Dict[str, List[Any]]:
-        """ Query the collection. Mimics ChromaDB's return format. """
-        if self.index is None or self.index.ntotal == 0:
+                self._compactions += 1
+                self._last_compaction = {
+                    "finished_at": time.time(),
+                    "duration_seconds": round(time.monotonic() - started, 3),
+                    "removed": removed - len(self._tombstones),
+                    "vectors": self.index.ntotal,
+                    "retrained": retrain,
+                }
+                logger.info(f"[{self.name}] Compacted FAISS index: {self._last_compaction}")
+                result = self._last_compaction
+            if self.embedding_archive is not None:
+                self.embedding_archive.maybe_compact() # Outside the collection lock: it only holds the archive's own
+            return result
+        except Exception as e:
+            logger.error(f"[{self.name}] FAISS compaction failed: {e}")
+            raise
+        finally:
+            with self._lock.write():
+                self._compacting = False
+                self._compaction_delta = None
+
+    def _empty_like_index(self):
+        """ Empty index of the current layout. Trained indexes (IVF centroids, int8 ranges) keep their training. """
+        index = self._new_index()
+        if index.is_trained and index_kind(index) == index_kind(self.index):
+            return index
+        index = faiss.clone_index(self.index)
+        index.reset()
+        return index
+
+    def compaction_stats(self) -> Dict[str, Any]:
+        """ Tombstone and compaction counters for the collections admin API. """
+        with self._lock.read():
+            return self._compaction_stats()
+
+    def _compaction_stats(self) -> Dict[str, Any]:
+        vectors = self.index.ntotal if self.index is not None else 0
+        return {
+            "vectors": vectors,
+            "live": self.count(),
+            "tombstones": len(self._tombstones),
+            "tombstone_ratio": round(len(self._tombstones) / vectors, 4) if vectors else 0.0,
+            "compaction_threshold": settings.FAISS_COMPACTION_TOMBSTONE_RATIO,
+            "compacting": self._compacting,
+            "compactions": self._compactions,
+            "last_compaction": self._last_compaction,
+            "embedding_archive": self.embedding_archive.stats() if self.embedding_archive is not None else None,
+            "optimizer": self.optimizer.stats(),
+        }
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, include: List[str] = ['metadatas', 'documents', 'distances'], where: Optional[Dict] = None, where_document: Optional[Dict] = None, max_distance: Optional[float] = None, full_history: bool = False) -> Dict[str, List[Any]]:
+        """
+        Query the collection with one or more embeddings. Mimics ChromaDB's return format:
+        each result field holds one list per query embedding.
+        where / where_document are resolved to an ID selector and applied inside the FAISS search.
+        Runs under the read lock: concurrent queries proceed in parallel, writes wait for them.
+        include=['embeddings'] adds the stored vectors of the hits, one (k, dimension) array per query.
+        max_distance keeps only hits at most that (Chroma-style) distance away; it runs as a FAISS range_search,
+        so farther documents are never hydrated and a query may return fewer than n_results hits.
+        full_history only matters to tiered collections (see TieredFaissCollection); every record is searched here.
+        """
+        self._maybe_refresh()
+        self.optimizer.maybe_check()
+        with self._lock.read():
+            return self._query(query_embeddings, n_results, include, where, where_document, max_distance)
+
+    def _query(self, query_embeddings: List[List[float]], n_results: int, include: List[str], where: Optional[Dict], where_document: Optional[Dict], max_distance: Optional[float] = None) -> Dict[str, List[Any]]:
+        if self.index is None or self.count() == 0:
             logger.warning(f"[{self.name}] Query called on empty or uninitialized index.")
             # Return format consistent with ChromaDB for empty results
             return {'ids': [], 'distances': [], 'metadatas': [], 'documents': [], 'embeddings': []}
 
-        if not query_embeddings:
+        if len(query_embeddings) == 0:
              return {'ids': [], 'distances': [], 'metadatas': [], 'documents': [], 'embeddings': []}
 
-        # Currently, FAISS client doesn't support 'where' or 'where_document' filters during search.
-        # This would require iterating through all results and filtering afterwards, which is inefficient.
-        # For now, we log a warning if these filters are used.
-        if where or where_document:
-            logger.warning(f"[{self.name}] FAISS client currently does not support 'where' or 'where_document' filters during query. Filters ignored.")
-
-        query_embeddings_np = np.array(query_embeddings).astype('float32')
+        # All query embeddings are searched as one matrix in a single (multithreaded) FAISS call
+        query_embeddings_np = prepare_vectors(self.index_config, np.atleast_2d(np.array(query_embeddings, dtype='float32')))
         if query_embeddings_np.shape[1] != self.dimension:
             raise ValueError(f"[{self.name}] Query embedding dimension mismatch: expected {self.dimension}, got {query_embeddings_np.shape[1]}")
 
-        # FAISS search expects a single batch of queries
-        # We only process the first query embedding if multiple are provided, mimicking Chroma's typical single-query behavior
-        if query_embeddings_np.shape[0] > 1:
-            logger.warning(f"[{self.name}] Multiple query embeddings provided ({query_embeddings_np.shape[0]}), but FAISS client currently processes only the first one.")
-            query_embeddings_np = query_embeddings_np[0:1]
-
-        k = min(n_results, self.index.ntotal)
+        live_count = self.count()
+        k = min(n_results, live_count)
         if k <= 0:
             return {'ids': [], 'distances': [], 'metadatas': [], 'documents': [], 'embeddings': []}
 
-        # FAISS search returns distances (L2 squared) and internal IDs
-        all_distances, all_internal_ids = self.index.search(query_embeddings_np, k)
+        # Quantized collections fetch rescore_factor * k candidates from the compressed codes and rescore them exactly
+        rescore = storage_kind(self.index) != "float32"
+        search_k = min(live_count, k * self.index_config.rescore_factor) if rescore else k
+
+        # FAISS search returns raw scores (squared L2 or inner products) and internal IDs
+        all_distances = None
+        allowed_ids = None
+        if where or where_document:
+            # Resolve the filters to internal ids and let FAISS skip everything else during the search
+            allowed_ids = self._filtered_internal_ids(where, where_document)
+            k = min(k, len(allowed_ids))
+            search_k = min(search_k, len(allowed_ids))
+            if k == 0:
+                all_distances = np.zeros((len(query_embeddings_np), 0), dtype='float32')
+                all_internal_ids = np.zeros((len(query_embeddings_np), 0), dtype='int64')
+            elif index_kind(self.index) == "hnsw" and len(allowed_ids) <= EXACT_FILTER_MAX_CANDIDATES:
+                all_distances, all_internal_ids = exact_search_subset(self.index, query_embeddings_np, allowed_ids, search_k)
+            else:
+                selector = build_id_selector(allowed_ids, self.next_internal_id)
+                params = search_parameters(self.index_config, self.index, selectivity=len(allowed_ids) / self.index.ntotal, sel=selector)
+        elif self._tombstones:
+            # Deleted vectors are still in the index until compaction: exclude them inside the search
+            params = search_parameters(self.index_config, self.index, selectivity=live_count / self.index.ntotal, sel=self._tombstone_filter())
+        else:
+            params = search_parameters(self.index_config, self.index)
+        if all_distances is None:
+            if storage_kind(self.index) == "binary":
+                # IndexLSH takes no SearchParameters: filters and tombstones are applied to over-fetched candidates instead
+                all_distances, all_internal_ids = self._search_binary(query_embeddings_np, search_k, allowed_ids)
+            elif max_distance is not None and not rescore:
+                # Only vectors within the radius are collected; quantized scores are approximate, so those collections rescore first
+                radius = to_search_radius(self.index_config, max_distance)
+                all_distances, all_internal_ids = range_search_top_k(self.index_config, self.index, query_embeddings_np, radius, search_k, params)
+            else:
+                all_distances, all_internal_ids = self.index.search(query_embeddings_np, search_k, params=params)
+        if rescore and k > 0:
+            all_distances, all_internal_ids = self._rescore(query_embeddings_np, all_internal_ids, k)
 
-        # Results for the first (and only processed) query
-        internal_ids_list = all_internal_ids[0]
-        distances_list = all_distances[0]
+        # L2 collections report L2 distance, cosine/ip collections 1 - similarity (as Chroma does)
+        all_distances = to_distances(self.index_config, all_distances)
+        if max_distance is not None:
+            # Exact cutoff on the final distances, for the rescored and exact-subset paths and float rounding at the radius
+            all_internal_ids = np.where(all_distances <= max_distance, all_internal_ids, -1)
 
-        final_ids = []
-        final_distances = []
-        final_metadatas = []
-        final_documents = []
+        # Map every row of the (n_queries, k) result matrix back to doc ids
+        id_lists = []
+        distance_lists = []
+        for internal_ids_list, distances_list in zip(all_internal_ids, all_distances):
+            final_ids = []
+            final_distances = []
+            # FAISS uses -1 if fewer than k results found; those map to None
+            for j, doc_id in enumerate(self.id_map.doc_ids_for(internal_ids_list)):
+                if doc_id:
+                    final_ids.append(doc_id)
+                    if 'distances' in include:
+                        final_distances.append(float(distances_list[j])) # Ensure float
+            id_lists.append(final_ids)
+            distance_lists.append(final_distances)
 
-        for j, internal_id in enumerate(internal_ids_list):
-            if internal_id == -1: # FAISS uses -1 if fewer than k results found
-                continue
+        # Hydrate the top-k hits of all queries with a single read from the metadata store
+        metadata_lists = []
+        document_lists = []
+        fields = self._store_fields(include)
+        if fields:
+            rows = self.store.fetch([doc_id for final_ids in id_lists for doc_id in final_ids], fields)
+            for final_ids in id_lists:
+                metadata_lists.append([(rows.get(doc_id, {}).get("metadata") or {}) for doc_id in final_ids])
+                document_lists.append([(rows.get(doc_id, {}).get("document") or "") for doc_id in final_ids])
 
-            doc_id = self.faiss_id_to_doc_id.get(int(internal_id)) # Ensure internal_id is int
-            if doc_id:
-                final_ids.append(doc_id)
-                if 'distances' in include:
-                    # FAISS returns L2 squared, Chroma often uses cosine similarity or L2.
-                    # We'll return L2 distance.
-                    final_distances.append(float(np.sqrt(distances_list[j]))) # Ensure float
-                if 'metadatas' in include:
-                    final_metadatas.append(self.metadata_store.get(doc_id, {}))
-                if 'documents' in include:
-                    final_documents.append(self.doc_store.get(doc_id, ""))
-                # 'embeddings' are typically not returned by FAISS search directly
+        # Stored vectors of all hits are reconstructed in one batch and split per query, one array each
+        embedding_lists = None
+        if 'embeddings' in include:
+            flat_ids = self.id_map.internal_ids_for(doc_id for final_ids in id_lists for doc_id in final_ids)
+            vectors = self._stored_vectors(flat_ids) if len(flat_ids) else np.zeros((0, self.dimension), dtype='float32')
+            embedding_lists = np.split(vectors, np.cumsum([len(final_ids) for final_ids in id_lists])[:-1])
 
-        # Construct the final result dictionary in ChromaDB format
+        # Construct the final result dictionary in ChromaDB format: one inner list per query embedding
         final_results = {
-            'ids': [final_ids], # Wrap in a list to match Chroma's structure for single query
-            'distances': [final_distances] if 'distances' in include else None,
-            'metadatas': [final_metadatas] if 'metadatas' in include else None,
-            'documents': [final_documents] if 'documents' in include else None,
-            'embeddings': None # Embeddings not retrieved in standard search
+            'ids': id_lists,
+            'distances': distance_lists if 'distances' in include else None,
+            'metadatas': metadata_lists if 'metadatas' in include else None,
+            'documents': document_lists if 'documents' in include else None,
+            'embeddings': embedding_lists
         }
 
         # Remove keys if not requested (as per ChromaDB behavior)
@@ -252,43 +839,177 @@ class FaissCollection:
 
         return final_results
 
+    def _search_binary(self, queries: np.ndarray, search_k: int, allowed_ids: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Hamming search of a binary (IndexLSH) collection, which accepts no ID selector. search_k candidates are
+        fetched per query, widened by the share of vectors filtered out or tombstoned, and those are dropped
+        here (id -1) before _rescore picks the top k.
+        """
+        allowed = len(allowed_ids) if allowed_ids is not None else self.count()
+        fetch_k = min(self.index.ntotal, int(np.ceil(search_k * self.index.ntotal / max(allowed, 1))))
+        distances, internal_ids = self.index.search(queries, fetch_k)
+        dropped = internal_ids < 0
+        if allowed_ids is not None:
+            dropped |= ~np.isin(internal_ids, allowed_ids)
+        if self._tombstones:
+            dropped |= np.isin(internal_ids, np.fromiter(self._tombstones, dtype='int64', count=len(self._tombstones)))
+        return distances, np.where(dropped, -1, internal_ids)
+
+    def _rescore(self, queries: np.ndarray, candidate_ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact top-k among the candidates of a quantized search, using the full-precision vectors on disk.
+        Returns raw scores (squared L2 or inner products) and internal ids, like Index.search.
+        """
+        valid = candidate_ids >= 0
+        candidates = np.zeros(candidate_ids.shape + (self.dimension,), dtype='float32')
+        candidates[valid] = self.vector_store.read(candidate_ids[valid])
+        if self.index_config.metric == "l2":
+            scores = ((candidates - queries[:, None, :]) ** 2).sum(axis=2)
+            scores[~valid] = np.inf
+            order = np.argsort(scores, axis=1, kind='stable')[:, :k]
+        else:
+            scores = np.einsum('qkd,qd->qk', candidates, queries)
+            scores[~valid] = -np.inf
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        ids = np.take_along_axis(np.where(valid, candidate_ids, -1), order, axis=1)
+        return np.take_along_axis(scores, order, axis=1).astype('float32'), ids
+
+    def _stored_vectors(self, internal_ids: np.ndarray) -> np.ndarray:
+        """
+        Vectors as stored for the given internal ids (L2-normalized in cosine collections). Quantized collections
+        read their full-precision copy; IVF-PQ returns decoded, approximate vectors.
+        """
+        if storage_kind(self.index) != "float32":
+            return self.vector_store.read(internal_ids)
+        inner = faiss.downcast_index(self.index.index)
+        if isinstance(inner, faiss.IndexIVF) and inner.direct_map.type == faiss.DirectMap.NoMap:
+            with self._direct_map_lock: # Readers share the index; build the id -> list position map only once
+                if inner.direct_map.type == faiss.DirectMap.NoMap:
+                    inner.make_direct_map()
+        return reconstruct_ids(self.index, internal_ids)
+
+    def browse(self, cursor: Optional[str] = None, limit: int = 100, include: List[str] = ['metadatas', 'documents']) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of records in insertion order, for admin browsing at any collection size.
+        cursor is the opaque next_cursor of the previous page (None for the first page); include may also
+        name 'embeddings'. Returns (records, next_cursor), next_cursor being None after the last page.
+        """
+        self._maybe_refresh()
+        after = int(cursor) if cursor else None
+        with self._lock.read():
+            page = list(self.store.iter_records(self._store_fields(include), limit=limit, after=after))
+            records = []
+            for doc_id, row in page:
+                record = {"id": doc_id}
+                if 'metadatas' in include:
+                    record["metadata"] = row.get("metadata")
+                if 'documents' in include:
+                    record["document"] = row.get("document")
+                records.append(record)
+            internal_ids = self.id_map.internal_ids_for(doc_id for doc_id, _ in page)
+            if 'embeddings' in include and len(internal_ids):
+                for record, vector in zip(records, self._stored_vectors(internal_ids)):
+                    record["embedding"] = vector.tolist()
+        next_cursor = str(int(internal_ids[-1])) if len(page) == limit and internal_ids[-1] >= 0 else None
+        return records, next_cursor
+
+    def _filtered_internal_ids(self, where: Optional[Dict[str, Any]], where_document: Optional[Dict[str, Any]]) -> np.ndarray:
+        """ Sorted internal ids of the records matching where / where_document. """
+        where_candidates, exact = self.metadata_index.resolve(where)
+        if where_candidates is not None and exact and not where_document:
+            doc_ids = where_candidates
+        else:
+            doc_ids = self._get(where=where, where_document=where_document, include=[])["ids"]
+        internal_ids = self.id_map.internal_ids_for(doc_ids)
+        return np.sort(internal_ids[internal_ids >= 0])
+
+    def _document_candidates(self, where_document: Optional[Dict[str, Any]]) -> Optional[set]:
+        """ Doc ids that may match where_document according to the trigram index, or None when it has to be scanned. """
+        if not where_document or not self.index_config.trigram_index:
+            return None
+        internal_ids = self._trigram_index().resolve(where_document)
+        if internal_ids is None:
+            return None
+        return {doc_id for doc_id in self.id_map.doc_ids_for(internal_ids) if doc_id is not None}
+
+    def _trigram_index(self) -> TrigramIndex:
+        """ The trigram index, built from the stored documents on first use (readers share it once built). """
+        with self._trigram_lock:
+            if self.trigram_index is None:
+                started = time.monotonic()
+                index = TrigramIndex()
+                index.add(self.store.iter_documents())
+                self.trigram_index = index
+                logger.info(f"[{self.name}] Built trigram index over {len(index)} documents in {time.monotonic() - started:.2f}s.")
+            return self.trigram_index
+
+    @staticmethod
+    def _store_fields(include: List[str], *extra: str) -> tuple:
+        """ Map Chroma include names to metadata store columns. """
+        fields = []
+        if 'metadatas' in include or "metadata" in extra:
+            fields.append("metadata")
+        if 'documents' in include or "document" in extra:
+            fields.append("document")
+        return tuple(fields)
+
     def _matches_where(self, metadata: Optional[Dict[str, Any]], where_clause: Dict[str, Any]) -> bool:
         """ Check if an item's metadata matches the where clause. """
-        if not metadata:
-            return False
-        for key, value in where_clause.items():
-            if key not in metadata or metadata[key] != value:
-                return False
-        return True
+        return matches_where(metadata, where_clause)
 
     def _matches_where_document(self, document: Optional[str], where_document_clause: Dict[str, Any]) -> bool:
         """ Check if an item's document content matches the where_document clause. """
-        if not document:
-            return False
-        if '$contains' in where_document_clause:
-            search_term = where_document_clause['$contains']
-            return search_term in document
-        # Add more complex document filtering logic here if needed
-        logger.warning(f"[{self.name}] Unsupported where_document filter: {where_document_clause}")
-        return False
+        return matches_where_document(document, where_document_clause)
 
     def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, limit: Optional[int] = None, offset: Optional[int] = None, where_document: Optional[Dict[str, Any]] = None, include: List[str] = ['metadatas', 'documents']) -> Dict[str, List[Any]]:
-        """ Mimics ChromaDB's get method, including basic 'where' and 'where_document' filtering. """
-        # Remove the warning log as filtering is implemented
-        # logger.warning(f"[{self.name}] FAISS get method currently only supports filtering by ID. 'where' and 'where_document' clauses are ignored.")
+        """
+        Mimics ChromaDB's get method, including 'where' ($and/$or/$in/...) and 'where_document' filtering.
+        Clauses on indexed metadata keys are answered from the hash indexes instead of a full scan, and
+        where_document $contains / $phrase from the trigram index.
+        include=['embeddings'] returns the stored vectors as one (n, dimension) float32 array, reconstructed
+        from the index rather than re-encoded (L2-normalized in cosine collections, decoded for IVF-PQ).
+        """
+        self._maybe_refresh()
+        with self._lock.read():
+            return self._get(ids, where, limit, offset, where_document, include)
 
-        potential_ids = ids if ids else list(self.doc_id_to_faiss_id.keys())
+    def _get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, limit: Optional[int] = None, offset: Optional[int] = None, where_document: Optional[Dict[str, Any]] = None, include: List[str] = ['metadatas', 'documents']) -> Dict[str, List[Any]]:
+        where_candidates, exact = self.metadata_index.resolve(where)
+        check_where = bool(where) and not exact
+        fields = self._store_fields(include, *(("metadata",) if check_where else ()), *(("document",) if where_document else ()))
+        # The trigram index narrows where_document down to a few candidates, which are still checked below
+        document_candidates = self._document_candidates(where_document)
+        if document_candidates is not None:
+            where_candidates = document_candidates if where_candidates is None else where_candidates & document_candidates
+        if ids:
+            known_ids = [doc_id for doc_id in ids if doc_id in self.doc_id_to_faiss_id and (where_candidates is None or doc_id in where_candidates)]
+            found = self.store.fetch(known_ids, fields)
+            candidates = ((doc_id, found[doc_id]) for doc_id in known_ids if doc_id in found)
+        elif where_candidates is not None:
+            candidate_ids = list(where_candidates)
+            candidate_internal_ids = self.id_map.internal_ids_for(candidate_ids)
+            ordered = [candidate_ids[i] for i in np.argsort(candidate_internal_ids, kind='stable') if candidate_internal_ids[i] >= 0]
+            if not check_where and not where_document:
+                # The index answered the whole clause: paginate before reading anything from the store
+                start = offset if offset else 0
+                ordered = ordered[start:(start + limit) if limit is not None else None]
+                limit, offset = None, None
+            found = self.store.fetch(ordered, fields)
+            candidates = ((doc_id, found[doc_id]) for doc_id in ordered if doc_id in found)
+        elif not where and not where_document:
+            # No filters: let the store apply limit/offset and read only the requested page
+            candidates = self.store.iter_records(fields, limit=limit, offset=offset or 0)
+            limit, offset = None, None
+        else:
+            candidates = self.store.iter_records(fields)
 
         filtered_items = []
-        for doc_id in potential_ids:
-            if doc_id not in self.doc_id_to_faiss_id:
-                continue # Skip if ID doesn't exist in this collection
-
-            metadata = self.metadata_store.get(doc_id)
-            document = self.doc_store.get(doc_id)
+        for doc_id, row in candidates:
+            metadata = row.get("metadata")
+            document = row.get("document")
 
             # Apply 'where' filter (metadata)
-            if where and not self._matches_where(metadata, where):
+            if check_where and not self._matches_where(metadata, where):
                 continue
 
             # Apply 'where_document' filter (document content)
@@ -299,7 +1020,6 @@ class FaissCollection:
             item = {'id': doc_id}
             if 'metadatas' in include: item['metadata'] = metadata
             if 'documents' in include: item['document'] = document
-            # Note: Embeddings are not typically stored/retrieved in 'get'
             filtered_items.append(item)
 
         # Apply limit and offset *after* filtering
@@ -313,6 +1033,10 @@ class FaissCollection:
             final_results['metadatas'] = [item.get('metadata') for item in paginated_items]
         if 'documents' in include:
             final_results['documents'] = [item.get('document') for item in paginated_items]
+        if 'embeddings' in include:
+            # Read back from the index (or the full-precision vector store), never re-encoded
+            internal_ids = self.id_map.internal_ids_for(final_results['ids'])
+            final_results['embeddings'] = self._stored_vectors(internal_ids) if len(internal_ids) else np.zeros((0, self.dimension), dtype='float32')
 
         return final_results
 
@@ -324,50 +1048,102 @@ class FaissCollection:
         if not ids:
              logger.warning(f"[{self.name}] Delete called without specific IDs. This is currently not supported for safety. Provide IDs to delete.")
              return []
+        with self._lock.write():
+            self._ensure_writable()
 
-        faiss_ids_to_remove = []
-        deleted_doc_ids = []
-
-        for doc_id in ids:
-            internal_id = self.doc_id_to_faiss_id.pop(doc_id, None)
-            if internal_id is not None:
-                faiss_ids_to_remove.append(internal_id)
-                self.faiss_id_to_doc_id.pop(internal_id, None)
-                self.metadata_store.pop(doc_id, None)
-                self.doc_store.pop(doc_id, None)
-                deleted_doc_ids.append(doc_id)
-            else:
-                logger.warning(f"[{self.name}] ID '{doc_id}' not found for deletion.")
+            faiss_ids_to_remove = []
+            deleted_doc_ids = []
 
-        if faiss_ids_to_remove:
-            try:
-                remove_result = self.index.remove_ids(np.array(faiss_ids_to_remove).astype('int64'))
-                logger.info(f"[{self.name}] Removed {remove_result} items from FAISS index. Attempted: {len(faiss_ids_to_remove)}. Index size: {self.index.ntotal}")
-                if remove_result != len(faiss_ids_to_remove):
-                     logger.warning(f"[{self.name}] Discrepancy in removed count from FAISS index.")
-                self._save()
-            except Exception as e:
-                logger.error(f"[{self.name}] Error removing IDs from FAISS index: {e}")
-                # Note: Metadata/doc store changes are already done. Rollback is complex.
-                # Re-raise or handle as appropriate.
-                # For now, return the IDs we *thought* we deleted.
+            for doc_id in ids:
+                internal_id = self.id_map.remove_doc(doc_id)
+                if internal_id is not None:
+                    faiss_ids_to_remove.append(internal_id)
+                    deleted_doc_ids.append(doc_id)
+                else:
+                    logger.warning(f"[{self.name}] ID '{doc_id}' not found for deletion.")
+
+            for doc_id, row in self.store.fetch(deleted_doc_ids, ("metadata",)).items():
+                self.metadata_index.remove(doc_id, row.get("metadata"))
+            self.store.delete_records(deleted_doc_ids)
+            self.id_map.maybe_compact()
+            if self.trigram_index is not None:
+                self.trigram_index.remove(faiss_ids_to_remove)
+            if self.embedding_archive is not None:
+                self.embedding_archive.remove(deleted_doc_ids)
+            if faiss_ids_to_remove:
+                self._tombstone_vectors(np.array(faiss_ids_to_remove).astype('int64'))
+                self._write_manifest()
+                self._maybe_checkpoint()
+                self._maybe_compact()
 
         return deleted_doc_ids
 
     def count(self) -> int:
-        """ Returns the number of items in the collection. """
-        return self.index.ntotal if self.index else 0
+        """ Returns the number of items in the collection (tombstoned vectors are not counted). """
+        return self.index.ntotal - len(self._tombstones) if self.index else 0
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """ Collection metadata in Chroma's terms, so callers can read the distance space the same way for both backends. """
+        return {"hnsw:space": self.index_config.metric}
+
+    @property
+    def doc_id_to_faiss_id(self) -> Mapping[str, int]:
+        """ Read-only dict-style view of the id map: doc id -> internal id. """
+        return self.id_map.by_doc_id
+
+    @property
+    def faiss_id_to_doc_id(self) -> Mapping[int, str]:
+        """ Read-only dict-style view of the id map: internal id -> doc id. """
+        return self.id_map.by_internal_id
+
+    def archived_embeddings(self, doc_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectors of doc ids as they were written, from the embedding archive, and a mask of the ids found there.
+        Only the vector each id currently has counts.
+        """
+        if self.embedding_archive is None:
+            return np.zeros((len(doc_ids), self.dimension), dtype='float32'), np.zeros(len(doc_ids), dtype=bool)
+        return self.embedding_archive.get(doc_ids, self.id_map.internal_ids_for(doc_ids))
+
+    def frozen(self):
+        """ Context manager holding off every other read and write, e.g. while the collection's files are swapped. """
+        return self._lock.write()
+
+    def close(self):
+        """ Abandon any in-flight compaction and close the metadata store (before the collection's files are deleted). """
+        with self._lock.write():
+            self._index_generation += 1
+            self.store.close()
+            self.vector_store.close()
+            if self.embedding_archive is not None:
+                self.embedding_archive.close()
+
+    def data_files(self) -> List[str]:
+        """ Every file of the collection (SQLite keeps -wal/-shm files next to the database), used when it is deleted. """
+        archive_files = self.embedding_archive.data_files() if self.embedding_archive is not None else []
+        return [self.index_path, self.wal.path, self.vector_store.path, self.metadata_path,
+                self.metadata_path + "-wal", self.metadata_path + "-shm",
+                os.path.join(self.collection_path, LEGACY_METADATA_FILENAME + ".migrated"),
+                os.path.join(self.collection_path, INDEX_CONFIG_FILENAME), os.path.join(self.collection_path, MANIFEST_FILENAME)] + archive_files
 
     def clear(self):
         """Remove all documents, metadata, and reset the FAISS index."""
-        import faiss
-        self.doc_store.clear()
-        self.metadata_store.clear()
-        self.faiss_id_to_doc_id.clear()
-        self.doc_id_to_faiss_id.clear()
-        self.next_internal_id = 0
-        self.index = faiss.IndexIDMap(faiss.IndexFlatL2(self.dimension))
-        self._save()
+        with self._lock.write():
+            self._ensure_writable()
+            self.store.clear()
+            self.metadata_index.clear()
+            self.id_map.clear()
+            self.trigram_index = None
+            self.next_internal_id = 0
+            self.vector_store.clear()
+            if self.embedding_archive is not None:
+                self.embedding_archive.clear()
+            self.index = self._new_index()
+            self._index_generation += 1
+            self._set_tombstones(set())
+            self._save()
+            self._write_manifest()
         logger.info(f"FAISS collection '{self.name}' cleared (all records removed, index reset).")
 
 
@@ -376,9 +1152,87 @@ class FaissClient:
     def __init__(self, base_path: str):
         self.base_path = base_path
         self.collections: Dict[str, FaissCollection] = {}
-        self.dimension = self._get_embedding_dimension()
+        # Guards the collections dict, so concurrent requests never load the same collection twice
+        self._collections_lock = threading.RLock()
+        self._dimension: Optional[int] = None
+        # Reindex jobs by collection name; the latest job of each collection is kept for its status
+        self._reindex_jobs: Dict[str, ReindexJob] = {}
         os.makedirs(self.base_path, exist_ok=True)
-        logger.info(f"FAISS Client initialized. Base path: {self.base_path}, Dimension: {self.dimension}")
+        if not settings.FAISS_READ_ONLY:
+            recover_interrupted_reindex(self.base_path)
+        logger.info(f"FAISS Client initialized. Base path: {self.base_path}")
+
+    @property
+    def dimension(self) -> int:
+        """
+        Embedding dimension for new collections. Taken from the manifest of a collection built with the
+        configured model when there is one; otherwise the model is loaded once to measure it.
+        """
+        if self._dimension is None:
+            model_name = current_model_name()
+            dimensions = [manifest.dimension for manifest in self._manifests().values() if manifest.model_name == model_name]
+            self._dimension = dimensions[0] if dimensions else self._get_embedding_dimension()
+        return self._dimension
+
+    def _collection_names_on_disk(self) -> List[str]:
+        """ Subdirectories of base_path holding a FAISS collection (manifest, index or metadata files). """
+        names = []
+        if os.path.exists(self.base_path):
+            for entry in sorted(os.listdir(self.base_path)):
+                entry_path = os.path.join(self.base_path, entry)
+                if os.path.isdir(entry_path) and any(
+                        os.path.exists(os.path.join(entry_path, f))
+                        for f in (MANIFEST_FILENAME, "index.faiss", METADATA_DB_FILENAME, LEGACY_METADATA_FILENAME)):
+                    names.append(entry)
+        return names
+
+    def _manifests(self) -> Dict[str, CollectionManifest]:
+        """ Manifests of the collections on disk, read without loading any collection. """
+        manifests = {}
+        for name in self._collection_names_on_disk():
+            manifest = load_manifest(os.path.join(self.base_path, name))
+            if manifest is not None:
+                manifests[name] = manifest
+        return manifests
+
+    def _open_collection(self, name: str, index_config: Optional[FaissIndexConfig] = None) -> FaissCollection:
+        """
+        Load (or create) a collection; existing ones keep the dimension recorded in their manifest.
+        Collections configured with more than one shard are opened as a ShardedFaissCollection, tiered ones as a
+        TieredFaissCollection.
+        Caller holds _collections_lock.
+        """
+        collection_path = os.path.join(self.base_path, name)
+        os.makedirs(collection_path, exist_ok=True)
+        manifest = load_manifest(collection_path)
+        dimension = manifest.dimension if manifest else self.dimension
+        if manifest and manifest.model_name and manifest.model_name != current_model_name():
+            logger.warning(f"Collection '{name}' was embedded with {manifest.model_name}, but the configured model is {current_model_name()}; "
+                           f"reindex it (POST /api/chroma-collections/{name}/reindex) to re-embed its documents.")
+        index_path = os.path.join(collection_path, "index.faiss")
+        metadata_path = os.path.join(collection_path, METADATA_DB_FILENAME)
+        persisted = load_index_config(collection_path)
+        if persisted is not None or os.path.exists(index_path) or os.path.exists(metadata_path):
+            # Existing collections keep their shard and tier layout: documents are not redistributed
+            existing_shards = persisted.shards if persisted is not None else 1
+            existing_tiering = persisted.tiering if persisted is not None else False
+            if index_config is not None and (index_config.shards, index_config.tiering) != (existing_shards, existing_tiering):
+                logger.warning(f"Collection '{name}' has {existing_shards} shard(s){' in hot and cold tiers' if existing_tiering else ''}; keeping them. "
+                               f"Rebuild it (POST /api/chroma-collections/{name}/rebuild) to change the shard count or tiering.")
+                index_config = index_config.model_copy(update={"shards": existing_shards, "tiering": existing_tiering})
+        config = index_config or persisted or FaissIndexConfig.from_settings()
+        if config.shards > 1 or config.tiering:
+            # Local imports: both modules import FaissCollection from here
+            from app.services.faiss_sharded import ShardedFaissCollection
+            from app.services.faiss_tiered import TieredFaissCollection
+            if config != persisted and not settings.FAISS_READ_ONLY:
+                save_index_config(collection_path, config)
+            collection_class = TieredFaissCollection if config.tiering else ShardedFaissCollection
+            collection = collection_class(name, collection_path, dimension, config)
+        else:
+            collection = FaissCollection(name, index_path, metadata_path, dimension, index_config=index_config)
+        self.collections[name] = collection
+        return collection
 
     def _get_embedding_dimension(self) -> int:
         try:
@@ -393,43 +1247,53 @@ class FaissClient:
             logger.warning(f"Falling back to default dimension: {dimension}")
             return dimension
 
-    def get_or_create_collection(self, name: str) -> FaissCollection:
-        if name in self.collections:
-            return self.collections[name]
-        else:
-            logger.info(f"Creating new FAISS collection: {name}")
-            collection_path = os.path.join(self.base_path, name)
-            os.makedirs(collection_path, exist_ok=True)
-            index_path = os.path.join(collection_path, "index.faiss")
-            metadata_path = os.path.join(collection_path, "metadata.pkl")
-            collection = FaissCollection(name, index_path, metadata_path, self.dimension)
-            self.collections[name] = collection
-            return collection
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> FaissCollection:
+        """
+        Get or create a collection. Index options can be passed Chroma-style through metadata,
+        e.g. {"faiss:index_type": "ivf_pq", "faiss:nprobe": 32} or {"faiss:storage": "int8", "faiss:rescore_factor": 8};
+        they are persisted with the collection and an existing index is rebuilt if its layout changes.
+        """
+        index_config = FaissIndexConfig.from_metadata(metadata)
+        with self._collections_lock:
+            if name in self.collections:
+                if index_config is not None and index_config != self.collections[name].index_config:
+                    logger.warning(f"Collection '{name}' is already loaded; new index options are ignored until it is reloaded.")
+                return self.collections[name]
+            else:
+                logger.info(f"Creating new FAISS collection: {name}")
+                return self._open_collection(name, index_config=index_config)
 
     def get_collection(self, name: str) -> Optional[FaissCollection]:
         # Try in-memory first
-        if name in self.collections:
-            return self.collections[name]
-        # Try loading from disk if folder exists
-        collection_path = os.path.join(self.base_path, name)
-        index_path = os.path.join(collection_path, "index.faiss")
-        metadata_path = os.path.join(collection_path, "metadata.pkl")
-        if os.path.exists(collection_path) and (os.path.exists(index_path) or os.path.exists(metadata_path)):
-            collection = FaissCollection(name, index_path, metadata_path, self.dimension)
-            self.collections[name] = collection
+        collection = self.collections.get(name)
+        if collection is not None:
             return collection
-        return None
+        # Try loading from disk if folder exists
+        with self._collections_lock:
+            if name in self.collections:
+                return self.collections[name]
+            if name in self._collection_names_on_disk():
+                return self._open_collection(name)
+            return None
 
     def delete_collection(self, name: str):
-        if name in self.collections:
-            collection = self.collections.pop(name)
+        if settings.FAISS_READ_ONLY:
+            raise RuntimeError(f"Cannot delete FAISS collection '{name}': the client is read-only (FAISS_READ_ONLY).")
+        with self._collections_lock:
+            collection = self.collections.pop(name, None)
+        if collection is not None:
             collection_path = os.path.join(self.base_path, name)
             try:
+                collection.close()
                 # Attempt to remove files and directory
-                if os.path.exists(collection.index_path):
-                    os.remove(collection.index_path)
-                if os.path.exists(collection.metadata_path):
-                    os.remove(collection.metadata_path)
+                for path in collection.data_files():
+                    if os.path.exists(path):
+                        os.remove(path)
+                # Shard subdirectories of a sharded collection are empty now
+                for entry in os.listdir(collection_path) if os.path.exists(collection_path) else []:
+                    entry_path = os.path.join(collection_path, entry)
+                    if os.path.isdir(entry_path) and not os.listdir(entry_path):
+                        os.rmdir(entry_path)
                 if os.path.exists(collection_path):
                      # Check if dir is empty before removing, might fail otherwise
                      if not os.listdir(collection_path):
@@ -442,32 +1306,106 @@ class FaissClient:
         else:
             logger.warning(f"Attempted to delete non-existent FAISS collection: {name}")
 
+    def checkpoint(self):
+        """ Checkpoint every loaded collection so no write-ahead log has to be replayed on next start. """
+        for collection in list(self.collections.values()):
+            try:
+                collection.checkpoint()
+            except Exception as e:
+                logger.error(f"Error checkpointing FAISS collection {collection.name}: {e}")
+
+    def collection_stats(self) -> List[Dict[str, Any]]:
+        """ Tombstone and compaction stats of every collection, for the collections admin API. """
+        results = []
+        for col in self.list_collections():
+            collection = self.get_collection(col["name"])
+            if collection:
+                results.append({"collection_name": col["name"], **collection.compaction_stats()})
+        return results
+
     def list_collections(self) -> List[Dict[str, Any]]:
         """
         Mimic Chroma's list_collections format.
-        Scan the base_path directory for all subdirectories that contain FAISS index or metadata files.
+        Scan the base_path directory for all subdirectories that contain FAISS collection files.
         Return their names as collections, even if not loaded in memory, and include record count.
+        Counts of collections that are not loaded come from their manifests; only collections written
+        before manifests existed are loaded (once, which writes their manifest).
         """
-        collections = set(self.collections.keys())
-        # Scan for additional collections on disk
-        if os.path.exists(self.base_path):
-            for entry in os.listdir(self.base_path):
-                entry_path = os.path.join(self.base_path, entry)
-                if os.path.isdir(entry_path):
-                    has_metadata = os.path.exists(os.path.join(entry_path, "metadata.pkl"))
-                    has_index = any(f.endswith(".index") for f in os.listdir(entry_path)) if os.path.exists(entry_path) else False
-                    if has_metadata or has_index:
-                        collections.add(entry)
+        manifests = self._manifests()
+        collections = set(self.collections.keys()) | set(self._collection_names_on_disk())
         result = []
         for name in sorted(collections):
             try:
-                collection = self.get_collection(name)
-                count = collection.count() if collection else 0
+                collection = self.collections.get(name)
+                if collection is not None:
+                    count = collection.count()
+                elif name in manifests:
+                    count = manifests[name].count
+                else:
+                    collection = self.get_collection(name)
+                    count = collection.count() if collection else 0
             except Exception:
                 count = 0
             result.append({"name": name, "record_count": count})
         return result
 
+    def collection_summaries(self) -> List[Dict[str, Any]]:
+        """ Name, record count and manifest details (dimension, index type, model, ...) of every collection, without records. """
+        manifests = self._manifests()
+        summaries = []
+        for col in self.list_collections():
+            collection = self.collections.get(col["name"])
+            manifest = collection.manifest if collection is not None and collection.manifest else manifests.get(col["name"])
+            summary = {"collection_name": col["name"], "record_count": col["record_count"]}
+            if manifest is not None:
+                summary.update(manifest.model_dump(include={"dimension", "index_type", "metric", "storage", "model_name", "version", "updated_at"}))
+                summary["needs_reindex"] = bool(manifest.model_name) and manifest.model_name != current_model_name()
+            summaries.append(summary)
+        return summaries
+
+    def reindex_collection(self, name: str) -> Dict[str, Any]:
+        """
+        Start re-embedding a collection with the configured embedding model in the background (see ReindexJob)
+        and return the job status. A job already running for the collection is returned instead.
+        """
+        return self._start_reindex_job(name)
+
+    def rebuild_collection(self, name: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Start rebuilding a collection in another index layout from its embedding archive, without the embedding model.
+        options are FaissIndexConfig fields overriding the collection's current ones, e.g. {"index_type": "hnsw"} or
+        {"shards": 4}. Runs in the background like reindex_collection and shares its status.
+        """
+        options = options or {}
+        unknown = set(options) - set(FaissIndexConfig.model_fields)
+        if unknown:
+            raise ValueError(f"Unknown FAISS collection options: {sorted(unknown)}")
+        collection = self.get_collection(name)
+        if collection is None:
+            raise KeyError(f"FAISS collection '{name}' does not exist.")
+        index_config = FaissIndexConfig(**{**collection.index_config.model_dump(), **options})
+        index_config.validate_type()
+        return self._start_reindex_job(name, index_config)
+
+    def _start_reindex_job(self, name: str, index_config: Optional[FaissIndexConfig] = None) -> Dict[str, Any]:
+        if settings.FAISS_READ_ONLY:
+            raise RuntimeError(f"Cannot reindex FAISS collection '{name}': the client is read-only (FAISS_READ_ONLY).")
+        with self._collections_lock:
+            job = self._reindex_jobs.get(name)
+            if job is not None and job.is_running():
+                return job.to_dict()
+            if self.get_collection(name) is None:
+                raise KeyError(f"FAISS collection '{name}' does not exist.")
+            job = ReindexJob(self, name, index_config)
+            self._reindex_jobs[name] = job
+            job.start()
+        return job.to_dict()
+
+    def reindex_status(self, name: str) -> Optional[Dict[str, Any]]:
+        """ Progress of the latest reindex or rebuild job of a collection, or None if there was none in this process. """
+        job = self._reindex_jobs.get(name)
+        return job.to_dict() if job is not None else None
+
     def get_collections_with_records(self) -> List[Dict[str, Any]]:
         """
         Returns all collections and their records (id, document, metadata) in Chroma-like format.
@@ -476,13 +1414,13 @@ class FaissClient:
         for col in self.list_collections() or []:
             collection = self.get_collection(col["name"])
             if collection:
-                all_ids = list(collection.doc_store.keys())
+                data = collection.get(include=['metadatas', 'documents'])
                 records = []
-                for doc_id in all_ids:
+                for doc_id, document, metadata in zip(data["ids"], data["documents"], data["metadatas"]):
                     record = {
                         "id": doc_id,
-                        "document": collection.doc_store.get(doc_id, ""),
-                        "metadata": collection.metadata_store.get(doc_id, {})
+                        "document": document or "",
+                        "metadata": metadata or {}
                     }
                     records.append(record)
                 results.append({
@@ -501,10 +1439,23 @@ _global_faiss_client = None
 
 def get_faiss_client(base_path: str = None) -> 'FaissClient':
     global _global_faiss_client
-    if _global_faiss_client is None:
+    if _global_faiss_client is None and settings.FAISS_SERVER_URL and not base_path:
+        from app.services.faiss_remote import RemoteFaissClient # Local import: faiss_remote is only needed with an index server
+        _global_faiss_client = RemoteFaissClient(settings.FAISS_SERVER_URL)
+    elif _global_faiss_client is None:
         path = base_path or settings.FAISS_INDEX_PATH
         _global_faiss_client = FaissClient(path)
     # If a different base_path is requested, warn but return the existing instance
-    elif base_path and _global_faiss_client.base_path != base_path:
+    elif base_path and getattr(_global_faiss_client, "base_path", None) != base_path:
         logger.warning("Requesting FAISS client with different base path. Returning existing instance.")
-    return _global_faiss_client
\ No newline at end of file
+    return _global_faiss_client
+
+
+def is_faiss_collection(collection) -> bool:
+    """
+    Whether a collection (as returned by the vector DB client) is served by FAISS, in process, sharded or through the
+    index server, rather than by Chroma. A collection with a generation being built is judged by its active generation.
+    """
+    from app.services.faiss_sharded import ShardedFaissCollection # Local import: faiss_sharded imports this module
+    from app.services.faiss_remote import RemoteFaissCollection
+    return isinstance(unwrap_collection(collection), (FaissCollection, ShardedFaissCollection, RemoteFaissCollection))
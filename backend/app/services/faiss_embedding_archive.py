@@ -0,0 +1,255 @@
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DB_FILENAME = "embeddings.db"
+# Row files are named by generation: compaction writes the next one and switches to it in one SQLite commit
+ARCHIVE_FILE_PREFIX = "embeddings."
+SUPPORTED_ARCHIVE_DTYPES = ("float32", "float16")
+_FILE_SUFFIXES = {"float32": "f32", "float16": "f16"}
+# Superseded and deleted rows are dropped once there are this many, and they outnumber the live rows
+MIN_COMPACT_ROWS = 4096
+COMPACT_CHUNK_ROWS = 65536
+# SQLite limits the number of bound parameters per statement; batch IN (...) lookups below it
+_SQL_BATCH_SIZE = 500
+
+def content_hash(document: Optional[str]) -> Optional[str]:
+    """ Key of a document's text in the archive. """
+    if document is None:
+        return None
+    return hashlib.blake2b(document.encode("utf-8"), digest_size=16).hexdigest()
+
+class EmbeddingArchive:
+    """
+    Append-only archive of the embeddings written to a collection, as they were given (before cosine
+    normalization or quantization), in a memory-mapped float32 or float16 row file. A SQLite table keys each row
+    by doc id, by the internal id it was written under and by the hash of its document, so any index layout can be
+    rebuilt without running the embedding model, and upserting an already embedded document reuses its vector.
+    Superseded and deleted rows stay in the file until compact() rewrites it.
+    """
+    def __init__(self, collection_path: str, dimension: int, dtype: str = "float32", model_name: Optional[str] = None):
+        self.collection_path = collection_path
+        self.db_path = os.path.join(collection_path, ARCHIVE_DB_FILENAME)
+        self._lock = threading.RLock()
+        self._mmap: Optional[np.memmap] = None
+        os.makedirs(collection_path, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS archive ("
+                " doc_id TEXT PRIMARY KEY,"
+                " internal_id INTEGER NOT NULL,"
+                " content_hash TEXT,"
+                " row INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS archive_content_hash ON archive (content_hash)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS archive_info (key TEXT PRIMARY KEY, value TEXT)")
+        info = dict(self._conn.execute("SELECT key, value FROM archive_info").fetchall())
+        if not info:
+            # A new archive takes the requested layout; an existing one keeps the layout it was written with
+            if dtype not in SUPPORTED_ARCHIVE_DTYPES:
+                raise ValueError(f"Unsupported embedding archive dtype '{dtype}'. Expected one of {SUPPORTED_ARCHIVE_DTYPES}.")
+            info = {"dimension": str(dimension), "dtype": dtype, "model_name": model_name or "", "generation": "0", "rows": "0"}
+            with self._lock, self._conn:
+                self._conn.executemany("INSERT INTO archive_info (key, value) VALUES (?, ?)", list(info.items()))
+        self.dimension = int(info["dimension"])
+        self.dtype = info["dtype"]
+        self.model_name = info["model_name"] or None
+        self._generation = int(info["generation"])
+        self._rows = int(info["rows"])
+        self._row_bytes = self.dimension * np.dtype(self.dtype).itemsize
+        self._remove_stale_files()
+
+    @property
+    def path(self) -> str:
+        """ Row file of the current generation. """
+        return os.path.join(self.collection_path, f"{ARCHIVE_FILE_PREFIX}{self._generation}.{_FILE_SUFFIXES[self.dtype]}")
+
+    def _remove_stale_files(self):
+        """ Drop row files of other generations, left behind by a compaction interrupted before or after its commit. """
+        current = os.path.basename(self.path)
+        for entry in os.listdir(self.collection_path):
+            if entry.startswith(ARCHIVE_FILE_PREFIX) and entry != current and entry.rsplit(".", 1)[-1] in _FILE_SUFFIXES.values():
+                os.remove(os.path.join(self.collection_path, entry))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM archive").fetchone()[0]
+
+    def put(self, doc_ids: Sequence[str], internal_ids: np.ndarray, vectors: np.ndarray, documents: Optional[Sequence[Optional[str]]] = None):
+        """
+        Append vectors and point their doc ids at them. Rows are written past the last committed row before the keys
+        are committed, so a crash in between leaves the archive as it was.
+        """
+        if len(doc_ids) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Embedding archive holds {self.dimension}-dimensional vectors, got {vectors.shape[1]}.")
+        hashes = [content_hash(document) for document in documents] if documents else [None] * len(doc_ids)
+        with self._lock:
+            start = self._rows
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.pwrite(fd, vectors.tobytes(), start * self._row_bytes)
+            finally:
+                os.close(fd)
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO archive (doc_id, internal_id, content_hash, row) VALUES (?, ?, ?, ?)",
+                    [(doc_id, int(internal_id), hashes[i], start + i) for i, (doc_id, internal_id) in enumerate(zip(doc_ids, internal_ids))]
+                )
+                self._conn.execute("UPDATE archive_info SET value = ? WHERE key = 'rows'", (str(start + len(doc_ids)),))
+            self._rows = start + len(doc_ids)
+            self._mmap = None # Remap on next read, the file has grown
+
+    def get(self, doc_ids: Sequence[str], internal_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Archived vectors of doc ids as float32, and a mask of the ids found. With internal_ids, a row only counts
+        if it was written under that internal id, i.e. it is the vector the collection currently holds.
+        """
+        rows = self._lookup("doc_id", doc_ids)
+        found = np.zeros(len(doc_ids), dtype=bool)
+        positions = np.zeros(len(doc_ids), dtype='int64')
+        for i, doc_id in enumerate(doc_ids):
+            hit = rows.get(doc_id)
+            if hit is not None and (internal_ids is None or hit[0] == internal_ids[i]):
+                found[i], positions[i] = True, hit[1]
+        return self._read(positions, found), found
+
+    def lookup_documents(self, documents: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """ Archived vectors of documents with identical text (any doc id), and a mask of the documents found. """
+        hashes = [content_hash(document) for document in documents]
+        rows = self._lookup("content_hash", [h for h in hashes if h is not None])
+        found = np.array([h in rows for h in hashes], dtype=bool)
+        positions = np.array([rows[h][1] if h in rows else 0 for h in hashes], dtype='int64')
+        return self._read(positions, found), found
+
+    def _lookup(self, column: str, keys: Sequence[str]) -> Dict[str, Tuple[int, int]]:
+        """ {key: (internal_id, row)} for the keys present in the archive. """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                for key, internal_id, row in self._conn.execute(f"SELECT {column}, internal_id, row FROM archive WHERE {column} IN ({placeholders})", batch):
+                    found[key] = (internal_id, row)
+        return found
+
+    def _read(self, rows: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        result = np.zeros((len(rows), self.dimension), dtype='float32')
+        if not mask.any():
+            return result
+        with self._lock:
+            if self._mmap is None:
+                self._mmap = np.memmap(self.path, dtype=self.dtype, mode='r', shape=(self._rows, self.dimension))
+            result[mask] = self._mmap[rows[mask]]
+        return result
+
+    def remove(self, doc_ids: Iterable[str]):
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM archive WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def maybe_compact(self):
+        """ Compact once dead rows pass MIN_COMPACT_ROWS and outnumber the live ones. """
+        with self._lock:
+            live = len(self)
+            if self._rows - live >= max(MIN_COMPACT_ROWS, live):
+                self.compact()
+
+    def compact(self):
+        """
+        Copy the live rows into the next generation's file, in row order, and switch the keys and the generation
+        over in one commit. Until the commit the old file stays current; the stale one is removed afterwards.
+        """
+        with self._lock:
+            live = self._conn.execute("SELECT doc_id, row FROM archive ORDER BY row").fetchall()
+            old_path, old_rows = self.path, self._rows
+            new_path = os.path.join(self.collection_path, f"{ARCHIVE_FILE_PREFIX}{self._generation + 1}.{_FILE_SUFFIXES[self.dtype]}")
+            source = np.memmap(old_path, dtype=self.dtype, mode='r', shape=(old_rows, self.dimension)) if old_rows else None
+            with open(new_path, "wb") as f:
+                for start in range(0, len(live), COMPACT_CHUNK_ROWS):
+                    rows = np.array([row for _, row in live[start:start + COMPACT_CHUNK_ROWS]], dtype='int64')
+                    f.write(np.ascontiguousarray(source[rows]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            del source
+            with self._conn:
+                self._conn.executemany("UPDATE archive SET row = ? WHERE doc_id = ?", [(i, doc_id) for i, (doc_id, _) in enumerate(live)])
+                self._conn.execute("UPDATE archive_info SET value = ? WHERE key = 'rows'", (str(len(live)),))
+                self._conn.execute("UPDATE archive_info SET value = ? WHERE key = 'generation'", (str(self._generation + 1),))
+            self._generation += 1
+            self._rows = len(live)
+            self._mmap = None
+            if os.path.exists(old_path):
+                os.remove(old_path)
+            logger.info(f"Compacted embedding archive {self.db_path}: {old_rows} -> {len(live)} rows.")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"rows": self._rows, "live": len(self), "bytes": self._rows * self._row_bytes}
+
+    def flush(self):
+        """ fsync the row file; called at index checkpoints. """
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM archive")
+            self._conn.execute("UPDATE archive_info SET value = '0' WHERE key = 'rows'")
+            self._rows = 0
+            self._mmap = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def close(self):
+        with self._lock:
+            self._mmap = None
+            self._conn.close()
+
+    def data_files(self) -> List[str]:
+        return [self.path, self.db_path, self.db_path + "-wal", self.db_path + "-shm"]
+
+def embed_documents(documents: Sequence[str], archives: Iterable[Optional[EmbeddingArchive]], encode: Callable[[List[str]], np.ndarray],
+                    model_name: Optional[str]) -> np.ndarray:
+    """
+    Embeddings of documents: the archived vector of an identical document is reused when its archive was written
+    with model_name, and only the remaining documents are passed to encode.
+    """
+    vectors: List[Optional[np.ndarray]] = [None] * len(documents)
+    for archive in archives:
+        if archive is None or archive.model_name != model_name:
+            continue
+        pending = [i for i, vector in enumerate(vectors) if vector is None]
+        if not pending:
+            break
+        archived, found = archive.lookup_documents([documents[i] for i in pending])
+        for i, vector, hit in zip(pending, archived, found):
+            if hit:
+                vectors[i] = vector
+    pending = [i for i, vector in enumerate(vectors) if vector is None]
+    if pending:
+        for i, vector in zip(pending, encode([documents[i] for i in pending])):
+            vectors[i] = vector
+    if len(pending) < len(documents):
+        logger.debug(f"Reused {len(documents) - len(pending)} archived embeddings, encoded {len(pending)} documents.")
+    return np.array(vectors, dtype='float32')
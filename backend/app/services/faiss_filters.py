@@ -0,0 +1,241 @@
+import logging
+import threading
+import numpy as np
+from typing import List, Tuple, Optional, Dict, Any, Set, Iterable
+from app.services.faiss_idmap import CompactIdMap
+from app.services.faiss_trigram import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Metadata keys that get a hash index unless a collection configures its own list
+DEFAULT_METADATA_INDEX_KEYS = ["content_hash", "jira_ticket_id", "msg_jira_id", "source"]
+
+_COMPARISON_OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+
+
+def _matches_condition(value: Any, condition: Any, present: bool) -> bool:
+    """ Evaluate a single field condition: a plain value (equality) or a {"$op": operand} dict. """
+    if not isinstance(condition, dict):
+        return present and value == condition
+    for operator, operand in condition.items():
+        if operator == "$eq":
+            ok = present and value == operand
+        elif operator == "$ne":
+            ok = not present or value != operand
+        elif operator == "$in":
+            ok = present and value in operand
+        elif operator == "$nin":
+            ok = not present or value not in operand
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            if not present:
+                return False
+            try:
+                ok = {"$gt": value > operand, "$gte": value >= operand, "$lt": value < operand, "$lte": value <= operand}[operator]
+            except TypeError:
+                return False
+        else:
+            logger.warning(f"Unsupported where operator: {operator}")
+            return False
+        if not ok:
+            return False
+    return True
+
+def matches_where(metadata: Optional[Dict[str, Any]], where: Dict[str, Any]) -> bool:
+    """ Chroma-compatible metadata filter: field equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin, $and and $or. """
+    if not where:
+        return True
+    if metadata is None:
+        return False
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif not _matches_condition(metadata.get(key), condition, key in metadata):
+            return False
+    return True
+
+def matches_where_document(document: Optional[str], where_document: Dict[str, Any]) -> bool:
+    """
+    Chroma-compatible document filter: $contains, $not_contains, $and and $or, plus $phrase, a substring match
+    that ignores case and whitespace differences (e.g. a stack trace pasted with other line breaks).
+    """
+    if not where_document:
+        return True
+    if document is None:
+        return False
+    for operator, operand in where_document.items():
+        if operator == "$contains":
+            ok = operand in document
+        elif operator == "$not_contains":
+            ok = operand not in document
+        elif operator == "$phrase":
+            ok = normalize_text(operand) in normalize_text(document)
+        elif operator == "$and":
+            ok = all(matches_where_document(document, clause) for clause in operand)
+        elif operator == "$or":
+            ok = any(matches_where_document(document, clause) for clause in operand)
+        else:
+            logger.warning(f"Unsupported where_document filter: {operator}")
+            return False
+        if not ok:
+            return False
+    return True
+
+
+def _hashable(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(value)
+    if isinstance(value, dict):
+        return None
+    return value
+
+class MetadataIndex:
+    """
+    Columnar indexes on selected metadata keys of a FAISS collection. Each key is an int32 column aligned to
+    the slots of the collection's CompactIdMap, holding codes into a table of interned values, so a value
+    repeated across records ("source", "collection_name", ...) is stored once.
+    resolve() answers equality, $in, $and and $or clauses on those keys without scanning the metadata store.
+    """
+    def __init__(self, keys: Iterable[str], id_map: CompactIdMap):
+        self.keys = list(dict.fromkeys(keys))
+        self.id_map = id_map
+        self._lock = threading.Lock()
+        for key in self.keys:
+            id_map.add_column(self._column_name(key))
+        self._reset_values()
+
+    @staticmethod
+    def _column_name(key: str) -> str:
+        return f"metadata:{key}"
+
+    def _reset_values(self):
+        self._values: Dict[str, List[Any]] = {key: [] for key in self.keys} # code -> value
+        self._codes: Dict[str, Dict[Any, int]] = {key: {} for key in self.keys} # value -> code
+
+    def _intern(self, key: str, value: Any) -> int:
+        code = self._codes[key].get(value)
+        if code is None:
+            code = self._codes[key][value] = len(self._values[key])
+            self._values[key].append(value)
+        return code
+
+    def add(self, doc_id: str, metadata: Optional[Dict[str, Any]]):
+        """ Index the metadata of a record; the doc id must already be in the id map. """
+        if not metadata:
+            return
+        with self._lock:
+            slot = self.id_map.slot_of(doc_id)
+            if slot < 0:
+                return
+            for key in self.keys:
+                if key in metadata:
+                    value = _hashable(metadata[key])
+                    if value is not None:
+                        self.id_map.set_value(self._column_name(key), slot, self._intern(key, value))
+
+    def add_values(self, doc_id: str, values: Dict[str, Any]):
+        """ Like add(), but with only the indexed keys already extracted (used when building from the store). """
+        self.add(doc_id, {key: value for key, value in values.items() if value is not None})
+
+    def remove(self, doc_id: str, metadata: Optional[Dict[str, Any]]):
+        """ Unindex the metadata of a record. Freed id map slots are unindexed by the map itself. """
+        if not metadata:
+            return
+        with self._lock:
+            slot = self.id_map.slot_of(doc_id)
+            if slot < 0:
+                return
+            for key in self.keys:
+                if key in metadata:
+                    self.id_map.set_value(self._column_name(key), slot, -1)
+
+    def clear(self):
+        with self._lock:
+            self._reset_values()
+            for key in self.keys:
+                self.id_map.reset_column(self._column_name(key))
+
+    def lookup(self, key: str, value: Any) -> Set[str]:
+        return self.lookup_any(key, [value])
+
+    def lookup_any(self, key: str, values: Iterable[Any]) -> Set[str]:
+        """ Doc ids whose value for key is one of values, from one scan of the key's column. """
+        with self._lock:
+            codes = [code for code in (self._codes[key].get(_hashable(value)) for value in values) if code is not None]
+            if not codes:
+                return set()
+            column = self.id_map.column(self._column_name(key))
+            matches = column == codes[0] if len(codes) == 1 else np.isin(column, codes)
+            return set(self.id_map.doc_ids_at(np.flatnonzero(matches)))
+
+    def resolve(self, where: Optional[Dict[str, Any]]) -> Tuple[Optional[Set[str]], bool]:
+        """
+        Resolve a where clause against the indexes.
+        Returns (candidate_ids, exact): candidate_ids is None when the clause needs a full scan;
+        exact is False when the candidates still have to be checked with matches_where.
+        """
+        if not where:
+            return None, False
+        candidates = None
+        exact = True
+        for key, condition in where.items():
+            if key == "$and":
+                ids, part_exact = self._resolve_all([clause for clause in condition])
+            elif key == "$or":
+                ids, part_exact = self._resolve_any(condition)
+            else:
+                ids, part_exact = self._resolve_field(key, condition)
+            if ids is None:
+                exact = False
+                continue
+            candidates = ids if candidates is None else candidates & ids
+            exact = exact and part_exact
+        if candidates is None:
+            return None, False
+        return candidates, exact
+
+    def _resolve_all(self, clauses: List[Dict[str, Any]]) -> Tuple[Optional[Set[str]], bool]:
+        candidates = None
+        exact = True
+        for clause in clauses:
+            ids, part_exact = self.resolve(clause)
+            if ids is None:
+                exact = False
+                continue
+            candidates = ids if candidates is None else candidates & ids
+            exact = exact and part_exact
+        return candidates, exact and candidates is not None
+
+    def _resolve_any(self, clauses: List[Dict[str, Any]]) -> Tuple[Optional[Set[str]], bool]:
+        candidates = set()
+        exact = True
+        for clause in clauses:
+            ids, part_exact = self.resolve(clause)
+            if ids is None:
+                return None, False # One unindexed branch means any document could match
+            candidates |= ids
+            exact = exact and part_exact
+        return candidates, exact
+
+    def _resolve_field(self, key: str, condition: Any) -> Tuple[Optional[Set[str]], bool]:
+        if key not in self._codes:
+            return None, False
+        if not isinstance(condition, dict):
+            return self.lookup(key, condition), True
+        if set(condition) == {"$eq"}:
+            return self.lookup(key, condition["$eq"]), True
+        if set(condition) == {"$in"}:
+            return self.lookup_any(key, condition["$in"]), True
+        return None, False
+
+    def stats(self) -> Dict[str, int]:
+        """ Number of distinct values in use per indexed key. """
+        with self._lock:
+            stats = {}
+            for key in self.keys:
+                column = self.id_map.column(self._column_name(key))
+                stats[key] = len(np.unique(column[column >= 0]))
+            return stats
@@ -0,0 +1,288 @@
+import numpy as np
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Slots appended since the sorted hash table was built are found through a dict until it holds this many
+MIN_TAIL_SIZE = 1024
+# Freed slots are reclaimed once there are this many, and they make up a quarter of all slots
+MIN_COMPACT_SLOTS = 1024
+_INITIAL_CAPACITY = 1024
+_AVERAGE_DOC_ID_BYTES = 32
+
+def _grow(array: np.ndarray, size: int, fill=None) -> np.ndarray:
+    """ array with room for at least size items (capacity doubles, so appends are amortized O(1)). """
+    if size <= len(array):
+        return array
+    grown = np.empty(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    if fill is not None:
+        grown[len(array):] = fill
+    return grown
+
+class CompactIdMap:
+    """
+    Bidirectional doc id <-> internal id map of a FAISS collection, held in NumPy arrays instead of two
+    dicts of boxed ints and strings. Each record has a slot holding its internal id (ids are assigned in
+    increasing order, so slots are sorted by internal id), its doc id as UTF-8 bytes in one shared buffer,
+    and the hash of its doc id. Doc ids are found through a sorted hash table plus a small dict of the slots
+    appended since the table was built; internal ids by binary search.
+    Other per-record data can be kept in int32 columns aligned to the slots (see MetadataIndex); they are
+    compacted together with the map. Callers serialize writes (the collection's write lock).
+    """
+    def __init__(self):
+        self._columns: Dict[str, np.ndarray] = {}
+        self.by_doc_id = DocIdView(self)
+        self.by_internal_id = InternalIdView(self)
+        self.clear()
+
+    def clear(self):
+        self._size = 0 # Slots in use, live or freed
+        self._live = 0
+        self._internal = np.empty(_INITIAL_CAPACITY, dtype='int64')
+        self._hashes = np.empty(_INITIAL_CAPACITY, dtype='int64')
+        self._alive = np.zeros(_INITIAL_CAPACITY, dtype='bool')
+        self._offsets = np.zeros(_INITIAL_CAPACITY + 1, dtype='int64') # Doc id of slot i: _blob[_offsets[i]:_offsets[i + 1]]
+        self._blob = np.empty(_INITIAL_CAPACITY * _AVERAGE_DOC_ID_BYTES, dtype='uint8')
+        self._sorted_hashes = np.empty(0, dtype='int64')
+        self._sorted_slots = np.empty(0, dtype='int64')
+        self._tail: Dict[str, int] = {}
+        for name in self._columns:
+            self._columns[name] = np.full(_INITIAL_CAPACITY, -1, dtype='int32')
+
+    def __len__(self) -> int:
+        return self._live
+
+    def load(self, pairs: Iterable[Tuple[int, str]]):
+        """ Replace the map with (internal_id, doc_id) pairs, e.g. the id pairs of the metadata store. """
+        pairs = sorted(pairs)
+        self.clear()
+        if not pairs:
+            return
+        encoded = [doc_id.encode("utf-8") for _, doc_id in pairs]
+        n = len(pairs)
+        self._internal = np.fromiter((internal_id for internal_id, _ in pairs), dtype='int64', count=n)
+        self._hashes = np.fromiter((hash(doc_id) for _, doc_id in pairs), dtype='int64', count=n)
+        self._alive = np.ones(n, dtype='bool')
+        self._offsets = np.zeros(n + 1, dtype='int64')
+        np.cumsum(np.fromiter((len(raw) for raw in encoded), dtype='int64', count=n), out=self._offsets[1:])
+        self._blob = np.frombuffer(b"".join(encoded), dtype='uint8').copy()
+        self._size = self._live = n
+        for name in self._columns:
+            self._columns[name] = np.full(n, -1, dtype='int32')
+        self._build_hash_table()
+
+    def slot_of(self, doc_id: str) -> int:
+        """ Slot of a live doc id, or -1. """
+        slot = self._tail.get(doc_id)
+        if slot is not None:
+            return slot
+        target = hash(doc_id)
+        return self._probe(doc_id, target, int(self._sorted_hashes.searchsorted(target)))
+
+    def _probe(self, doc_id: str, target: int, position: int) -> int:
+        """ Walk the sorted hash table from position over the entries with hash target. """
+        while position < len(self._sorted_hashes) and self._sorted_hashes[position] == target:
+            slot = int(self._sorted_slots[position])
+            if self._alive[slot] and self._doc_at(slot) == doc_id:
+                return slot
+            position += 1
+        return -1
+
+    def _slot_of_internal(self, internal_id: int) -> int:
+        """ Slot holding an internal id (live or freed), or -1. """
+        slot = int(np.searchsorted(self._internal[:self._size], internal_id))
+        if slot < self._size and self._internal[slot] == internal_id:
+            return slot
+        return -1
+
+    def _doc_at(self, slot: int) -> str:
+        return self._blob[self._offsets[slot]:self._offsets[slot + 1]].tobytes().decode("utf-8")
+
+    def get_internal(self, doc_id: str) -> Optional[int]:
+        slot = self.slot_of(doc_id)
+        return int(self._internal[slot]) if slot >= 0 else None
+
+    def get_doc(self, internal_id: int) -> Optional[str]:
+        slot = self._slot_of_internal(int(internal_id))
+        return self._doc_at(slot) if slot >= 0 and self._alive[slot] else None
+
+    def internal_ids_for(self, doc_ids: Iterable[str]) -> np.ndarray:
+        """ Internal ids of doc ids, -1 for unknown ones. The hash table is searched for the whole batch at once. """
+        doc_ids = list(doc_ids)
+        targets = np.fromiter((hash(doc_id) for doc_id in doc_ids), dtype='int64', count=len(doc_ids))
+        positions = self._sorted_hashes.searchsorted(targets)
+        result = np.full(len(doc_ids), -1, dtype='int64')
+        for i, doc_id in enumerate(doc_ids):
+            slot = self._tail.get(doc_id)
+            if slot is None:
+                slot = self._probe(doc_id, int(targets[i]), int(positions[i]))
+            if slot >= 0:
+                result[i] = self._internal[slot]
+        return result
+
+    def doc_ids_for(self, internal_ids: np.ndarray) -> List[Optional[str]]:
+        """ Doc ids of internal ids (e.g. a row of FAISS search results), None for -1 and unknown ids. """
+        internal_ids = np.asarray(internal_ids, dtype='int64')
+        slots = np.searchsorted(self._internal[:self._size], internal_ids)
+        clipped = np.minimum(slots, max(self._size - 1, 0))
+        found = (slots < self._size) & (internal_ids >= 0)
+        if self._size:
+            found &= (self._internal[clipped] == internal_ids) & self._alive[clipped]
+        return [self._doc_at(int(slot)) if ok else None for slot, ok in zip(clipped, found)]
+
+    def doc_ids_at(self, slots: np.ndarray) -> List[str]:
+        return [self._doc_at(int(slot)) for slot in slots]
+
+    def internal_ids(self) -> np.ndarray:
+        """ Sorted internal ids of all live records. """
+        return self._internal[:self._size][self._alive[:self._size]]
+
+    def max_internal_id(self) -> int:
+        return int(self._internal[self._size - 1]) if self._size else -1
+
+    def items(self) -> Iterator[Tuple[int, str]]:
+        """ (internal_id, doc_id) of the live records, in internal id order. """
+        for slot in np.flatnonzero(self._alive[:self._size]):
+            yield int(self._internal[slot]), self._doc_at(int(slot))
+
+    def assign(self, doc_id: str, internal_id: int):
+        """ Map doc_id to a new internal id, above every id assigned so far; a previous mapping of doc_id is freed. """
+        if internal_id <= self.max_internal_id():
+            raise ValueError(f"Internal id {internal_id} is not above the last assigned id {self.max_internal_id()}.")
+        previous = self.slot_of(doc_id)
+        if previous >= 0:
+            self._free(previous)
+        raw = doc_id.encode("utf-8")
+        slot = self._size
+        self._internal = _grow(self._internal, slot + 1)
+        self._hashes = _grow(self._hashes, slot + 1)
+        self._alive = _grow(self._alive, slot + 1, fill=False)
+        self._offsets = _grow(self._offsets, slot + 2)
+        end = self._offsets[slot] + len(raw)
+        self._blob = _grow(self._blob, int(end))
+        self._blob[self._offsets[slot]:end] = np.frombuffer(raw, dtype='uint8')
+        self._offsets[slot + 1] = end
+        self._internal[slot] = internal_id
+        self._hashes[slot] = hash(doc_id)
+        self._alive[slot] = True
+        for name, column in self._columns.items():
+            column = self._columns[name] = _grow(column, slot + 1, fill=-1)
+            column[slot] = -1
+        self._size += 1
+        self._live += 1
+        self._tail[doc_id] = slot
+        if len(self._tail) > max(MIN_TAIL_SIZE, self._size // 8):
+            self._build_hash_table()
+
+    def restore(self, doc_id: str, internal_id: int):
+        """ Map doc_id back to an internal id it held before (rolling back a failed write), if its slot still exists. """
+        slot = self._slot_of_internal(int(internal_id))
+        if slot < 0 or self._alive[slot] or self._doc_at(slot) != doc_id:
+            raise KeyError(f"Internal id {internal_id} of '{doc_id}' cannot be restored.")
+        current = self.slot_of(doc_id)
+        if current >= 0:
+            self._free(current)
+        self._alive[slot] = True
+        self._live += 1
+        self._tail[doc_id] = slot
+
+    def remove_doc(self, doc_id: str) -> Optional[int]:
+        """ Drop the mapping of doc_id; returns its internal id, or None if it was unknown. """
+        slot = self.slot_of(doc_id)
+        if slot < 0:
+            return None
+        self._free(slot)
+        return int(self._internal[slot])
+
+    def _free(self, slot: int):
+        self._alive[slot] = False
+        self._live -= 1
+        for column in self._columns.values():
+            column[slot] = -1
+        doc_id = self._doc_at(slot)
+        if self._tail.get(doc_id) == slot:
+            del self._tail[doc_id]
+
+    def _build_hash_table(self):
+        slots = np.flatnonzero(self._alive[:self._size])
+        order = np.argsort(self._hashes[slots], kind='stable')
+        self._sorted_slots = slots[order]
+        self._sorted_hashes = self._hashes[self._sorted_slots]
+        self._tail = {}
+
+    def maybe_compact(self):
+        """ Reclaim the slots of removed and superseded records once they are numerous enough; slot numbers change. """
+        freed = self._size - self._live
+        if freed < MIN_COMPACT_SLOTS or freed * 4 < self._size:
+            return
+        keep = self._alive[:self._size]
+        lengths = np.diff(self._offsets[:self._size + 1])
+        self._blob = self._blob[:self._offsets[self._size]][np.repeat(keep, lengths)]
+        self._offsets = np.concatenate(([0], np.cumsum(lengths[keep]))).astype('int64')
+        self._internal = self._internal[:self._size][keep]
+        self._hashes = self._hashes[:self._size][keep]
+        for name, column in self._columns.items():
+            self._columns[name] = column[:self._size][keep]
+        self._size = self._live
+        self._alive = np.ones(self._size, dtype='bool')
+        self._build_hash_table()
+
+    def add_column(self, name: str):
+        """ Register an int32 per-record column (-1 = no value) kept aligned with the slots. """
+        if name not in self._columns:
+            self._columns[name] = np.full(max(len(self._internal), 1), -1, dtype='int32')
+
+    def column(self, name: str) -> np.ndarray:
+        """ The column over the slots in use; freed slots hold -1. """
+        return self._columns[name][:self._size]
+
+    def set_value(self, name: str, slot: int, value: int):
+        self._columns[name][slot] = value
+
+    def reset_column(self, name: str):
+        self._columns[name][:] = -1
+
+    def nbytes(self) -> int:
+        """ Memory held by the map and its columns. """
+        arrays = [self._internal, self._hashes, self._alive, self._offsets, self._blob, self._sorted_hashes, self._sorted_slots, *self._columns.values()]
+        return int(sum(array.nbytes for array in arrays))
+
+class DocIdView(Mapping):
+    """ Read-only doc id -> internal id view of a CompactIdMap, for code written against the former dict. """
+    def __init__(self, id_map: CompactIdMap):
+        self._id_map = id_map
+
+    def __getitem__(self, doc_id: str) -> int:
+        internal_id = self._id_map.get_internal(doc_id)
+        if internal_id is None:
+            raise KeyError(doc_id)
+        return internal_id
+
+    def __contains__(self, doc_id) -> bool:
+        return isinstance(doc_id, str) and self._id_map.slot_of(doc_id) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return (doc_id for _, doc_id in self._id_map.items())
+
+    def __len__(self) -> int:
+        return len(self._id_map)
+
+class InternalIdView(Mapping):
+    """ Read-only internal id -> doc id view of a CompactIdMap. """
+    def __init__(self, id_map: CompactIdMap):
+        self._id_map = id_map
+
+    def __getitem__(self, internal_id: int) -> str:
+        doc_id = self._id_map.get_doc(internal_id)
+        if doc_id is None:
+            raise KeyError(internal_id)
+        return doc_id
+
+    def __contains__(self, internal_id) -> bool:
+        return self._id_map.get_doc(internal_id) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return (int(internal_id) for internal_id in self._id_map.internal_ids())
+
+    def __len__(self) -> int:
+        return len(self._id_map)
@@ -0,0 +1,393 @@
+import faiss
+import numpy as np
+import os
+import json
+import logging
+from typing import Optional, Dict, Any, Tuple, List
+from pydantic import BaseModel
+from app.core.config import settings
+from app.services.faiss_filters import DEFAULT_METADATA_INDEX_KEYS
+
+logger = logging.getLogger(__name__)
+
+INDEX_CONFIG_FILENAME = "index_config.json"
+SUPPORTED_INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+IVF_INDEX_TYPES = ("ivf_flat", "ivf_pq")
+# Same metric names as Chroma's "hnsw:space"; cosine stores L2-normalized vectors in an inner-product index
+SUPPORTED_METRICS = ("l2", "cosine", "ip")
+# In-RAM vector storage: float16 / int8 use a scalar quantizer, binary one sign bit per dimension (IndexLSH)
+SUPPORTED_STORAGE = ("float32", "float16", "int8", "binary")
+_SQ_TYPES = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+# Collection metadata keys understood by FaissIndexConfig.from_metadata, e.g. {"faiss:index_type": "hnsw"}
+METADATA_PREFIX = "faiss:"
+# Upper bound for the efSearch widening applied to filtered HNSW searches
+MAX_FILTERED_EF_SEARCH = 1024
+# Filtered HNSW searches over at most this many candidates are answered by brute force instead
+EXACT_FILTER_MAX_CANDIDATES = 4096
+# Relative slack added to range_search radii so hits exactly at a distance cutoff are kept
+RADIUS_MARGIN = 1e-5
+# Sharded collections place documents by a hash of their id, or by a timestamp in their metadata
+SUPPORTED_SHARD_BY = ("hash", "time")
+# Metadata keys tried in order for time sharding and tiering (issues, Confluence pages and .msg imports name it differently)
+DEFAULT_SHARD_TIME_KEYS = ["created_at", "created_date", "msg_received_date"]
+
+class FaissIndexConfig(BaseModel):
+    """ Per-collection FAISS index settings, persisted next to index.faiss. """
+    index_type: str = "flat"
+    metric: str = "l2"
+    storage: str = "float32"
+    rescore_factor: int = 4
+    nlist: int = 1024
+    nprobe: int = 16
+    pq_m: int = 16
+    pq_nbits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    train_sample_size: int = 100000
+    min_train_size: int = 10000
+    metadata_index_keys: List[str] = DEFAULT_METADATA_INDEX_KEYS
+    trigram_index: bool = True
+    shards: int = 1
+    shard_by: str = "hash"
+    shard_time_keys: List[str] = DEFAULT_SHARD_TIME_KEYS
+    shard_time_span_days: int = 30
+    tiering: bool = False
+    hot_days: int = 180
+    promote_hits: int = 3
+
+    @classmethod
+    def from_settings(cls, **overrides) -> 'FaissIndexConfig':
+        """ Build a config from the FAISS_* settings, applying any explicit overrides. """
+        values = {
+            "index_type": settings.FAISS_INDEX_TYPE,
+            "metric": settings.FAISS_METRIC,
+            "storage": settings.FAISS_STORAGE,
+            "rescore_factor": settings.FAISS_RESCORE_FACTOR,
+            "nlist": settings.FAISS_NLIST,
+            "nprobe": settings.FAISS_NPROBE,
+            "pq_m": settings.FAISS_PQ_M,
+            "hnsw_m": settings.FAISS_HNSW_M,
+            "ef_search": settings.FAISS_EF_SEARCH,
+            "train_sample_size": settings.FAISS_TRAIN_SAMPLE_SIZE,
+            "min_train_size": settings.FAISS_MIN_TRAIN_SIZE,
+            "metadata_index_keys": settings.FAISS_METADATA_INDEX_KEYS,
+            "trigram_index": settings.FAISS_TRIGRAM_INDEX,
+            "shards": settings.FAISS_SHARDS,
+            "shard_by": settings.FAISS_SHARD_BY,
+            "tiering": settings.FAISS_TIERING,
+            "hot_days": settings.FAISS_HOT_TIER_DAYS,
+            "promote_hits": settings.FAISS_TIER_PROMOTE_HITS,
+        }
+        values.update({k: v for k, v in overrides.items() if v is not None})
+        config = cls(**values)
+        config.validate_type()
+        return config
+
+    @classmethod
+    def from_metadata(cls, metadata: Optional[Dict[str, Any]]) -> Optional['FaissIndexConfig']:
+        """
+        Build a config from Chroma-style collection metadata ({"faiss:index_type": "ivf_pq", "faiss:nprobe": 32}).
+        Chroma's own {"hnsw:space": "cosine"} selects the metric. Returns None if the metadata carries no FAISS options.
+        """
+        if not metadata:
+            return None
+        overrides = {k[len(METADATA_PREFIX):]: v for k, v in metadata.items() if k.startswith(METADATA_PREFIX)}
+        if "hnsw:space" in metadata and "metric" not in overrides:
+            overrides["metric"] = metadata["hnsw:space"]
+        if not overrides:
+            return None
+        unknown = set(overrides) - set(cls.model_fields)
+        if unknown:
+            raise ValueError(f"Unknown FAISS collection options: {sorted(unknown)}")
+        return cls.from_settings(**overrides)
+
+    def validate_type(self):
+        if self.index_type not in SUPPORTED_INDEX_TYPES:
+            raise ValueError(f"Unsupported FAISS index type '{self.index_type}'. Expected one of {SUPPORTED_INDEX_TYPES}.")
+        if self.metric not in SUPPORTED_METRICS:
+            raise ValueError(f"Unsupported FAISS metric '{self.metric}'. Expected one of {SUPPORTED_METRICS}.")
+        if self.storage not in SUPPORTED_STORAGE:
+            raise ValueError(f"Unsupported FAISS storage '{self.storage}'. Expected one of {SUPPORTED_STORAGE}.")
+        if self.storage == "binary" and self.index_type != "flat":
+            raise ValueError("Binary storage is only available for the flat index type.")
+        if self.storage != "float32" and self.index_type == "ivf_pq":
+            raise ValueError("ivf_pq already stores compressed codes; use storage 'float32' with it.")
+        if self.shards < 1:
+            raise ValueError(f"A FAISS collection needs at least one shard, got {self.shards}.")
+        if self.shard_by not in SUPPORTED_SHARD_BY:
+            raise ValueError(f"Unsupported FAISS shard placement '{self.shard_by}'. Expected one of {SUPPORTED_SHARD_BY}.")
+        if self.tiering and self.shards > 1:
+            raise ValueError("A FAISS collection is either sharded or split into hot and cold tiers, not both.")
+        if self.hot_days < 1:
+            raise ValueError(f"The hot tier must span at least one day, got {self.hot_days}.")
+
+    @property
+    def requires_training(self) -> bool:
+        return self.index_type in IVF_INDEX_TYPES
+
+    @property
+    def quantized(self) -> bool:
+        return self.storage != "float32"
+
+    @property
+    def faiss_metric(self) -> int:
+        return faiss.METRIC_L2 if self.metric == "l2" else faiss.METRIC_INNER_PRODUCT
+
+
+def load_index_config(collection_path: str) -> Optional[FaissIndexConfig]:
+    """ Read the persisted index config of a collection, if any. """
+    config_path = os.path.join(collection_path, INDEX_CONFIG_FILENAME)
+    if not os.path.exists(config_path):
+        return None
+    try:
+        with open(config_path, "r") as f:
+            return FaissIndexConfig(**json.load(f))
+    except Exception as e:
+        logger.error(f"Could not read FAISS index config from {config_path}: {e}")
+        return None
+
+def save_index_config(collection_path: str, config: FaissIndexConfig):
+    """ Persist the index config of a collection alongside its index file. """
+    config_path = os.path.join(collection_path, INDEX_CONFIG_FILENAME)
+    try:
+        os.makedirs(collection_path, exist_ok=True)
+        with open(config_path, "w") as f:
+            json.dump(config.model_dump(), f, indent=2)
+    except Exception as e:
+        logger.error(f"Could not write FAISS index config to {config_path}: {e}")
+
+def build_index(config: FaissIndexConfig, dimension: int, training_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    Create an empty IndexIDMap for the configured index type and storage.
+    IVF types need training vectors; without them a flat staging index is returned,
+    which the collection trains and converts once enough vectors have been added.
+    int8 storage is trained on training_vectors when given, otherwise on the first batch added.
+    """
+    metric = config.faiss_metric
+    sq_type = _SQ_TYPES.get(config.storage)
+    if config.index_type == "hnsw":
+        if sq_type is not None:
+            base_index = faiss.IndexHNSWSQ(dimension, sq_type, config.hnsw_m, metric)
+        else:
+            base_index = faiss.IndexHNSWFlat(dimension, config.hnsw_m, metric)
+        base_index.hnsw.efConstruction = config.ef_construction
+        base_index.hnsw.efSearch = config.ef_search
+    elif config.requires_training and training_vectors is not None and len(training_vectors) > 0:
+        # Keep at least ~39 training points per centroid, as recommended by FAISS
+        nlist = max(1, min(config.nlist, len(training_vectors) // 39))
+        quantizer = faiss.IndexFlat(dimension, metric)
+        if config.index_type == "ivf_pq":
+            if dimension % config.pq_m != 0:
+                raise ValueError(f"pq_m ({config.pq_m}) must divide the embedding dimension ({dimension}).")
+            base_index = faiss.IndexIVFPQ(quantizer, dimension, nlist, config.pq_m, config.pq_nbits, metric)
+        elif sq_type is not None:
+            base_index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, sq_type, metric)
+        else:
+            base_index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+        base_index.train(np.ascontiguousarray(training_vectors, dtype='float32'))
+        base_index.nprobe = min(config.nprobe, nlist)
+        logger.info(f"Trained {config.index_type} index with {nlist} lists on {len(training_vectors)} vectors.")
+    elif config.storage == "binary":
+        # Random rotation + sign bits: d bits per vector, searched by Hamming distance
+        base_index = faiss.IndexLSH(dimension, dimension, True, False)
+    elif sq_type is not None:
+        base_index = faiss.IndexScalarQuantizer(dimension, sq_type, metric)
+    else:
+        base_index = faiss.IndexFlat(dimension, metric)
+    if not base_index.is_trained and training_vectors is not None and len(training_vectors) > 0:
+        base_index.train(np.ascontiguousarray(training_vectors, dtype='float32'))
+    return faiss.IndexIDMap(base_index)
+
+def prepare_vectors(config: FaissIndexConfig, vectors: np.ndarray) -> np.ndarray:
+    """ Contiguous float32 copy of vectors as stored/searched: L2-normalized for cosine collections. """
+    vectors = np.array(vectors, dtype='float32', order='C')
+    if config.metric == "cosine" and len(vectors):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+def to_distances(config: FaissIndexConfig, raw_scores: np.ndarray) -> np.ndarray:
+    """
+    Convert FAISS search output to Chroma-style distances: L2 for l2 collections (FAISS returns it squared),
+    1 - similarity for cosine and ip collections (so smaller is closer everywhere).
+    """
+    if config.metric == "l2":
+        return np.sqrt(np.maximum(raw_scores, 0))
+    return 1.0 - raw_scores
+
+def to_search_radius(config: FaissIndexConfig, max_distance: float) -> float:
+    """
+    Inverse of to_distances: the FAISS range_search radius matching a Chroma-style distance cutoff.
+    range_search excludes hits exactly on the radius, so it is widened by a rounding margin; callers cut exactly afterwards.
+    """
+    if config.metric == "l2":
+        return float(max_distance) ** 2 * (1 + RADIUS_MARGIN) + RADIUS_MARGIN
+    return 1.0 - float(max_distance) - RADIUS_MARGIN
+
+def read_index(path: str, mmap: bool = False) -> faiss.Index:
+    """
+    Read an index file. With mmap=True the vector and code arrays are mapped from the file
+    instead of copied, so processes serving the same file share page-cache pages.
+    A mapped index must not be mutated: FAISS aborts on writes to mapped arrays.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) # IFC also maps flat and HNSW storage
+    return faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+
+def index_kind(index: Optional[faiss.Index]) -> str:
+    """ Index type name of an IndexIDMap-wrapped index, in FaissIndexConfig.index_type terms. """
+    if index is None:
+        return "none"
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, (faiss.IndexFlat, faiss.IndexScalarQuantizer, faiss.IndexLSH)):
+        return "flat"
+    return type(inner).__name__
+
+def storage_kind(index: Optional[faiss.Index]) -> str:
+    """ Vector storage of an IndexIDMap-wrapped index, in FaissIndexConfig.storage terms. """
+    if index is None:
+        return "none"
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, faiss.IndexLSH):
+        return "binary"
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return {faiss.ScalarQuantizer.QT_fp16: "float16", faiss.ScalarQuantizer.QT_8bit: "int8"}.get(inner.sq.qtype, "sq")
+    return "float32"
+
+def search_parameters(config: FaissIndexConfig, index: faiss.Index, selectivity: float = 1.0, **kwargs) -> Optional[faiss.SearchParameters]:
+    """
+    Per-query search parameters (nprobe / efSearch) for the index.
+    selectivity is the fraction of vectors an ID selector lets through; nprobe and efSearch
+    are widened accordingly so filtered searches still find k neighbours.
+    Extra kwargs (e.g. sel=IDSelector) are passed through to the parameter object.
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    widen = 1.0 / max(selectivity, 1e-6)
+    if isinstance(inner, faiss.IndexIVF):
+        nprobe = int(np.ceil(config.nprobe * widen))
+        return faiss.SearchParametersIVF(nprobe=max(1, min(nprobe, inner.nlist)), **kwargs)
+    if isinstance(inner, faiss.IndexHNSW):
+        ef_search = int(np.ceil(config.ef_search * widen))
+        return faiss.SearchParametersHNSW(efSearch=max(config.ef_search, min(ef_search, MAX_FILTERED_EF_SEARCH)), **kwargs)
+    if kwargs:
+        return faiss.SearchParameters(**kwargs)
+    return None
+
+def build_id_selector(internal_ids: np.ndarray, id_bound: int) -> faiss.IDSelector:
+    """
+    IDSelector for a set of internal ids: a bitmap over [0, id_bound) when the set is dense
+    enough for the bitmap to be smaller than a hash set, IDSelectorBatch otherwise.
+    """
+    internal_ids = np.ascontiguousarray(internal_ids, dtype='int64')
+    # A bitmap costs id_bound / 8 bytes; IDSelectorBatch roughly 16 bytes per id
+    if id_bound > 0 and id_bound // 8 <= len(internal_ids) * 16:
+        bitmap = np.zeros((id_bound + 7) // 8, dtype='uint8')
+        np.bitwise_or.at(bitmap, internal_ids >> 3, (1 << (internal_ids & 7)).astype('uint8'))
+        selector = faiss.IDSelectorBitmap(bitmap)
+        selector.referenced_objects = [bitmap] # The selector only keeps a pointer to the bitmap
+        return selector
+    return faiss.IDSelectorBatch(internal_ids)
+
+def build_exclusion_selector(excluded_ids: np.ndarray, id_bound: int) -> faiss.IDSelector:
+    """ IDSelector letting through every id except excluded_ids (e.g. the tombstones of deleted vectors). """
+    inner = build_id_selector(excluded_ids, id_bound)
+    selector = faiss.IDSelectorNot(inner)
+    selector.referenced_objects = [inner] # IDSelectorNot does not own the selector it wraps
+    return selector
+
+def exact_search_subset(index: faiss.Index, queries: np.ndarray, internal_ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Brute-force top-k restricted to internal_ids, for indexes with full-precision storage (flat, HNSW).
+    Used when a filter is so selective that graph search would rarely reach the allowed vectors.
+    Returns (raw scores, internal ids) like Index.search: squared L2, or inner products for IP indexes.
+    """
+    inner = faiss.downcast_index(index.index)
+    id_map = faiss.vector_to_array(index.id_map)
+    positions = np.nonzero(np.isin(id_map, internal_ids))[0]
+    k = min(k, len(positions))
+    if k == 0:
+        return np.full((len(queries), 0), np.inf, dtype='float32'), np.full((len(queries), 0), -1, dtype='int64')
+    vectors = inner.reconstruct_batch(positions)
+    distances, subset_positions = faiss.knn(np.ascontiguousarray(queries, dtype='float32'), vectors, k, metric=index.metric_type)
+    return distances, id_map[positions][subset_positions]
+
+def range_search_top_k(config: FaissIndexConfig, index: faiss.Index, queries: np.ndarray, radius: float, k: int, params: Optional[faiss.SearchParameters] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k best hits within radius (raw score, see to_search_radius) of each query, from one range_search.
+    Vectors outside the radius are never collected, so a strict threshold returns fewer than k hits.
+    Returns (raw scores, internal ids) padded with -1 ids like Index.search.
+    """
+    lims, scores, ids = index.range_search(np.ascontiguousarray(queries, dtype='float32'), radius, params=params)
+    l2 = config.metric == "l2"
+    top_scores = np.full((len(queries), k), np.inf if l2 else -np.inf, dtype='float32')
+    top_ids = np.full((len(queries), k), -1, dtype='int64')
+    for q in range(len(queries)):
+        hit_scores, hit_ids = scores[lims[q]:lims[q + 1]], ids[lims[q]:lims[q + 1]]
+        order = np.argsort(hit_scores if l2 else -hit_scores, kind='stable')[:k]
+        top_scores[q, :len(order)] = hit_scores[order]
+        top_ids[q, :len(order)] = hit_ids[order]
+    return top_scores, top_ids
+
+def reconstruct_ids(index: faiss.Index, internal_ids: np.ndarray) -> np.ndarray:
+    """
+    Vectors stored under the given internal ids of an IndexIDMap, in the order given; unknown ids read as zeros.
+    Exact for flat/HNSW storage, decoded codes for PQ and scalar-quantized storage. IVF indexes need a direct map.
+    """
+    internal_ids = np.asarray(internal_ids, dtype='int64')
+    result = np.zeros((len(internal_ids), index.d), dtype='float32')
+    id_map = faiss.vector_to_array(index.id_map)
+    positions = np.nonzero(np.isin(id_map, internal_ids))[0]
+    if len(positions):
+        row_of = {internal_id: row for row, internal_id in enumerate(internal_ids.tolist())}
+        rows = [row_of[internal_id] for internal_id in id_map[positions].tolist()]
+        result[rows] = faiss.downcast_index(index.index).reconstruct_batch(positions)
+    return result
+
+def extract_vectors(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return (vectors, ids) stored in an IndexIDMap. Exact for flat/HNSW storage,
+    approximate (decoded codes) for PQ indexes.
+    """
+    ids = faiss.vector_to_array(index.id_map).astype('int64')
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype='float32'), ids
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+    vectors = inner.reconstruct_n(0, index.ntotal)
+    return np.asarray(vectors, dtype='float32'), ids
+
+def write_index_atomic(index: faiss.Index, path: str):
+    """
+    Write an index to a temp file and rename it over path, so readers and crash recovery
+    only ever see the old or the new complete file.
+    """
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass # Directory fsync is not supported on every platform
+
+def sample_vectors(vectors: np.ndarray, sample_size: int, seed: int = 1234) -> np.ndarray:
+    """ Random training sample of at most sample_size rows. """
+    if len(vectors) <= sample_size:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[rng.choice(len(vectors), sample_size, replace=False)]
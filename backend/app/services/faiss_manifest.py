@@ -0,0 +1,57 @@
+import os
+import json
+import time
+import logging
+from typing import Optional
+from pydantic import BaseModel
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_FORMAT = 1
+
+def current_model_name() -> str:
+    """ Name of the configured embedding model; a local model path wins, as in get_embedding_model. """
+    return settings.MODEL_LOCAL_PATH or settings.EMBEDDING_MODEL
+
+class CollectionManifest(BaseModel):
+    """
+    Small summary of a FAISS collection, rewritten after every mutation, so listing collections
+    and detecting the embedding dimension never have to load an index or the embedding model.
+    """
+    name: str
+    dimension: int
+    count: int = 0
+    index_type: str = "flat"
+    metric: str = "l2"
+    storage: str = "float32"
+    model_name: Optional[str] = None
+    shards: int = 1
+    version: int = 0 # Incremented on every write to the collection
+    updated_at: float = 0.0
+    format: int = MANIFEST_FORMAT
+
+def load_manifest(collection_path: str) -> Optional[CollectionManifest]:
+    """ Read the manifest of a collection, if any. """
+    manifest_path = os.path.join(collection_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r") as f:
+            return CollectionManifest(**json.load(f))
+    except Exception as e:
+        logger.error(f"Could not read FAISS collection manifest from {manifest_path}: {e}")
+        return None
+
+def save_manifest(collection_path: str, manifest: CollectionManifest):
+    """ Atomically replace the manifest. It is derived data, so it is not fsynced; a stale one is rewritten on load. """
+    manifest_path = os.path.join(collection_path, MANIFEST_FILENAME)
+    manifest.updated_at = time.time()
+    try:
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest.model_dump(), f, indent=2)
+        os.replace(tmp_path, manifest_path)
+    except Exception as e:
+        logger.error(f"Could not write FAISS collection manifest to {manifest_path}: {e}")
@@ -0,0 +1,260 @@
+import os
+import json
+import pickle
+import sqlite3
+import logging
+import threading
+from typing import List, Tuple, Optional, Dict, Any, Iterator, Iterable
+
+logger = logging.getLogger(__name__)
+
+METADATA_DB_FILENAME = "metadata.db"
+LEGACY_METADATA_FILENAME = "metadata.pkl"
+
+# A stored record: (internal_id, doc_id, metadata, document)
+Record = Tuple[int, str, Optional[Dict[str, Any]], Optional[str]]
+
+# SQLite limits the number of bound parameters per statement; batch IN (...) lookups below it
+_SQL_BATCH_SIZE = 500
+
+class FaissMetadataStore:
+    """
+    SQLite sidecar holding the id map, metadata and documents of a FAISS collection.
+    Writes are per record (no full rewrite per mutation) and reads fetch only the rows asked for.
+    With read_only=True an existing database is opened in SQLite's read-only mode.
+    """
+    def __init__(self, db_path: str, read_only: bool = False):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        parent_dir = os.path.dirname(db_path)
+        if parent_dir:
+            os.makedirs(parent_dir, exist_ok=True)
+        self.read_only = read_only and os.path.exists(db_path)
+        if self.read_only:
+            self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                " internal_id INTEGER PRIMARY KEY,"
+                " doc_id TEXT NOT NULL UNIQUE,"
+                " metadata TEXT,"
+                " document TEXT)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.commit()
+
+    @staticmethod
+    def _dump_metadata(metadata: Optional[Dict[str, Any]]) -> Optional[str]:
+        if metadata is None:
+            return None
+        # default=str keeps datetimes and other non-JSON values readable instead of failing the write
+        return json.dumps(metadata, default=str)
+
+    @staticmethod
+    def _load_metadata(raw: Optional[str]) -> Optional[Dict[str, Any]]:
+        return json.loads(raw) if raw is not None else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add_records(self, records: List[Record], next_id: Optional[int] = None):
+        """ Insert or replace records (and optionally the next internal id) in a single transaction. """
+        if not records and next_id is None:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records (internal_id, doc_id, metadata, document) VALUES (?, ?, ?, ?)",
+                [(int(internal_id), doc_id, self._dump_metadata(metadata), document) for internal_id, doc_id, metadata, document in records]
+            )
+            if next_id is not None:
+                self._conn.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('next_id', ?)", (str(next_id),))
+
+    def delete_records(self, doc_ids: List[str]):
+        if not doc_ids:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM records WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records")
+            self._conn.execute("DELETE FROM store_info")
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def id_pairs(self) -> List[Tuple[int, str]]:
+        """ All (internal_id, doc_id) pairs, used to rebuild the in-memory id maps on load. """
+        with self._lock:
+            return self._conn.execute("SELECT internal_id, doc_id FROM records ORDER BY internal_id").fetchall()
+
+    def fetch(self, doc_ids: Iterable[str], fields: Tuple[str, ...] = ("metadata", "document")) -> Dict[str, Dict[str, Any]]:
+        """ Random-access read of the given doc ids. Returns {doc_id: {"metadata": ..., "document": ...}}. """
+        doc_ids = list(dict.fromkeys(doc_ids))
+        columns = ", ".join(("doc_id",) + fields)
+        found = {}
+        with self._lock:
+            for start in range(0, len(doc_ids), _SQL_BATCH_SIZE):
+                batch = doc_ids[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                for row in self._conn.execute(f"SELECT {columns} FROM records WHERE doc_id IN ({placeholders})", batch):
+                    found[row[0]] = self._row_to_fields(row[1:], fields)
+        return found
+
+    def _row_to_fields(self, values, fields) -> Dict[str, Any]:
+        item = {}
+        for field, value in zip(fields, values):
+            item[field] = self._load_metadata(value) if field == "metadata" else value
+        return item
+
+    def get_metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self.fetch([doc_id], ("metadata",)).get(doc_id, {}).get("metadata")
+
+    def get_document(self, doc_id: str) -> Optional[str]:
+        return self.fetch([doc_id], ("document",)).get(doc_id, {}).get("document")
+
+    def iter_records(self, fields: Tuple[str, ...] = ("metadata", "document"), limit: Optional[int] = None, offset: int = 0, batch_size: int = 1000,
+                     after: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Stream (doc_id, fields) in insertion order, with optional SQL-side limit/offset.
+        after starts the stream past that internal id (keyset cursor), without scanning the skipped rows.
+        """
+        columns = ", ".join(("doc_id", "internal_id") + fields)
+        remaining = limit
+        last_internal_id = after
+        skip = offset or 0
+        while remaining is None or remaining > 0:
+            page = batch_size if remaining is None else min(batch_size, remaining)
+            with self._lock:
+                if last_internal_id is None or skip:
+                    rows = self._conn.execute(
+                        f"SELECT {columns} FROM records WHERE internal_id > ? ORDER BY internal_id LIMIT ? OFFSET ?",
+                        (-1 if last_internal_id is None else last_internal_id, page, skip)
+                    ).fetchall()
+                    skip = 0
+                else:
+                    rows = self._conn.execute(
+                        f"SELECT {columns} FROM records WHERE internal_id > ? ORDER BY internal_id LIMIT ?", (last_internal_id, page)
+                    ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], self._row_to_fields(row[2:], fields)
+            last_internal_id = rows[-1][1]
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < page:
+                return
+
+    def iter_documents(self, batch_size: int = 1000) -> Iterator[Tuple[int, str]]:
+        """ Stream (internal_id, document) of the records that have a document, in internal id order (to build text indexes). """
+        last_internal_id = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT internal_id, document FROM records WHERE internal_id > ? AND document IS NOT NULL ORDER BY internal_id LIMIT ?",
+                    (last_internal_id, batch_size)
+                ).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_internal_id = rows[-1][0]
+
+    def metadata_values(self, keys: List[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """ Stream (doc_id, {key: value}) for a few metadata keys, extracted inside SQLite without decoding whole records. """
+        if not keys:
+            return
+        columns = []
+        params = []
+        for key in keys:
+            path = '$."' + key.replace('"', '\\"') + '"'
+            columns.append("json_extract(metadata, ?), json_type(metadata, ?)")
+            params.extend([path, path])
+        with self._lock:
+            rows = self._conn.execute(f"SELECT doc_id, {', '.join(columns)} FROM records WHERE metadata IS NOT NULL", params).fetchall()
+        for row in rows:
+            values = {}
+            for i, key in enumerate(keys):
+                value, value_type = row[1 + 2 * i], row[2 + 2 * i]
+                if value_type is None:
+                    continue
+                if value_type in ("array", "object"):
+                    value = json.loads(value)
+                elif value_type in ("true", "false"):
+                    value = value_type == "true"
+                values[key] = value
+            yield row[0], values
+
+    def get_info(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_info(self, key: str, value: Any):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def migrate_from_pickle(self, pickle_path: str) -> bool:
+        """
+        One-time import of a legacy metadata.pkl. The pickle is renamed to *.migrated afterwards
+        so it is kept as a backup but never imported twice.
+        """
+        if not os.path.exists(pickle_path):
+            return False
+        try:
+            with open(pickle_path, 'rb') as f:
+                saved_data = pickle.load(f)
+        except Exception as e:
+            logger.error(f"Could not read legacy FAISS metadata {pickle_path}: {e}")
+            return False
+        metadata_store = saved_data.get('metadata', {})
+        doc_store = saved_data.get('documents', {})
+        faiss_map = saved_data.get('faiss_map', {})
+        records = [
+            (internal_id, doc_id, metadata_store.get(doc_id), doc_store.get(doc_id))
+            for internal_id, doc_id in faiss_map.items()
+        ]
+        self.add_records(records, next_id=saved_data.get('next_id', 0))
+        os.replace(pickle_path, pickle_path + ".migrated")
+        logger.info(f"Migrated {len(records)} records from {pickle_path} to {self.db_path}")
+        return True
+
+
+class StoreFieldView:
+    """
+    Read-only dict-like view of one field (metadata or document) of a FaissMetadataStore,
+    so existing code using collection.metadata_store / collection.doc_store keeps working.
+    """
+    def __init__(self, store: FaissMetadataStore, field: str):
+        self._store = store
+        self._field = field
+
+    def get(self, doc_id: str, default: Any = None) -> Any:
+        item = self._store.fetch([doc_id], (self._field,)).get(doc_id)
+        if item is None or item[self._field] is None:
+            return default
+        return item[self._field]
+
+    def __getitem__(self, doc_id: str) -> Any:
+        item = self._store.fetch([doc_id], (self._field,)).get(doc_id)
+        if item is None:
+            raise KeyError(doc_id)
+        return item[self._field]
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._store.fetch([doc_id], ())
+
+    def keys(self) -> List[str]:
+        return [doc_id for doc_id, _ in self._store.iter_records(fields=())]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return self._store.count()
@@ -0,0 +1,167 @@
+import faiss
+import time
+import logging
+import threading
+import numpy as np
+from collections import deque
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+from app.services.faiss_index_factory import index_kind
+
+logger = logging.getLogger(__name__)
+
+# store_info key holding the number of vectors the IVF centroids were last trained with
+TRAINED_ON_INFO_KEY = "ivf_trained_on"
+# Recall is measured as recall@RECALL_K of the index against an exact search over the live vectors
+RECALL_K = 10
+# Decisions kept for compaction_stats()
+MAX_DECISIONS = 20
+
+def ivf_of(index) -> Optional[faiss.IndexIVF]:
+    """ The IndexIVF inside an IndexIDMap-wrapped index, or None for other layouts. """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return inner if isinstance(inner, faiss.IndexIVF) else None
+
+def list_imbalance(index) -> Optional[float]:
+    """
+    Imbalance factor of an IVF index's inverted lists: nlist * sum(size^2) / total^2, 1.0 when every list
+    holds the same number of vectors. A search scans about that many times more vectors than a balanced index would.
+    """
+    inner = ivf_of(index)
+    if inner is None:
+        return None
+    sizes = np.array([inner.invlists.list_size(i) for i in range(inner.nlist)], dtype='float64')
+    total = sizes.sum()
+    if total == 0:
+        return None
+    return float(inner.nlist * np.square(sizes).sum() / total ** 2)
+
+def measure_recall(collection, vectors: np.ndarray, ids: np.ndarray, sample_size: int) -> Optional[float]:
+    """
+    Mean recall@RECALL_K of collection queries against an exact k-NN search of the live vectors, with a random
+    sample of those vectors as queries. Each query's own record is held out of both result lists.
+    """
+    if len(ids) <= RECALL_K + 1 or sample_size <= 0:
+        return None
+    rng = np.random.default_rng()
+    sample = rng.choice(len(ids), min(sample_size, len(ids)), replace=False)
+    queries = np.ascontiguousarray(vectors[sample])
+    _, positions = faiss.knn(queries, vectors, RECALL_K + 1, metric=collection.index_config.faiss_metric)
+    with collection._lock.read():
+        approximate = collection._query(queries, RECALL_K + 1, ['distances'], None, None)['ids']
+    own_doc_ids = collection.id_map.doc_ids_for(ids[sample])
+    recalls = []
+    for own, exact_positions, approximate_ids in zip(own_doc_ids, positions, approximate):
+        exact = [doc_id for doc_id in collection.id_map.doc_ids_for(ids[exact_positions[exact_positions >= 0]]) if doc_id != own][:RECALL_K]
+        found = [doc_id for doc_id in approximate_ids if doc_id != own][:RECALL_K]
+        if exact:
+            recalls.append(len(set(exact) & set(found)) / len(exact))
+    return float(np.mean(recalls)) if recalls else None
+
+class IndexOptimizer:
+    """
+    Watches an IVF collection as it grows: every FAISS_OPTIMIZER_INTERVAL_SECONDS a background check compares the
+    live vector count with the count the centroids were trained on, the balance of the inverted lists and the recall
+    measured on a sample of stored vectors. Past FAISS_RETRAIN_GROWTH, FAISS_RETRAIN_IMBALANCE or below
+    FAISS_RETRAIN_MIN_RECALL the collection is compacted with freshly trained centroids (and an nlist sized
+    for its current size), off the request path. Decisions are logged and kept for compaction_stats().
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._checking = False
+        self._last_check = time.monotonic()
+        self._retrains = 0
+        self._decisions: deque = deque(maxlen=MAX_DECISIONS)
+
+    def _applies(self) -> bool:
+        return settings.FAISS_OPTIMIZER and not self.collection.read_only and index_kind(self.collection.index) in ("ivf_flat", "ivf_pq")
+
+    def maybe_check(self):
+        """ Start a background check once FAISS_OPTIMIZER_INTERVAL_SECONDS have passed since the last one. """
+        if time.monotonic() - self._last_check < settings.FAISS_OPTIMIZER_INTERVAL_SECONDS or not self._applies():
+            return
+        with self._lock:
+            if self._checking:
+                return
+            self._checking = True
+            self._last_check = time.monotonic()
+        threading.Thread(target=self._check_in_background, name=f"faiss-optimize-{self.collection.name}", daemon=True).start()
+
+    def _check_in_background(self):
+        try:
+            self.check()
+        except Exception as e:
+            logger.error(f"[{self.collection.name}] FAISS index optimization failed: {e}")
+        finally:
+            self._checking = False
+
+    def check(self, retrain: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Measure the collection and record a decision; with retrain=True a retrain it calls for runs right away
+        (in the calling thread). Returns the decision, or None when the collection is not an IVF one.
+        """
+        collection = self.collection
+        if not self._applies():
+            return None
+        # Only a snapshot under the write lock; the vectors are copied under the read lock, so writes are not held up
+        with collection._lock.write():
+            collection._ensure_writable()
+            generation = collection._index_generation
+            ids = collection._live_ids()
+            nlist = ivf_of(collection.index).nlist
+            imbalance = list_imbalance(collection.index)
+        if not len(ids):
+            return None
+        with collection._lock.read():
+            if collection._index_generation != generation:
+                logger.info(f"[{collection.name}] FAISS index was replaced during the check; measuring it next time.")
+                return None
+            vectors = collection._vectors_of(ids)
+        trained_on = int(collection.store.get_info(TRAINED_ON_INFO_KEY, "0"))
+        if not trained_on:
+            # Trained before the count was recorded: measure growth from now on
+            trained_on = len(ids)
+            collection.store.set_info(TRAINED_ON_INFO_KEY, trained_on)
+        recall = measure_recall(collection, vectors, ids, settings.FAISS_OPTIMIZER_SAMPLE_SIZE)
+        reasons = self._reasons(len(ids), trained_on, imbalance, recall)
+        decision = {
+            "checked_at": time.time(),
+            "vectors": len(ids),
+            "trained_on": trained_on,
+            "nlist": nlist,
+            "imbalance": round(imbalance, 3) if imbalance is not None else None,
+            "recall": round(recall, 4) if recall is not None else None,
+            "action": "retrain" if reasons else "none",
+            "reasons": reasons,
+        }
+        self._decisions.append(decision)
+        if not reasons:
+            logger.info(f"[{collection.name}] FAISS index check: no retraining needed ({decision}).")
+            return decision
+        logger.warning(f"[{collection.name}] FAISS index needs retraining: {'; '.join(reasons)}.")
+        if retrain:
+            compaction = collection.compact(retrain=True)
+            if compaction is not None:
+                self._retrains += 1
+                decision["retrained"] = compaction
+        return decision
+
+    @staticmethod
+    def _reasons(vectors: int, trained_on: int, imbalance: Optional[float], recall: Optional[float]) -> List[str]:
+        reasons = []
+        if vectors >= trained_on * settings.FAISS_RETRAIN_GROWTH:
+            reasons.append(f"grew from {trained_on} to {vectors} vectors since training")
+        if imbalance is not None and imbalance > settings.FAISS_RETRAIN_IMBALANCE:
+            reasons.append(f"list imbalance {imbalance:.2f} above {settings.FAISS_RETRAIN_IMBALANCE}")
+        if recall is not None and recall < settings.FAISS_RETRAIN_MIN_RECALL:
+            reasons.append(f"recall@{RECALL_K} {recall:.3f} below {settings.FAISS_RETRAIN_MIN_RECALL}")
+        return reasons
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._applies(),
+            "checking": self._checking,
+            "retrains": self._retrains,
+            "decisions": list(self._decisions),
+        }
@@ -0,0 +1,118 @@
+import json
+import socket
+import struct
+import numpy as np
+from typing import Any, Dict, Tuple
+from urllib.parse import urlparse
+
+# Wire format shared by faiss_server and faiss_remote. Every message is one frame:
+#   u32 length of the rest | u8 version | u8 kind | u16 array count | u32 JSON length | JSON body | arrays
+# Each array is u8 dtype code | u8 ndim | u32 * ndim shape | raw little-endian data, so embeddings travel
+# as packed float32 instead of JSON number lists. The JSON body lists the array names under "arrays".
+PROTOCOL_VERSION = 1
+KIND_REQUEST = 1
+KIND_OK = 2
+KIND_ERROR = 3
+
+_LENGTH = struct.Struct("!I")
+_HEADER = struct.Struct("!BBHI")
+_ARRAY_HEADER = struct.Struct("!BB")
+_DTYPES = {0: np.dtype('<f4'), 1: np.dtype('<i8')}
+_DTYPE_CODES = {dtype: code for code, dtype in _DTYPES.items()}
+
+class ProtocolError(Exception):
+    pass
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def encode_frame(kind: int, body: Dict[str, Any], arrays: Dict[str, np.ndarray] = None) -> bytes:
+    arrays = arrays or {}
+    if arrays:
+        body = dict(body, arrays=list(arrays))
+    payload = json.dumps(body, default=_json_default, separators=(",", ":")).encode("utf-8")
+    parts = [_HEADER.pack(PROTOCOL_VERSION, kind, len(arrays), len(payload)), payload]
+    for array in arrays.values():
+        array = np.ascontiguousarray(array)
+        dtype = array.dtype.newbyteorder('<') if array.dtype.byteorder == '>' else array.dtype
+        if dtype not in _DTYPE_CODES:
+            array, dtype = array.astype('<f4'), np.dtype('<f4')
+        parts.append(_ARRAY_HEADER.pack(_DTYPE_CODES[dtype], array.ndim))
+        parts.append(struct.pack(f"!{array.ndim}I", *array.shape))
+        parts.append(array.astype(dtype, copy=False).tobytes())
+    rest = b"".join(parts)
+    return _LENGTH.pack(len(rest)) + rest
+
+def split_arrays(result: Any) -> Tuple[Any, Dict[str, np.ndarray]]:
+    """
+    Move the array values of a result dict (e.g. get's embeddings, or query's list of per-query arrays)
+    out of the JSON body, to be sent as binary arrays named "key" or "key.<position>".
+    """
+    if not isinstance(result, dict):
+        return result, {}
+    body, arrays = {}, {}
+    for key, value in result.items():
+        if isinstance(value, np.ndarray):
+            arrays[key] = value
+        elif isinstance(value, list) and value and all(isinstance(item, np.ndarray) for item in value):
+            for position, item in enumerate(value):
+                arrays[f"{key}.{position}"] = item
+        else:
+            body[key] = value
+    return body, arrays
+
+def merge_arrays(result: Any, arrays: Dict[str, np.ndarray]) -> Any:
+    """ Inverse of split_arrays. """
+    for name, array in arrays.items():
+        key, _, position = name.partition(".")
+        if position:
+            result.setdefault(key, []).append(array)
+        else:
+            result[key] = array
+    return result
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("Connection closed by peer.")
+        received += count
+    return bytes(buffer)
+
+def read_frame(sock: socket.socket) -> Tuple[int, Dict[str, Any], Dict[str, np.ndarray]]:
+    """ Read one frame: (kind, JSON body, {name: array}). """
+    (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    data = memoryview(_recv_exactly(sock, length))
+    version, kind, array_count, json_length = _HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version} (expected {PROTOCOL_VERSION}).")
+    offset = _HEADER.size
+    body = json.loads(bytes(data[offset:offset + json_length]))
+    offset += json_length
+    arrays = {}
+    for name in body.pop("arrays", [])[:array_count]:
+        code, ndim = _ARRAY_HEADER.unpack_from(data, offset)
+        offset += _ARRAY_HEADER.size
+        shape = struct.unpack_from(f"!{ndim}I", data, offset)
+        offset += 4 * ndim
+        dtype = _DTYPES[code]
+        size = int(np.prod(shape)) * dtype.itemsize
+        arrays[name] = np.frombuffer(data[offset:offset + size], dtype=dtype).reshape(shape)
+        offset += size
+    return kind, body, arrays
+
+def parse_server_url(url: str) -> Tuple[int, Any]:
+    """ Socket family and address of unix:///path/to.sock or tcp://host:port. """
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return socket.AF_UNIX, parsed.path
+    if parsed.scheme == "tcp" and parsed.hostname and parsed.port:
+        return socket.AF_INET, (parsed.hostname, parsed.port)
+    raise ValueError(f"Unsupported FAISS server URL '{url}'. Expected unix:///path/to.sock or tcp://127.0.0.1:PORT.")
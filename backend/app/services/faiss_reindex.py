@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import numpy as np
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Dict, Any
+from app.core.config import settings
+from app.services.embedding_service import get_embedding_model
+from app.services.faiss_index_factory import FaissIndexConfig, save_index_config
+from app.services.faiss_manifest import CollectionManifest, current_model_name, save_manifest
+from app.services.faiss_metadata_store import METADATA_DB_FILENAME
+
+logger = logging.getLogger(__name__)
+
+# Staging collections are built in base_path/.reindex/<name>; the directory is not a collection itself
+REINDEX_DIRNAME = ".reindex"
+READY_SUFFIX = ".ready" # Marker: the staging collection is complete and being swapped in
+OLD_SUFFIX = ".old" # The replaced collection, removed once the swap is done
+PAGE_SIZE = 1000
+MAX_CATCH_UP_PASSES = 3
+
+def _fingerprint(value: Any) -> bytes:
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode("utf-8"), digest_size=8).digest()
+
+def _adopt(target, source):
+    """ Make target the same collection as source (they share one attribute dict), keeping target's lock when it has the same kind. """
+    lock = target._lock if type(target._lock) is type(source._lock) else source._lock
+    target.__class__ = type(source)
+    target.__dict__ = source.__dict__
+    target._lock = lock
+
+def take_over(live, replacement):
+    """
+    Move a reopened collection into the live collection object after a swap, so references taken before it (cached
+    retrievers, dual-write wrappers, queries waiting on its locks) serve the new collection. Shards of the live
+    collection whose files the replacement reopened take over their counterparts the same way.
+    """
+    replacement_shards = {shard.index_path: shard for shard in getattr(replacement, "shards", [])}
+    for shard in getattr(live, "shards", []):
+        if shard.index_path in replacement_shards:
+            _adopt(shard, replacement_shards[shard.index_path])
+    _adopt(live, replacement)
+
+def recover_interrupted_reindex(base_path: str):
+    """
+    Finish or roll back collection swaps interrupted by a crash, and drop staging collections of unfinished jobs.
+    A swap renames the live directory to .reindex/<name>.old, then the staging directory to <name>.
+    """
+    reindex_path = os.path.join(base_path, REINDEX_DIRNAME)
+    if not os.path.isdir(reindex_path):
+        return
+    for entry in sorted(os.listdir(reindex_path)):
+        path = os.path.join(reindex_path, entry)
+        if not os.path.isdir(path) or entry.endswith(OLD_SUFFIX):
+            continue
+        live_path = os.path.join(base_path, entry)
+        if os.path.exists(path + READY_SUFFIX) and not os.path.exists(live_path):
+            logger.warning(f"Completing the interrupted reindex swap of FAISS collection '{entry}'.")
+            os.rename(path, live_path)
+        else:
+            logger.warning(f"Dropping the staging collection of an unfinished reindex of FAISS collection '{entry}'.")
+            shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(path + READY_SUFFIX):
+            os.remove(path + READY_SUFFIX)
+    for entry in sorted(os.listdir(reindex_path)):
+        if not entry.endswith(OLD_SUFFIX):
+            continue
+        live_path = os.path.join(base_path, entry[:-len(OLD_SUFFIX)])
+        if os.path.exists(live_path):
+            shutil.rmtree(os.path.join(reindex_path, entry), ignore_errors=True)
+        else:
+            logger.warning(f"Restoring FAISS collection '{entry[:-len(OLD_SUFFIX)]}' from an interrupted reindex swap.")
+            os.rename(os.path.join(reindex_path, entry), live_path)
+
+class ReindexJob:
+    """
+    Re-embeds the stored documents of a collection with the configured embedding model. The new vectors go into
+    a staging collection built beside the live one, which keeps serving reads and writes meanwhile. Writes made
+    during the job are caught up by diffing (document, metadata) fingerprints; the last pass and the directory
+    swap run with the live collection frozen, so no write is lost.
+    Given an index_config, the job rebuilds the collection in that layout (index type, storage, metric, shards, ...)
+    instead: vectors are read from the embedding archive and the model is not run; records missing from the
+    archive take the vector stored in the live index.
+    """
+    def __init__(self, client, name: str, index_config: Optional[FaissIndexConfig] = None):
+        self.client = client
+        self.name = name
+        self.index_config = index_config
+        self.mode = "rebuild" if index_config is not None else "reindex"
+        self.model_name = current_model_name()
+        self.status = "pending"
+        self.phase: Optional[str] = None
+        self.total = 0
+        self.processed = 0
+        self.dimension: Optional[int] = None
+        self.previous_model_name: Optional[str] = None
+        self.previous_dimension: Optional[int] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.archive_misses = 0 # Rebuilds only: records whose vector was not in the embedding archive
+        self.staging_path = os.path.join(client.base_path, REINDEX_DIRNAME, name)
+        self._staged: Dict[str, Tuple[bytes, bytes]] = {} # doc_id -> fingerprints of the staged (document, metadata)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"faiss-reindex-{self.name}", daemon=True)
+        self._thread.start()
+
+    def is_running(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "collection_name": self.name,
+            "mode": self.mode,
+            "status": self.status,
+            "phase": self.phase,
+            "model_name": self.model_name,
+            "dimension": self.dimension,
+            "previous_model_name": self.previous_model_name,
+            "previous_dimension": self.previous_dimension,
+            "total": self.total,
+            "processed": self.processed,
+            "progress": round(self.processed / self.total, 4) if self.total else (1.0 if self.status == "completed" else 0.0),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "archive_misses": self.archive_misses,
+        }
+
+    def _run(self):
+        self.status, self.started_at = "running", time.time()
+        staging = None
+        try:
+            live = self.client.get_collection(self.name)
+            if live is None:
+                raise KeyError(f"FAISS collection '{self.name}' does not exist.")
+            self.previous_model_name = live.manifest.model_name if live.manifest else None
+            self.previous_dimension = live.dimension
+            if self.index_config is None:
+                model = get_embedding_model()
+                self.dimension = len(model.encode(["dimension probe"])[0])
+                logger.info(f"[{self.name}] Reindexing {live.count()} records with {self.model_name} "
+                            f"(dimension {self.previous_dimension} -> {self.dimension}) into {self.staging_path}.")
+            else:
+                model = None # Rebuilds keep the collection's vectors and model
+                self.model_name, self.dimension = self.previous_model_name, live.dimension
+                logger.info(f"[{self.name}] Rebuilding {live.count()} records as {self.index_config.index_type}/{self.index_config.storage} "
+                            f"({self.index_config.metric}, {self.index_config.shards} shard(s)) from the embedding archive into {self.staging_path}.")
+            staging = self._open_staging(live)
+            with ThreadPoolExecutor(max_workers=max(1, settings.FAISS_REINDEX_WORKERS), thread_name_prefix=f"faiss-reindex-{self.name}") as executor:
+                self.phase, self.total = "embedding", live.count()
+                version = live.manifest.version
+                self._sync(live, staging, model, executor)
+                # Catch up with writes made meanwhile, until a pass sees none (or the final, frozen pass takes over)
+                self.phase = "catching_up"
+                for _ in range(MAX_CATCH_UP_PASSES):
+                    if live.manifest.version == version:
+                        break
+                    version = live.manifest.version
+                    self._sync(live, staging, model, executor)
+                self.phase = "swapping"
+                self._swap(live, staging, model, executor, version)
+                staging = None
+            self.status, self.phase = "completed", None
+            if model is None:
+                logger.info(f"[{self.name}] Rebuild completed: {self.processed} vectors copied, {self.archive_misses} of them not from the embedding archive.")
+            else:
+                logger.info(f"[{self.name}] Reindex with {self.model_name} completed: {self.processed} documents re-embedded.")
+        except Exception as e:
+            logger.error(f"[{self.name}] {self.mode.capitalize()} failed: {e}")
+            self.status, self.error = "failed", str(e)
+            if staging is not None:
+                try:
+                    staging.close()
+                except Exception as close_error: # Already closed by a failed swap
+                    logger.debug(f"[{self.name}] Closing the staging collection: {close_error}")
+            if not os.path.exists(self.staging_path + READY_SUFFIX): # Otherwise the swap is completed on the next start
+                shutil.rmtree(self.staging_path, ignore_errors=True)
+        finally:
+            self.finished_at = time.time()
+
+    def _open_staging(self, live):
+        """
+        Empty collection with the live collection's index options (or the rebuild's), at the new model's dimension.
+        Its manifests are seeded with the job's model, which a rebuild takes over from the live collection.
+        """
+        from app.services.faiss_client import FaissCollection # Local imports: these modules use this one
+        from app.services.faiss_sharded import SHARD_DIR_FORMAT, ShardedFaissCollection
+        from app.services.faiss_tiered import TIER_DIRS, TieredFaissCollection
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+        config = self.index_config or live.index_config
+        if config.tiering:
+            parts = list(TIER_DIRS)
+        else:
+            parts = [SHARD_DIR_FORMAT.format(i) for i in range(config.shards) if config.shards > 1]
+        paths = [self.staging_path] + [os.path.join(self.staging_path, part) for part in parts]
+        for path in paths:
+            os.makedirs(path)
+            save_manifest(path, CollectionManifest(name=self.name, dimension=self.dimension, index_type=config.index_type, metric=config.metric,
+                                                   storage=config.storage, model_name=self.model_name, shards=config.shards if path == self.staging_path else 1))
+        if parts:
+            save_index_config(self.staging_path, config)
+            collection_class = TieredFaissCollection if config.tiering else ShardedFaissCollection
+            return collection_class(self.name, self.staging_path, self.dimension, config, read_only=False, use_mmap=False)
+        return FaissCollection(self.name, os.path.join(self.staging_path, "index.faiss"), os.path.join(self.staging_path, METADATA_DB_FILENAME),
+                               self.dimension, index_config=config, read_only=False, use_mmap=False)
+
+    def _sync(self, live, staging, model, executor: ThreadPoolExecutor):
+        """ One pass over the live records: embed new or changed documents, copy metadata changes, drop deletions. """
+        seen = set()
+        pending: List[Tuple[str, Optional[str], Optional[Dict[str, Any]], bool]] = []
+        flush_size = max(1, settings.FAISS_REINDEX_BATCH_SIZE) * max(1, settings.FAISS_REINDEX_WORKERS)
+        cursor = None
+        while True:
+            records, cursor = live.browse(cursor=cursor, limit=PAGE_SIZE, include=['metadatas', 'documents'])
+            for record in records:
+                doc_id, document, metadata = record["id"], record.get("document"), record.get("metadata")
+                seen.add(doc_id)
+                fingerprint = (_fingerprint(document), _fingerprint(metadata))
+                staged = self._staged.get(doc_id)
+                if staged == fingerprint:
+                    continue
+                if document is None and model is not None:
+                    raise ValueError(f"Record '{doc_id}' has no stored document to re-embed.")
+                pending.append((doc_id, document, metadata, staged is None or staged[0] != fingerprint[0]))
+                self._staged[doc_id] = fingerprint
+            if len(pending) >= flush_size or cursor is None:
+                self._write(live, staging, model, executor, pending)
+                pending = []
+            if cursor is None:
+                break
+        removed = [doc_id for doc_id in self._staged if doc_id not in seen]
+        if removed:
+            staging.delete(ids=removed)
+            for doc_id in removed:
+                del self._staged[doc_id]
+
+    def _write(self, live, staging, model, executor: ThreadPoolExecutor, pending: List[Tuple[str, Optional[str], Optional[Dict[str, Any]], bool]]):
+        to_embed = [item for item in pending if item[3]]
+        metadata_only = [item for item in pending if not item[3]]
+        if to_embed:
+            if self.phase != "embedding":
+                self.total += len(to_embed)
+            batch_size = max(1, settings.FAISS_REINDEX_BATCH_SIZE)
+            batches = [to_embed[i:i + batch_size] for i in range(0, len(to_embed), batch_size)]
+            if model is None:
+                encode = lambda batch: self._archived_vectors(live, [doc_id for doc_id, _, _, _ in batch])
+            else:
+                encode = lambda batch: model.encode([document for _, document, _, _ in batch])
+            # Batches are encoded (or read from the archive) concurrently and written in order; the model releases the GIL
+            for batch, vectors in zip(batches, executor.map(encode, batches)):
+                staging.upsert(ids=[doc_id for doc_id, _, _, _ in batch], embeddings=vectors,
+                               metadatas=[metadata for _, _, metadata, _ in batch], documents=[document for _, document, _, _ in batch])
+                self.processed += len(batch)
+        if metadata_only:
+            staging.upsert(ids=[doc_id for doc_id, _, _, _ in metadata_only], metadatas=[metadata for _, _, metadata, _ in metadata_only],
+                           documents=[document for _, document, _, _ in metadata_only])
+
+    def _archived_vectors(self, live, doc_ids: List[str]) -> np.ndarray:
+        """ Vectors of a rebuild batch: archived as written, else the copy stored in the live index. """
+        vectors, found = live.archived_embeddings(doc_ids)
+        if not found.all():
+            missing = [doc_id for doc_id, hit in zip(doc_ids, found) if not hit]
+            stored = live.get(ids=missing, include=['embeddings'])
+            by_id = dict(zip(stored["ids"], stored["embeddings"]))
+            for position in np.flatnonzero(~found):
+                if doc_ids[position] in by_id: # Otherwise deleted meanwhile; the next pass drops it
+                    vectors[position] = by_id[doc_ids[position]]
+            self.archive_misses += len(missing)
+        return vectors
+
+    def _swap(self, live, staging, model, executor: ThreadPoolExecutor, version: int):
+        """ Freeze the live collection, apply its last writes, and move the staging collection into its place. """
+        client = self.client
+        collection_path = os.path.join(client.base_path, self.name)
+        old_path = self.staging_path + OLD_SUFFIX
+        with client._collections_lock:
+            with live.frozen():
+                if live.manifest.version != version:
+                    self._sync(live, staging, model, executor)
+                staging.checkpoint()
+                staging.close()
+                with ExitStack() as held:
+                    for shard in getattr(live, "shards", [live]):
+                        held.enter_context(shard.frozen()) # Readers too wait until the new collection is in place
+                    retired_executor = getattr(live, "_executor", None)
+                    if retired_executor is not None:
+                        live.close_shards() # The thread pool keeps serving queries already submitted to it
+                    else:
+                        live.close()
+                    client.collections.pop(self.name, None)
+                    # Two renames; recover_interrupted_reindex completes or undoes them after a crash in between
+                    open(self.staging_path + READY_SUFFIX, "w").close()
+                    os.rename(collection_path, old_path)
+                    os.rename(self.staging_path, collection_path)
+                    os.remove(self.staging_path + READY_SUFFIX)
+                    client._dimension = None # Re-read from the manifests, which now name the new model
+                    take_over(live, client._open_collection(self.name))
+                    client.collections[self.name] = live
+                    if retired_executor is not None:
+                        retired_executor.shutdown(wait=False)
+            shutil.rmtree(old_path, ignore_errors=True)
@@ -0,0 +1,164 @@
+import socket
+import logging
+import threading
+import numpy as np
+from typing import List, Tuple, Optional, Dict, Any
+from app.core.config import settings
+from app.services.embedding_service import get_embedding_model
+from app.services.faiss_protocol import KIND_REQUEST, KIND_ERROR, encode_frame, read_frame, parse_server_url, merge_arrays
+
+logger = logging.getLogger(__name__)
+
+# Server-side exception types re-raised as themselves in the worker; anything else becomes a RuntimeError
+_ERROR_TYPES = {"ValueError": ValueError, "KeyError": KeyError, "RuntimeError": RuntimeError, "PermissionError": PermissionError}
+
+class RemoteFaissCollection:
+    """ Proxy for a collection served by the FAISS index server; mirrors the FaissCollection API. """
+    index_path = None # The index files belong to the server process
+
+    def __init__(self, client: 'RemoteFaissClient', name: str, metadata: Optional[Dict[str, Any]] = None):
+        self._client = client
+        self.name = name
+        self._metadata = metadata or {}
+
+    def _call(self, method: str, arrays: Optional[Dict[str, np.ndarray]] = None, **kwargs) -> Any:
+        return self._client._call(method, collection=self.name, arrays=arrays, **kwargs)
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
+        if not ids or embeddings is None or len(embeddings) == 0:
+            logger.warning(f"[{self.name}] Add called with empty ids or embeddings.")
+            return
+        self._call("add", arrays={"embeddings": np.asarray(embeddings, dtype='float32')}, ids=list(ids), metadatas=metadatas, documents=documents)
+
+    def upsert(self, ids: List[str], embeddings: Optional[List[List[float]]] = None, metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
+        if not ids:
+            logger.warning(f"[{self.name}] Upsert called with empty ids.")
+            return
+        if embeddings is None and documents is not None:
+            # Embed in the worker, so the index server never spends its time on the model
+            embeddings = get_embedding_model().encode(list(documents))
+        arrays = {"embeddings": np.asarray(embeddings, dtype='float32')} if embeddings is not None else None
+        self._call("upsert", arrays=arrays, ids=list(ids), metadatas=metadatas, documents=documents)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, include: List[str] = ['metadatas', 'documents', 'distances'], where: Optional[Dict] = None, where_document: Optional[Dict] = None, max_distance: Optional[float] = None, full_history: bool = False) -> Dict[str, List[Any]]:
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype='float32'))
+        return self._call("query", arrays={"query_embeddings": queries}, n_results=n_results, include=include, where=where, where_document=where_document,
+                          max_distance=max_distance, full_history=full_history)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, limit: Optional[int] = None, offset: Optional[int] = None, where_document: Optional[Dict[str, Any]] = None, include: List[str] = ['metadatas', 'documents']) -> Dict[str, List[Any]]:
+        return self._call("get", ids=ids, where=where, limit=limit, offset=offset, where_document=where_document, include=include)
+
+    def browse(self, cursor: Optional[str] = None, limit: int = 100, include: List[str] = ['metadatas', 'documents']) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        records, next_cursor = self._call("browse", cursor=cursor, limit=limit, include=include)
+        return records, next_cursor
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, where_document: Optional[Dict[str, Any]] = None) -> List[str]:
+        return self._call("delete", ids=ids, where=where, where_document=where_document)
+
+    def count(self) -> int:
+        return self._call("count")
+
+    def clear(self):
+        self._call("clear")
+
+    def compact(self, background: bool = False) -> Optional[Dict[str, Any]]:
+        return self._call("compact", background=background)
+
+    def compaction_stats(self) -> Dict[str, Any]:
+        return self._call("compaction_stats")
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """ Read once from the server when the proxy is created; it only changes when the collection is rebuilt. """
+        return dict(self._metadata)
+
+class RemoteFaissClient:
+    """
+    Client for the standalone FAISS index server (FAISS_SERVER_URL), a drop-in for FaissClient in API workers.
+    Each thread keeps its own connection, so concurrent requests in a worker do not serialize on one socket.
+    """
+    def __init__(self, url: str, timeout: Optional[float] = None):
+        self.url = url
+        self.timeout = timeout if timeout is not None else settings.FAISS_SERVER_TIMEOUT_SECONDS
+        self._family, self._address = parse_server_url(url)
+        self._local = threading.local()
+        logger.info(f"Remote FAISS client for index server {url}")
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(self._family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self._address)
+        except OSError as e:
+            sock.close()
+            logger.error(f"Could not connect to FAISS index server at {self.url}: {e}")
+            raise
+        if self._family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _close_connection(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _call(self, method: str, collection: Optional[str] = None, arrays: Optional[Dict[str, np.ndarray]] = None, **kwargs) -> Any:
+        frame = encode_frame(KIND_REQUEST, {"method": method, "collection": collection, "kwargs": kwargs}, arrays)
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            reused = sock is not None
+            if sock is None:
+                sock = self._local.sock = self._connect()
+            try:
+                sock.sendall(frame)
+                kind, body, arrays = read_frame(sock)
+                break
+            except (ConnectionError, OSError) as e:
+                self._close_connection()
+                # A pooled connection may have been closed by a server restart; retry once on a fresh one.
+                # Timeouts are not retried: the server may still be working on the request.
+                if not reused or attempt or isinstance(e, socket.timeout):
+                    logger.error(f"FAISS index server call {method} on '{collection}' failed: {e}")
+                    raise
+        if kind == KIND_ERROR:
+            raise _ERROR_TYPES.get(body.get("type"), RuntimeError)(body.get("message"))
+        return merge_arrays(body.get("result"), arrays)
+
+    def list_collections(self) -> List[Dict[str, Any]]:
+        return self._call("list_collections")
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> RemoteFaissCollection:
+        description = self._call("get_or_create_collection", name=name, metadata=metadata)
+        return RemoteFaissCollection(self, description["name"], description.get("metadata"))
+
+    def get_collection(self, name: str) -> Optional[RemoteFaissCollection]:
+        description = self._call("get_collection", name=name)
+        return RemoteFaissCollection(self, description["name"], description.get("metadata")) if description else None
+
+    def delete_collection(self, name: str):
+        self._call("delete_collection", name=name)
+
+    def checkpoint(self):
+        self._call("checkpoint")
+
+    def collection_stats(self) -> List[Dict[str, Any]]:
+        return self._call("collection_stats")
+
+    def collection_summaries(self) -> List[Dict[str, Any]]:
+        return self._call("collection_summaries")
+
+    def reindex_collection(self, name: str) -> Dict[str, Any]:
+        return self._call("reindex_collection", name=name)
+
+    def rebuild_collection(self, name: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self._call("rebuild_collection", name=name, options=options)
+
+    def reindex_status(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._call("reindex_status", name=name)
+
+    def get_collections_with_records(self) -> List[Dict[str, Any]]:
+        return self._call("get_collections_with_records")
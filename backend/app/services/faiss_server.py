@@ -0,0 +1,131 @@
+import os
+import sys
+import signal
+import socket
+import logging
+import threading
+import socketserver
+from typing import Any, Dict, Optional
+from app.core.config import settings
+from app.services.faiss_client import FaissClient
+from app.services.faiss_protocol import KIND_REQUEST, KIND_OK, KIND_ERROR, encode_frame, read_frame, parse_server_url, split_arrays
+
+logger = logging.getLogger(__name__)
+
+# Methods a worker may call, on the client or on one collection; everything else is refused
+CLIENT_METHODS = {
+    "list_collections", "get_or_create_collection", "get_collection", "delete_collection",
+    "checkpoint", "collection_summaries", "collection_stats", "get_collections_with_records",
+    "reindex_collection", "rebuild_collection", "reindex_status",
+}
+COLLECTION_METHODS = {
+    "add", "upsert", "query", "get", "delete", "count", "clear", "browse",
+    "compact", "compaction_stats",
+}
+
+def _describe(collection) -> Optional[Dict[str, Any]]:
+    """ What a worker needs to build a RemoteFaissCollection. """
+    if collection is None:
+        return None
+    return {"name": collection.name, "metadata": collection.metadata}
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """ One worker connection: frames are read and answered in order until the worker disconnects. """
+    def handle(self):
+        while True:
+            try:
+                kind, body, arrays = read_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            if kind != KIND_REQUEST:
+                logger.warning(f"FAISS index server: ignoring frame of kind {kind}.")
+                continue
+            try:
+                result, result_arrays = split_arrays(self.server.index_server.dispatch(body, arrays))
+                response = encode_frame(KIND_OK, {"result": result}, result_arrays)
+            except Exception as e:
+                logger.error(f"FAISS index server: {body.get('method')} on '{body.get('collection')}' failed: {e}")
+                response = encode_frame(KIND_ERROR, {"type": type(e).__name__, "message": str(e)})
+            try:
+                self.request.sendall(response)
+            except OSError:
+                return
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FaissIndexServer:
+    """
+    Owns the FAISS collections of one index path and serves them to API worker processes over a
+    Unix socket or localhost TCP, so every worker shares a single copy of each index in memory
+    and writes never race between processes. Workers talk to it through RemoteFaissClient.
+    """
+    def __init__(self, client: FaissClient, url: str):
+        self.client = client
+        self.url = url
+        family, address = parse_server_url(url)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address) # Stale socket from a previous run
+            self._server = _UnixServer(address, _RequestHandler)
+        else:
+            if address[0] not in ("127.0.0.1", "localhost", "::1"):
+                logger.warning(f"FAISS index server listening on non-loopback address {address[0]}; the protocol is unauthenticated.")
+            self._server = _TCPServer(address, _RequestHandler)
+        self._server.index_server = self
+        logger.info(f"FAISS index server for {client.base_path} listening on {url}")
+
+    def dispatch(self, body: Dict[str, Any], arrays: Dict[str, Any]) -> Any:
+        method = body.get("method")
+        kwargs = dict(body.get("kwargs") or {})
+        kwargs.update(arrays) # Embeddings arrive as binary arrays rather than JSON lists
+        name = body.get("collection")
+        if name is None:
+            if method not in CLIENT_METHODS:
+                raise ValueError(f"Unknown FAISS client method '{method}'.")
+            result = getattr(self.client, method)(**kwargs)
+            if method in ("get_or_create_collection", "get_collection"):
+                return _describe(result)
+            return result
+        if method not in COLLECTION_METHODS:
+            raise ValueError(f"Unknown FAISS collection method '{method}'.")
+        collection = self.client.get_collection(name)
+        if collection is None:
+            raise KeyError(f"FAISS collection '{name}' does not exist.")
+        return getattr(collection, method)(**kwargs)
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """ Stop serving and checkpoint every collection so no write-ahead log is left to replay. """
+        self._server.shutdown()
+        self._server.server_close()
+        self.client.checkpoint()
+        family, address = parse_server_url(self.url)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+
+def main(url: Optional[str] = None):
+    from app.core.logging_config import setup_logging
+    setup_logging()
+    url = url or settings.FAISS_SERVER_URL
+    if not url:
+        raise SystemExit("Set FAISS_SERVER_URL or pass the server URL, e.g. unix:///tmp/support-buddy-faiss.sock")
+    server = FaissIndexServer(FaissClient(settings.FAISS_INDEX_PATH), url)
+
+    def stop(signum, frame):
+        logger.info(f"FAISS index server: received signal {signum}, shutting down.")
+        # shutdown() waits for serve_forever to return, so it cannot run on the serving thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,381 @@
+import os
+import zlib
+import heapq
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Dict, Any, Callable
+from app.core.config import settings
+from app.services.embedding_service import get_embedding_model
+from app.services.faiss_client import FaissCollection
+from app.services.faiss_embedding_archive import embed_documents
+from app.services.faiss_index_factory import FaissIndexConfig, INDEX_CONFIG_FILENAME
+from app.services.faiss_manifest import MANIFEST_FILENAME, CollectionManifest, current_model_name, load_manifest, save_manifest
+from app.services.faiss_metadata_store import METADATA_DB_FILENAME
+
+logger = logging.getLogger(__name__)
+
+SHARD_DIR_FORMAT = "shard_{:03d}"
+
+def metadata_timestamp(metadata: Optional[Dict[str, Any]], keys: List[str]) -> Optional[float]:
+    """ Epoch seconds of the first readable time value among keys of a record's metadata, or None. """
+    for key in keys if metadata else []:
+        timestamp = _timestamp(metadata.get(key))
+        if timestamp is not None:
+            return timestamp
+    return None
+
+def _timestamp(value: Any) -> Optional[float]:
+    """ Epoch seconds of a metadata time value (epoch number, datetime or ISO string), or None if it cannot be read. """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+class ShardedFaissCollection:
+    """
+    A FAISS collection spread over N FaissCollection shards, each with its own index, metadata store and
+    write-ahead log in a shard_NNN/ subdirectory. Documents are placed by a stable hash of their id, or by
+    the timestamp in their metadata (shard_by="time"), so recent documents share a shard.
+    Queries fan out to all shards on a thread pool and the per-shard top-k lists are merged with a heap;
+    load, rebuild, compaction and checkpoints run per shard in parallel.
+    """
+    def __init__(self, name: str, collection_path: str, dimension: int, index_config: FaissIndexConfig,
+                 read_only: Optional[bool] = None, use_mmap: Optional[bool] = None):
+        self.name = name
+        self.collection_path = collection_path
+        self.dimension = dimension
+        self.index_config = index_config
+        self.read_only = settings.FAISS_READ_ONLY if read_only is None else read_only
+        shard_paths = self._shard_paths()
+        self._executor = ThreadPoolExecutor(max_workers=min(len(shard_paths), os.cpu_count() or 1), thread_name_prefix=f"faiss-{name}")
+        # Serializes placement decisions of writes; each shard guards its own index and maps
+        self._lock = threading.RLock()
+        shard_config = index_config.model_copy(update={"shards": 1, "tiering": False})
+
+        def open_shard(i: int) -> FaissCollection:
+            os.makedirs(shard_paths[i], exist_ok=True)
+            return FaissCollection(f"{name}[{i}]", os.path.join(shard_paths[i], "index.faiss"),
+                                   os.path.join(shard_paths[i], METADATA_DB_FILENAME), dimension, index_config=shard_config,
+                                   read_only=read_only, use_mmap=self._shard_use_mmap(i, use_mmap))
+
+        # Shards load (and replay or rebuild their indexes) in parallel
+        self.shards: List[FaissCollection] = list(self._executor.map(open_shard, range(len(shard_paths))))
+        self.manifest: Optional[CollectionManifest] = load_manifest(collection_path)
+        self._write_manifest(if_changed=True)
+        logger.info(f"Loaded FAISS collection '{name}' ({self._layout()}, {self.count()} records)")
+
+    def _layout(self) -> str:
+        return f"{len(self.shards)} shards by {self.index_config.shard_by}"
+
+    def _shard_paths(self) -> List[str]:
+        return [os.path.join(self.collection_path, SHARD_DIR_FORMAT.format(i)) for i in range(self.index_config.shards)]
+
+    def _shard_use_mmap(self, i: int, use_mmap: Optional[bool]) -> Optional[bool]:
+        return use_mmap
+
+    def _map(self, fn: Callable[[FaissCollection], Any]) -> List[Any]:
+        """ Run fn on every shard on the thread pool; results in shard order. """
+        return list(self._executor.map(fn, self.shards))
+
+    def _shard_for(self, doc_id: str, metadata: Optional[Dict[str, Any]]) -> int:
+        """ Shard a new document is placed in. Time placement falls back to the id hash when no timestamp is found. """
+        timestamp = metadata_timestamp(metadata, self.index_config.shard_time_keys) if self.index_config.shard_by == "time" else None
+        if timestamp is not None:
+            return int(timestamp // (self.index_config.shard_time_span_days * 86400)) % len(self.shards)
+        return zlib.crc32(doc_id.encode("utf-8")) % len(self.shards)
+
+    def _locate(self, doc_ids: List[str]) -> Dict[str, int]:
+        """ Shard currently holding each of the given ids (ids not stored anywhere are left out). """
+        located = {}
+        for i, shard in enumerate(self.shards):
+            for doc_id in doc_ids:
+                if doc_id in shard.doc_id_to_faiss_id:
+                    located[doc_id] = i
+        return located
+
+    @staticmethod
+    def _rows(values: Optional[List[Any]], positions: List[int]) -> Optional[List[Any]]:
+        return [values[p] for p in positions] if values else None
+
+    def _write_manifest(self, if_changed: bool = False):
+        """ Aggregate manifest in the collection directory, so FaissClient lists the whole collection without loading it. """
+        if self.read_only:
+            return
+        previous = self.manifest
+        manifest = CollectionManifest(
+            name=self.name,
+            dimension=self.dimension,
+            count=self.count(),
+            index_type=self.index_config.index_type,
+            metric=self.index_config.metric,
+            storage=self.index_config.storage,
+            model_name=previous.model_name if previous and previous.model_name else current_model_name(),
+            shards=self.index_config.shards,
+            version=previous.version if previous else 0,
+        )
+        if if_changed and previous is not None and manifest.model_dump(exclude={"updated_at"}) == previous.model_dump(exclude={"updated_at"}):
+            return
+        manifest.version += 1
+        save_manifest(self.collection_path, manifest)
+        self.manifest = manifest
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
+        """ Add new records, each to its shard. Ids that already exist are skipped, as in ChromaDB. """
+        if not ids or embeddings is None or len(embeddings) == 0:
+            logger.warning(f"[{self.name}] Add called with empty ids or embeddings.")
+            return
+        self.shards[0]._validate_batch(ids, embeddings, metadatas, documents)
+        with self._lock:
+            existing = self._locate(ids)
+            groups: Dict[int, List[int]] = {}
+            for position, doc_id in enumerate(ids):
+                if doc_id not in existing:
+                    groups.setdefault(self._shard_for(doc_id, metadatas[position] if metadatas else None), []).append(position)
+            self._map_groups(groups, lambda shard, rows: shard.add(
+                [ids[p] for p in rows], [embeddings[p] for p in rows], self._rows(metadatas, rows), self._rows(documents, rows)))
+            self._write_manifest()
+
+    def upsert(self, ids: List[str], embeddings: Optional[List[List[float]]] = None, metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
+        """
+        Chroma-style upsert across shards. A record whose new metadata places it in another shard (time placement)
+        is moved there. Metadata-only updates stay in the record's current shard.
+        """
+        if not ids:
+            logger.warning(f"[{self.name}] Upsert called with empty ids.")
+            return
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"[{self.name}] Upsert ids must be unique.")
+        if embeddings is None and documents is not None:
+            # Embed once here rather than once per shard; identical documents archived in any shard are reused
+            embeddings = embed_documents(list(documents), [shard.embedding_archive for shard in self.shards],
+                                         lambda texts: get_embedding_model().encode(texts), current_model_name())
+        self.shards[0]._validate_batch(ids, embeddings, metadatas, documents)
+        with self._lock:
+            existing = self._locate(ids)
+            groups: Dict[int, List[int]] = {}
+            moved: Dict[int, List[int]] = {}
+            for position, doc_id in enumerate(ids):
+                current = existing.get(doc_id)
+                if current is not None and (embeddings is None or metadatas is None):
+                    target = current
+                else:
+                    target = self._shard_for(doc_id, metadatas[position] if metadatas else None)
+                if current is not None and target != current:
+                    moved.setdefault(current, []).append(position)
+                groups.setdefault(target, []).append(position)
+            if moved:
+                # A moved record keeps its stored document unless the upsert replaces it
+                documents = list(documents) if documents else [None] * len(ids)
+                for shard_index, rows in moved.items():
+                    stored = self.shards[shard_index].store.fetch([ids[p] for p in rows], ("document",))
+                    for p in rows:
+                        if documents[p] is None:
+                            documents[p] = stored.get(ids[p], {}).get("document")
+                self._map_groups(moved, lambda shard, rows: shard.delete(ids=[ids[p] for p in rows]))
+            self._map_groups(groups, lambda shard, rows: shard.upsert(
+                [ids[p] for p in rows], [embeddings[p] for p in rows] if embeddings is not None else None,
+                self._rows(metadatas, rows), self._rows(documents, rows)))
+            self._write_manifest()
+
+    def _map_groups(self, groups: Dict[int, List[Any]], fn: Callable[[FaissCollection, List[Any]], Any]) -> Dict[int, Any]:
+        """ Apply fn to each shard and its group (batch positions or ids) in parallel; returns {shard index: result}. """
+        shard_indexes = sorted(groups)
+        return dict(zip(shard_indexes, self._executor.map(lambda i: fn(self.shards[i], groups[i]), shard_indexes)))
+
+    def _group_by_shard(self, doc_ids: List[str]) -> Dict[int, List[str]]:
+        """ Existing ids grouped by the shard holding them. """
+        located = self._locate(doc_ids)
+        groups: Dict[int, List[str]] = {}
+        for doc_id in dict.fromkeys(doc_ids):
+            if doc_id in located:
+                groups.setdefault(located[doc_id], []).append(doc_id)
+        return groups
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, include: List[str] = ['metadatas', 'documents', 'distances'], where: Optional[Dict] = None, where_document: Optional[Dict] = None, max_distance: Optional[float] = None, full_history: bool = False) -> Dict[str, List[Any]]:
+        """
+        Query every shard in parallel for its top n_results and merge the sorted per-shard lists with a heap.
+        Only the merged top n_results are hydrated with metadata, documents and stored embeddings.
+        max_distance is applied inside each shard's search (see FaissCollection.query); every shard is always searched,
+        so full_history changes nothing.
+        """
+        if len(query_embeddings) == 0 or self.count() == 0:
+            return {'ids': [], 'distances': [], 'metadatas': [], 'documents': [], 'embeddings': []}
+        n_queries = len(np.atleast_2d(np.array(query_embeddings, dtype='float32')))
+        partials = self._map(lambda shard: shard.query(query_embeddings, n_results=n_results, include=['distances'], where=where, where_document=where_document, max_distance=max_distance))
+
+        winners: List[List[Tuple[float, str, int]]] = []
+        for q in range(n_queries):
+            per_shard = [
+                zip(partial['distances'][q], partial['ids'][q], [i] * len(partial['ids'][q]))
+                for i, partial in enumerate(partials) if len(partial.get('ids') or []) > q
+            ]
+            winners.append(list(islice(heapq.merge(*per_shard, key=lambda hit: hit[0]), n_results)))
+
+        rows: Dict[str, Dict[str, Any]] = {}
+        fields = [field for field in ('metadatas', 'documents', 'embeddings') if field in include]
+        if fields:
+            by_shard: Dict[int, List[str]] = {}
+            for hits in winners:
+                for _, doc_id, shard_index in hits:
+                    by_shard.setdefault(shard_index, []).append(doc_id)
+            for shard_index, doc_ids in by_shard.items():
+                found = self.shards[shard_index].get(ids=list(dict.fromkeys(doc_ids)), include=fields)
+                for position, doc_id in enumerate(found["ids"]):
+                    rows[doc_id] = {field: found[field][position] for field in fields}
+
+        results = {'ids': [[doc_id for _, doc_id, _ in hits] for hits in winners]}
+        if 'distances' in include:
+            results['distances'] = [[distance for distance, _, _ in hits] for hits in winners]
+        if 'metadatas' in include:
+            results['metadatas'] = [[rows.get(doc_id, {}).get('metadatas') or {} for _, doc_id, _ in hits] for hits in winners]
+        if 'documents' in include:
+            results['documents'] = [[rows.get(doc_id, {}).get('documents') or "" for _, doc_id, _ in hits] for hits in winners]
+        if 'embeddings' in include:
+            results['embeddings'] = [self._stack([rows[doc_id]['embeddings'] for _, doc_id, _ in hits]) for hits in winners]
+        return results
+
+    def _stack(self, vectors: List[np.ndarray]) -> np.ndarray:
+        """ Stored vectors gathered from several shards, as one (n, dimension) array. """
+        return np.array(vectors, dtype='float32').reshape(len(vectors), self.dimension)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, limit: Optional[int] = None, offset: Optional[int] = None, where_document: Optional[Dict[str, Any]] = None, include: List[str] = ['metadatas', 'documents']) -> Dict[str, List[Any]]:
+        """ Chroma-style get across shards. Without ids, records are returned shard by shard (insertion order within a shard). """
+        fields = [field for field in ('metadatas', 'documents', 'embeddings') if field in include]
+        if ids:
+            found: Dict[str, Dict[str, Any]] = {}
+            parts = self._map_groups(self._group_by_shard(ids), lambda shard, doc_ids: shard.get(ids=doc_ids, where=where, where_document=where_document, include=fields))
+            for part in parts.values():
+                for position, doc_id in enumerate(part["ids"]):
+                    found[doc_id] = {field: part[field][position] for field in fields}
+            ordered = [doc_id for doc_id in dict.fromkeys(ids) if doc_id in found]
+            start = offset or 0
+            ordered = ordered[start:(start + limit) if limit is not None else None]
+        else:
+            # Each shard returns at most offset + limit records; the page is cut from their concatenation
+            shard_limit = (offset or 0) + limit if limit is not None else None
+            found = {}
+            ordered = []
+            for part in self._map(lambda shard: shard.get(where=where, where_document=where_document, limit=shard_limit, include=fields)):
+                for position, doc_id in enumerate(part["ids"]):
+                    found[doc_id] = {field: part[field][position] for field in fields}
+                    ordered.append(doc_id)
+            start = offset or 0
+            ordered = ordered[start:(start + limit) if limit is not None else None]
+        results = {'ids': ordered}
+        for field in fields:
+            results[field] = [found[doc_id][field] for doc_id in ordered]
+        if 'embeddings' in fields:
+            results['embeddings'] = self._stack(results['embeddings'])
+        return results
+
+    def browse(self, cursor: Optional[str] = None, limit: int = 100, include: List[str] = ['metadatas', 'documents']) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """ One page of records, shard by shard. The cursor is '<shard>:<cursor within the shard>'. """
+        shard_index, _, shard_cursor = (cursor or "0:").partition(":")
+        shard_index = int(shard_index)
+        records: List[Dict[str, Any]] = []
+        while shard_index < len(self.shards) and len(records) < limit:
+            page, shard_cursor = self.shards[shard_index].browse(cursor=shard_cursor or None, limit=limit - len(records), include=include)
+            records.extend(page)
+            if shard_cursor is None:
+                shard_index += 1
+        if shard_index >= len(self.shards):
+            return records, None
+        return records, f"{shard_index}:{shard_cursor or ''}"
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, where_document: Optional[Dict[str, Any]] = None) -> List[str]:
+        """ Mimics ChromaDB's delete method. Filtering is basic (only by ID). """
+        if not ids:
+            logger.warning(f"[{self.name}] Delete called without specific IDs. This is currently not supported for safety. Provide IDs to delete.")
+            return []
+        with self._lock:
+            groups = self._group_by_shard(ids)
+            parts = self._map_groups(groups, lambda shard, doc_ids: shard.delete(ids=doc_ids, where=where, where_document=where_document))
+            deleted = [doc_id for part in parts.values() for doc_id in part]
+            missing = set(ids) - set(deleted)
+            if missing:
+                logger.warning(f"[{self.name}] IDs not found for deletion: {sorted(missing)[:5]}")
+            self._write_manifest()
+            return deleted
+
+    def archived_embeddings(self, doc_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """ Archived vectors of doc ids, read from the shards holding them, and a mask of the ids found. """
+        vectors = np.zeros((len(doc_ids), self.dimension), dtype='float32')
+        found = np.zeros(len(doc_ids), dtype=bool)
+        positions: Dict[str, List[int]] = {}
+        for position, doc_id in enumerate(doc_ids):
+            positions.setdefault(doc_id, []).append(position)
+        parts = self._map_groups(self._group_by_shard(doc_ids), lambda shard, shard_ids: (shard_ids, shard.archived_embeddings(shard_ids)))
+        for shard_ids, (shard_vectors, shard_found) in parts.values():
+            for doc_id, vector, hit in zip(shard_ids, shard_vectors, shard_found):
+                for position in positions[doc_id]:
+                    vectors[position], found[position] = vector, hit
+        return vectors, found
+
+    def count(self) -> int:
+        """ Returns the number of items in the collection, over all shards. """
+        return sum(shard.count() for shard in self.shards)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return {"hnsw:space": self.index_config.metric}
+
+    def clear(self):
+        """ Remove all documents from every shard. """
+        with self._lock:
+            self._map(lambda shard: shard.clear())
+            self._write_manifest()
+
+    def compact(self, background: bool = False) -> Optional[List[Optional[Dict[str, Any]]]]:
+        """ Compact every shard; shards are rebuilt in parallel. """
+        results = self._map(lambda shard: shard.compact(background=background))
+        return None if background else results
+
+    def checkpoint(self):
+        """ Checkpoint every shard in parallel. """
+        self._map(lambda shard: shard.checkpoint())
+
+    def compaction_stats(self) -> Dict[str, Any]:
+        """ Tombstone and compaction counters summed over the shards, with the per-shard stats. """
+        per_shard = self._map(lambda shard: shard.compaction_stats())
+        vectors = sum(stats["vectors"] for stats in per_shard)
+        tombstones = sum(stats["tombstones"] for stats in per_shard)
+        return {
+            "vectors": vectors,
+            "live": sum(stats["live"] for stats in per_shard),
+            "tombstones": tombstones,
+            "tombstone_ratio": round(tombstones / vectors, 4) if vectors else 0.0,
+            "compaction_threshold": settings.FAISS_COMPACTION_TOMBSTONE_RATIO,
+            "compacting": any(stats["compacting"] for stats in per_shard),
+            "compactions": sum(stats["compactions"] for stats in per_shard),
+            "shards": per_shard,
+        }
+
+    def data_files(self) -> List[str]:
+        """ Every file of the collection, shard files first (used when the collection is deleted). """
+        files = [path for shard in self.shards for path in shard.data_files()]
+        return files + [os.path.join(self.collection_path, INDEX_CONFIG_FILENAME), os.path.join(self.collection_path, MANIFEST_FILENAME)]
+
+    def frozen(self):
+        """ Context manager holding off writes to every shard (they all take the placement lock), e.g. during a swap. """
+        return self._lock
+
+    def close_shards(self):
+        """ Close every shard's stores, in the calling thread (a swap closes them while holding their locks). """
+        for shard in self.shards:
+            shard.close()
+
+    def close(self):
+        self.close_shards()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import heapq
+import logging
+import threading
+import numpy as np
+from itertools import islice
+from typing import List, Optional, Dict, Any
+from app.core.config import settings
+from app.services.faiss_client import FaissCollection
+from app.services.faiss_index_factory import FaissIndexConfig
+from app.services.faiss_sharded import ShardedFaissCollection, metadata_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Subdirectories of a tiered collection, in shard order
+TIER_DIRS = ("hot", "cold")
+HOT, COLD = 0, 1
+TIER_STATS_FILENAME = "tiers.json"
+# Records moved between the tiers per get/upsert/delete round
+MOVE_BATCH_SIZE = 1000
+# Hit counts are halved at every rebalance, so promotion follows recent demand; counts below MIN_TRACKED_HITS are forgotten
+HIT_DECAY = 0.5
+MIN_TRACKED_HITS = 0.5
+
+class TieredFaissCollection(ShardedFaissCollection):
+    """
+    A FAISS collection split into a hot tier, held in memory, for records dated within hot_days (or undated) and
+    records hit at least promote_hits times, and a cold tier whose index is memory-mapped from disk.
+    Queries search the hot tier and fall back to the cold one only for the queries it cannot fill with n_results
+    hits, or for every query with full_history=True. The two tiers are FaissCollections kept in hot/ and cold/
+    and handled like the shards of a ShardedFaissCollection; a periodic rebalance moves aged, unused records to
+    the cold tier and promotes cold records that keep being returned.
+    """
+    def __init__(self, name: str, collection_path: str, dimension: int, index_config: FaissIndexConfig,
+                 read_only: Optional[bool] = None, use_mmap: Optional[bool] = None):
+        # Decayed number of times each record was returned by a query
+        self._hits: Dict[str, float] = {}
+        self._hits_lock = threading.Lock()
+        self._queries = 0
+        self._cold_queries = 0
+        self._rebalancing = False
+        self._last_rebalance: Optional[Dict[str, Any]] = None
+        self._last_rebalance_check = time.monotonic()
+        self._closed = False
+        super().__init__(name, collection_path, dimension, index_config, read_only=read_only, use_mmap=use_mmap)
+        self._load_tier_stats()
+
+    def _layout(self) -> str:
+        return f"{self.shards[HOT].count()} hot and {self.shards[COLD].count()} cold records, hot for {self.index_config.hot_days} days"
+
+    def _shard_paths(self) -> List[str]:
+        return [os.path.join(self.collection_path, tier) for tier in TIER_DIRS]
+
+    def _shard_use_mmap(self, i: int, use_mmap: Optional[bool]) -> Optional[bool]:
+        return i == COLD
+
+    def _hot_cutoff(self) -> float:
+        return time.time() - self.index_config.hot_days * 86400
+
+    def _hit_count(self, doc_id: str) -> float:
+        with self._hits_lock:
+            return self._hits.get(doc_id, 0.0)
+
+    def _shard_for(self, doc_id: str, metadata: Optional[Dict[str, Any]]) -> int:
+        """ Tier a written record goes to: hot when undated, dated within hot_days, or hit promote_hits times. """
+        timestamp = metadata_timestamp(metadata, self.index_config.shard_time_keys)
+        if timestamp is None or timestamp >= self._hot_cutoff() or self._hit_count(doc_id) >= self.index_config.promote_hits:
+            return HOT
+        return COLD
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, include: List[str] = ['metadatas', 'documents', 'distances'], where: Optional[Dict] = None, where_document: Optional[Dict] = None, max_distance: Optional[float] = None, full_history: bool = False) -> Dict[str, List[Any]]:
+        """
+        Query the hot tier, then the cold tier for the queries left with fewer than n_results hits (all of them
+        with full_history), and merge both sorted lists per query. Returned records count as hits for promotion.
+        """
+        if len(query_embeddings) == 0 or self.count() == 0:
+            return {'ids': [], 'distances': [], 'metadatas': [], 'documents': [], 'embeddings': []}
+        queries = np.atleast_2d(np.array(query_embeddings, dtype='float32'))
+        fields = ['distances'] + [field for field in ('metadatas', 'documents', 'embeddings') if field in include]
+        hot, cold = self.shards
+        hits = self._hits_by_query(hot.query(queries, n_results=n_results, include=fields, where=where, where_document=where_document, max_distance=max_distance), len(queries), fields)
+        pending = [q for q in range(len(queries)) if full_history or len(hits[q]) < n_results] if cold.count() else []
+        if pending:
+            cold_results = cold.query(queries[pending], n_results=n_results, include=fields, where=where, where_document=where_document, max_distance=max_distance)
+            for q, cold_hits in zip(pending, self._hits_by_query(cold_results, len(pending), fields)):
+                hits[q] = list(islice(heapq.merge(hits[q], cold_hits, key=lambda hit: hit['distances']), n_results))
+
+        results = {'ids': [[hit['id'] for hit in query_hits] for query_hits in hits]}
+        for field in fields:
+            if field == 'embeddings':
+                results[field] = [self._stack([hit[field] for hit in query_hits]) for query_hits in hits]
+            elif field in include:
+                results[field] = [[hit[field] for hit in query_hits] for query_hits in hits]
+        with self._hits_lock:
+            self._queries += len(queries)
+            self._cold_queries += len(pending)
+            for doc_ids in results['ids']:
+                for doc_id in doc_ids:
+                    self._hits[doc_id] = self._hits.get(doc_id, 0.0) + 1
+        self._maybe_rebalance()
+        return results
+
+    @staticmethod
+    def _hits_by_query(results: Dict[str, List[Any]], n_queries: int, fields: List[str]) -> List[List[Dict[str, Any]]]:
+        """ One tier's results as a list of hits ({'id': ..., field: value}) per query, sorted by distance. """
+        hits: List[List[Dict[str, Any]]] = [[] for _ in range(n_queries)]
+        for q, doc_ids in enumerate(results.get('ids') or []):
+            for position, doc_id in enumerate(doc_ids):
+                hits[q].append({'id': doc_id, **{field: results[field][q][position] for field in fields}})
+        return hits
+
+    def _maybe_rebalance(self):
+        """ Start a background rebalance once FAISS_TIER_REBALANCE_SECONDS have passed since the last one. """
+        if self.read_only or time.monotonic() - self._last_rebalance_check < settings.FAISS_TIER_REBALANCE_SECONDS:
+            return
+        with self._hits_lock:
+            if self._rebalancing:
+                return
+            self._rebalancing = True
+            self._last_rebalance_check = time.monotonic()
+        threading.Thread(target=self._rebalance_in_background, name=f"faiss-tiers-{self.name}", daemon=True).start()
+
+    def _rebalance_in_background(self):
+        try:
+            self.rebalance()
+        except Exception as e:
+            logger.error(f"[{self.name}] Tier rebalance failed: {e}")
+        finally:
+            self._rebalancing = False
+
+    def rebalance(self) -> Optional[Dict[str, Any]]:
+        """
+        Move hot records dated before hot_days and not hit since about the last rebalance to the cold tier, and
+        cold records hit at least promote_hits times to the hot one. Hit counts then decay, and the cold tier
+        drops the in-memory copy of its index that writes made, to be memory-mapped again.
+        """
+        if self.read_only:
+            raise RuntimeError(f"[{self.name}] FAISS collection is opened read-only (FAISS_READ_ONLY); writes must go through the writer process.")
+        started = time.monotonic()
+        hot, cold = self.shards
+        keys = self.index_config.shard_time_keys
+        with self._lock:
+            if self._closed:
+                return None
+            cutoff = self._hot_cutoff()
+            with self._hits_lock:
+                hits = dict(self._hits)
+            demote = []
+            for doc_id, values in hot.store.metadata_values(keys):
+                timestamp = metadata_timestamp(values, keys)
+                if timestamp is not None and timestamp < cutoff and hits.get(doc_id, 0.0) < 1:
+                    demote.append(doc_id)
+            promote = [doc_id for doc_id, count in hits.items() if count >= self.index_config.promote_hits and doc_id in cold.doc_id_to_faiss_id]
+            self._move(hot, cold, demote)
+            self._move(cold, hot, promote)
+            with self._hits_lock:
+                self._hits = {doc_id: count * HIT_DECAY for doc_id, count in self._hits.items() if count * HIT_DECAY >= MIN_TRACKED_HITS}
+            self._write_manifest()
+            cold.release_memory()
+            self._last_rebalance = {
+                "finished_at": time.time(),
+                "duration_seconds": round(time.monotonic() - started, 3),
+                "demoted": len(demote),
+                "promoted": len(promote),
+            }
+            self._save_tier_stats()
+        logger.info(f"[{self.name}] Tiers rebalanced: {len(demote)} records demoted, {len(promote)} promoted ({self._layout()}).")
+        return self._last_rebalance
+
+    def _move(self, source: FaissCollection, target: FaissCollection, doc_ids: List[str]):
+        """ Copy records with their vectors (archived ones when available) from one tier to the other, then drop them from the source. """
+        for start in range(0, len(doc_ids), MOVE_BATCH_SIZE):
+            records = source.get(ids=doc_ids[start:start + MOVE_BATCH_SIZE], include=['metadatas', 'documents', 'embeddings'])
+            if not records["ids"]:
+                continue
+            # The index of a normalized or quantized collection keeps altered vectors; the archive keeps them as embedded
+            vectors, found = source.archived_embeddings(records["ids"])
+            vectors[~found] = np.asarray(records["embeddings"], dtype='float32')[~found]
+            target.upsert(ids=records["ids"], embeddings=vectors, metadatas=records["metadatas"], documents=records["documents"])
+            source.delete(ids=records["ids"])
+
+    def _tier_stats_path(self) -> str:
+        return os.path.join(self.collection_path, TIER_STATS_FILENAME)
+
+    def _load_tier_stats(self):
+        try:
+            with open(self._tier_stats_path(), "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"[{self.name}] Could not read tier hit counts: {e}. Starting from none.")
+            return
+        self._hits = {doc_id: float(count) for doc_id, count in (stats.get("hits") or {}).items()}
+        self._last_rebalance = stats.get("last_rebalance")
+
+    def _save_tier_stats(self):
+        if self.read_only:
+            return
+        with self._hits_lock:
+            stats = {"hits": dict(self._hits), "last_rebalance": self._last_rebalance}
+        tmp_path = self._tier_stats_path() + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, self._tier_stats_path())
+        except OSError as e:
+            logger.error(f"[{self.name}] Error saving tier hit counts: {e}")
+
+    def tier_stats(self) -> Dict[str, Any]:
+        with self._hits_lock:
+            return {
+                "hot_days": self.index_config.hot_days,
+                "promote_hits": self.index_config.promote_hits,
+                "hot_records": self.shards[HOT].count(),
+                "cold_records": self.shards[COLD].count(),
+                "cold_mmapped": self.shards[COLD]._mmapped,
+                "queries": self._queries,
+                "cold_queries": self._cold_queries,
+                "tracked_hits": len(self._hits),
+                "last_rebalance": self._last_rebalance,
+            }
+
+    def compact(self, background: bool = False) -> Optional[List[Optional[Dict[str, Any]]]]:
+        """ Compact both tiers; a foreground compaction maps the rebuilt cold index from disk again. """
+        results = super().compact(background=background)
+        if not background:
+            self.shards[COLD].release_memory()
+        return results
+
+    def checkpoint(self):
+        super().checkpoint()
+        self._save_tier_stats()
+
+    def compaction_stats(self) -> Dict[str, Any]:
+        stats = super().compaction_stats()
+        stats["tiers"] = dict(zip(TIER_DIRS, stats.pop("shards")))
+        stats["tiering"] = self.tier_stats()
+        return stats
+
+    def data_files(self) -> List[str]:
+        return super().data_files() + [self._tier_stats_path()]
+
+    def close_shards(self):
+        with self._lock:
+            self._closed = True
+            self._save_tier_stats()
+        super().close_shards()
@@ -0,0 +1,141 @@
+import logging
+import threading
+import numpy as np
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Removed rows are dropped from the postings once there are this many, and they outnumber the live rows
+MIN_PURGE_ROWS = 1024
+
+def normalize_text(text: str) -> str:
+    """ Case- and whitespace-insensitive form of a text: what $phrase compares and TrigramIndex indexes. """
+    # casefold maps each character independently (unlike lower() for a final sigma), so substrings stay substrings
+    return " ".join(text.casefold().split())
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class TrigramIndex:
+    """
+    Inverted index from the trigrams of normalized documents to the records containing them, for where_document
+    $contains and $phrase. A query's trigrams are intersected from the rarest up (binary search into the longer
+    posting lists), which yields a small superset of the matching records; callers confirm the matches on the
+    documents themselves. Normalization only merges texts, so the candidates of a case-sensitive $contains are
+    a superset too.
+    Records are numbered by rows in the order they are indexed, so posting lists are sorted uint32 arrays.
+    Removed rows stay in the postings until a purge renumbers them. Callers serialize writes against reads.
+    """
+    def __init__(self):
+        self._postings: Dict[str, array] = {}
+        self._row_ids = array('q') # row -> internal id
+        self._alive = bytearray()
+        self._live = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._live
+
+    def add(self, records: Iterable[Tuple[int, Optional[str]]]):
+        """ Index (internal_id, document) pairs; records without a document are skipped. """
+        with self._lock:
+            for internal_id, document in records:
+                if not document:
+                    continue
+                row = len(self._row_ids)
+                self._row_ids.append(int(internal_id))
+                self._alive.append(1)
+                self._live += 1
+                for gram in trigrams(normalize_text(document)):
+                    postings = self._postings.get(gram)
+                    if postings is None:
+                        postings = self._postings[gram] = array('I')
+                    postings.append(row)
+
+    def remove(self, internal_ids: Iterable[int]):
+        internal_ids = np.fromiter(internal_ids, dtype='int64')
+        if not len(internal_ids) or not self._live:
+            return
+        with self._lock:
+            alive = np.frombuffer(self._alive, dtype='uint8')
+            rows = np.flatnonzero(np.isin(np.frombuffer(self._row_ids, dtype='int64'), internal_ids) & (alive == 1))
+            alive[rows] = 0
+            del alive # The buffer cannot be resized while a view is exported
+            self._live -= len(rows)
+            if len(self._row_ids) - self._live >= max(MIN_PURGE_ROWS, self._live):
+                self._purge()
+
+    def _purge(self):
+        """ Drop removed rows from every posting list and renumber the live rows. """
+        keep = np.frombuffer(self._alive, dtype='uint8').astype(bool)
+        new_rows = np.cumsum(keep, dtype='int64') - 1
+        postings = {}
+        for gram, rows in self._postings.items():
+            rows = np.frombuffer(rows, dtype='uint32')
+            kept = new_rows[rows[keep[rows]]]
+            if len(kept):
+                postings[gram] = array('I', kept.astype('uint32').tobytes())
+        self._postings = postings
+        self._row_ids = array('q', np.frombuffer(self._row_ids, dtype='int64')[keep].tobytes())
+        self._alive = bytearray(b"\x01" * self._live)
+        logger.debug(f"Trigram index purged: {len(self._row_ids)} rows, {len(self._postings)} trigrams.")
+
+    def candidates(self, text: str) -> Optional[np.ndarray]:
+        """
+        Internal ids of the records whose normalized document may contain normalize_text(text), or None when the
+        text is too short to have a trigram (the caller has to scan).
+        """
+        grams = trigrams(normalize_text(text))
+        if not grams:
+            return None
+        with self._lock:
+            postings = []
+            for gram in grams:
+                rows = self._postings.get(gram)
+                if rows is None:
+                    return np.empty(0, dtype='int64')
+                postings.append(rows)
+            postings.sort(key=len)
+            rows = np.array(postings[0], dtype='uint32')
+            for other in postings[1:]:
+                if not len(rows):
+                    break
+                other = np.frombuffer(other, dtype='uint32')
+                positions = np.minimum(np.searchsorted(other, rows), len(other) - 1)
+                rows = rows[other[positions] == rows]
+            rows = rows[np.frombuffer(self._alive, dtype='uint8')[rows] == 1]
+            return np.frombuffer(self._row_ids, dtype='int64')[rows]
+
+    def resolve(self, where_document: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Candidate internal ids for a where_document clause ($contains, $phrase, $and, $or), or None when the clause
+        cannot be narrowed down ($not_contains, operands shorter than a trigram).
+        """
+        if not where_document:
+            return None
+        parts: List[Optional[np.ndarray]] = []
+        for operator, operand in where_document.items():
+            if operator in ("$contains", "$phrase") and isinstance(operand, str):
+                parts.append(self.candidates(operand))
+            elif operator == "$and":
+                narrowed = [ids for ids in (self.resolve(clause) for clause in operand) if ids is not None]
+                parts.append(_intersect(narrowed) if narrowed else None)
+            elif operator == "$or":
+                branches = [self.resolve(clause) for clause in operand]
+                parts.append(None if any(ids is None for ids in branches) else np.unique(np.concatenate(branches or [np.empty(0, dtype='int64')])))
+            else:
+                parts.append(None)
+        narrowed = [ids for ids in parts if ids is not None]
+        return _intersect(narrowed) if narrowed else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"documents": self._live, "trigrams": len(self._postings),
+                    "postings_bytes": sum(rows.itemsize * len(rows) for rows in self._postings.values())}
+
+def _intersect(id_arrays: List[np.ndarray]) -> np.ndarray:
+    result = id_arrays[0]
+    for ids in id_arrays[1:]:
+        result = np.intersect1d(result, ids)
+    return result
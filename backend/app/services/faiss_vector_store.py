@@ -0,0 +1,80 @@
+import os
+import logging
+import threading
+import numpy as np
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILENAME = "vectors.f32"
+
+class FullPrecisionVectorStore:
+    """
+    Full-precision (float32) copy of a collection's vectors on disk, one row per internal id.
+    Quantized collections search compressed codes in RAM and rescore a small candidate set
+    against these rows, read through a memory map so only the touched pages are loaded.
+    """
+    def __init__(self, path: str, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        self._row_bytes = dimension * 4
+        self._lock = threading.Lock()
+        self._mmap: Optional[np.memmap] = None
+
+    @property
+    def row_count(self) -> int:
+        return os.path.getsize(self.path) // self._row_bytes if os.path.exists(self.path) else 0
+
+    def write(self, ids: np.ndarray, vectors: np.ndarray):
+        """ Store vectors at the rows of their internal ids. Rewriting a row is idempotent (used by WAL replay). """
+        ids = np.asarray(ids, dtype='int64')
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if len(ids) == 0:
+            return
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if np.all(np.diff(ids) == 1):
+                    # Ids handed out by one add() are consecutive: a single write covers the batch
+                    os.pwrite(fd, vectors.tobytes(), int(ids[0]) * self._row_bytes)
+                else:
+                    for internal_id, vector in zip(ids.tolist(), vectors):
+                        os.pwrite(fd, vector.tobytes(), internal_id * self._row_bytes)
+            finally:
+                os.close(fd)
+            self._mmap = None # Remap on next read, the file may have grown
+
+    def read(self, ids: np.ndarray) -> np.ndarray:
+        """ Rows of the given internal ids as a float32 array; rows never written read as zeros. """
+        ids = np.asarray(ids, dtype='int64')
+        with self._lock:
+            rows = self.row_count
+            if self._mmap is None or len(self._mmap) != rows:
+                self._mmap = np.memmap(self.path, dtype='float32', mode='r', shape=(rows, self.dimension)) if rows else None
+            result = np.zeros((len(ids), self.dimension), dtype='float32')
+            if self._mmap is not None:
+                present = ids < rows
+                result[present] = self._mmap[ids[present]]
+            return result
+
+    def flush(self):
+        """ fsync the file; called at index checkpoints, before the write-ahead log is truncated. """
+        if not os.path.exists(self.path):
+            return
+        with self._lock:
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        """ Drop the read mapping, so the file can be moved or deleted (required on Windows). """
+        with self._lock:
+            self._mmap = None
+
+    def clear(self):
+        with self._lock:
+            self._mmap = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
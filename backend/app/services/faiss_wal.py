@@ -0,0 +1,107 @@
+import os
+import zlib
+import struct
+import logging
+import threading
+import numpy as np
+from typing import Iterator, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+WAL_FILENAME = "index.wal"
+
+OP_ADD = 1
+OP_REMOVE = 2
+
+# Record header: op (uint8), number of ids (uint32), vector dimension (uint32), CRC32 of the payload (uint32).
+# The payload is the int64 ids followed, for adds, by the float32 vectors.
+_HEADER = struct.Struct("<BIII")
+
+class IndexWriteAheadLog:
+    """
+    Append-only log of FAISS index mutations made since the last checkpoint of index.faiss.
+    Records are checksummed so a torn write at the tail (crash mid-append) is detected and dropped on replay.
+    """
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self.record_count = 0
+        self.vector_count = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _append(self, op: int, ids: np.ndarray, vectors: Optional[np.ndarray] = None):
+        ids = np.ascontiguousarray(ids, dtype='int64')
+        payload = ids.tobytes()
+        dimension = 0
+        if vectors is not None:
+            vectors = np.ascontiguousarray(vectors, dtype='float32')
+            dimension = vectors.shape[1]
+            payload += vectors.tobytes()
+        header = _HEADER.pack(op, len(ids), dimension, zlib.crc32(payload))
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(header + payload)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self.record_count += 1
+            self.vector_count += len(ids)
+
+    def append_add(self, ids: np.ndarray, vectors: np.ndarray):
+        self._append(OP_ADD, ids, vectors)
+
+    def append_remove(self, ids: np.ndarray):
+        self._append(OP_REMOVE, ids)
+
+    def replay(self, truncate_tail: bool = True) -> Iterator[Tuple[int, np.ndarray, Optional[np.ndarray]]]:
+        """
+        Yield (op, ids, vectors) for every intact record. A truncated or corrupt tail is cut off
+        so later appends start from the last good record. Read-only readers pass truncate_tail=False:
+        for them an incomplete tail may be an append the writer has not finished yet.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        position = 0
+        self.record_count = 0
+        self.vector_count = 0
+        while position + _HEADER.size <= len(data):
+            op, count, dimension, checksum = _HEADER.unpack_from(data, position)
+            payload_size = count * 8 + count * dimension * 4
+            start = position + _HEADER.size
+            payload = data[start:start + payload_size]
+            if op not in (OP_ADD, OP_REMOVE) or len(payload) < payload_size or zlib.crc32(payload) != checksum:
+                break
+            ids = np.frombuffer(payload[:count * 8], dtype='int64')
+            vectors = np.frombuffer(payload[count * 8:], dtype='float32').reshape(count, dimension) if op == OP_ADD else None
+            self.record_count += 1
+            self.vector_count += count
+            yield op, ids, vectors
+            position = start + payload_size
+        if position < len(data) and truncate_tail:
+            logger.warning(f"Discarding {len(data) - position} bytes of incomplete write-ahead log data in {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(position)
+
+    def reset(self):
+        """ Drop all records; called once a checkpoint made them durable in index.faiss. """
+        with self._lock:
+            if os.path.exists(self.path):
+                with open(self.path, "wb") as f:
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+            self.record_count = 0
+            self.vector_count = 0
+
+    def remove(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.record_count = 0
+            self.vector_count = 0
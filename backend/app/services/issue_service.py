@@ -1,14 +1,15 @@
 from typing import Optional, List, Dict, Any
-from app.services.chroma_client import get_collection
+from app.services.chroma_client import get_collection, get_vector_db_client
+from app.services.collection_generations import serving_key
 from app.services.embedding_service import get_embedding_model
-from app.services.faiss_client import FaissCollection
+from app.services.faiss_client import is_faiss_collection
 from app.utils.rag_utils import index_vector_data
 from app.utils.llm_augmentation import llm_summarize
 from app.models import IssueResponse
 from datetime import datetime
 import logging
 import os
-from app.utils.similarity import compute_text_similarity_score
+from app.utils.similarity import compute_text_similarity_score, compute_embedding_similarity_score
 from app.utils.rag_utils import load_components, create_bm25_index, create_retrievers, create_rag_pipeline
 from app.utils.dspy_utils import get_openrouter_llm
 
@@ -16,13 +17,16 @@ logger = logging.getLogger(__name__)
 
 COLLECTION_NAME = "issues"
 
-# Cache pipeline at module level to avoid reloading every call
+# Cache pipeline at module level to avoid reloading every call; it is rebuilt once the collection
+# is served by another generation (see collection_generations.serving_key)
 _rag_pipeline = None
 _corpus = None
+_pipeline_key = None
 
 def _get_rag_pipeline(use_llm: bool = False):
-    global _rag_pipeline, _corpus
-    if _rag_pipeline is not None:
+    global _rag_pipeline, _corpus, _pipeline_key
+    key = serving_key(get_vector_db_client(), COLLECTION_NAME)
+    if _rag_pipeline is not None and _pipeline_key == key:
         return _rag_pipeline
     from app.core.config import settings
     import dspy
@@ -36,7 +40,7 @@ def _get_rag_pipeline(use_llm: bool = False):
     # For now, just ensure _corpus is the list of documents for BM25 index
     # The create_retrievers function will need adjustment to pass IDs/Metas to BM25Retriever
     # Determine db_type and db_path robustly
-    if isinstance(collection, FaissCollection):
+    if is_faiss_collection(collection):
         db_type = 'faiss'
         # Use the directory containing the index file
         index_file_path = getattr(collection, 'index_path', None)
@@ -65,6 +69,7 @@ def _get_rag_pipeline(use_llm: bool = False):
     # Pass IDs and Metadatas to create_retrievers so BM25Retriever can use them
     vector_retriever, bm25_retriever = create_retrievers(collection, embedder, bm25_processor, _corpus, doc_ids=_ids, metadatas=_metadatas)
     _rag_pipeline = create_rag_pipeline(vector_retriever, bm25_retriever, reranker, llm)
+    _pipeline_key = key
     return _rag_pipeline
 
 def delete_issue(issue_id: str) -> bool:
@@ -120,10 +125,26 @@ def get_issue(issue_id: str) -> Optional[IssueResponse]:
         logger.error(f"Error getting issue from vector database: {str(e)}")
         raise
 
-def search_similar_issues(query_text: str = "", jira_ticket_id: Optional[str] = None, limit: int = 10, use_llm: bool = False) -> List[IssueResponse]:
+def _get_stored_embeddings(issue_ids: List[str]) -> Dict[str, Any]:
+    """ Stored vectors of the given issues, read in one call; empty if the vector store cannot return them. """
+    if not issue_ids:
+        return {}
+    try:
+        results = get_collection(COLLECTION_NAME).get(ids=issue_ids, include=['embeddings'])
+        embeddings = results.get("embeddings")
+        if embeddings is None:
+            return {}
+        return {issue_id: embedding for issue_id, embedding in zip(results.get("ids", []), embeddings)}
+    except Exception as e:
+        logger.warning(f"Could not read stored embeddings, re-embedding issue descriptions instead: {e}")
+        return {}
+
+def search_similar_issues(query_text: str = "", jira_ticket_id: Optional[str] = None, limit: int = 10, use_llm: bool = False, exact_phrase: bool = False, full_history: bool = False) -> List[IssueResponse]:
     """
     Use the DSPy RAG pipeline for hybrid retrieval and answer generation.
     Ensures only Jira issues are returned, not Confluence or other data.
+    With exact_phrase=True only issues containing the query text itself are returned (e.g. an exception name).
+    With full_history=True a tiered collection searches its older (cold) issues too, even when recent ones fill the limit.
     """
     try:
         rag_pipeline = _get_rag_pipeline(use_llm=use_llm)
@@ -167,7 +188,7 @@ def search_similar_issues(query_text: str = "", jira_ticket_id: Optional[str] =
                 ))
             return issue_responses
         # Otherwise, use the RAG pipeline
-        rag_result = rag_pipeline.forward(query_text, use_llm=use_llm)
+        rag_result = rag_pipeline.forward(query_text, use_llm=use_llm, exact_phrase=exact_phrase, full_history=full_history)
         responses = []
         retrieved_examples = rag_result.context
         logger.debug(f"Issue RAG pipeline returned {len(retrieved_examples)} examples.")
@@ -193,6 +214,10 @@ def search_similar_issues(query_text: str = "", jira_ticket_id: Optional[str] =
             except Exception as fetch_err:
                  logger.error(f"Error fetching issue {issue_id} using get_issue: {fetch_err}")
         logger.debug(f"Populated issues_map with {len(issues_map)} entries.")
+        # Issues the retriever did not score are compared against their stored vectors instead of being re-embedded
+        unscored_ids = [ex.get('id') for ex in filtered_examples if ex.get('id') in issues_map and not ex.get('score')]
+        stored_embeddings = _get_stored_embeddings(unscored_ids)
+        query_embedding = get_embedding_model().encode([query_text])[0] if stored_embeddings else None
         for idx, example in enumerate(filtered_examples):
             logger.debug(f"Processing filtered RAG example {idx}: {example}")
             if not hasattr(example, 'get'):
@@ -205,7 +230,12 @@ def search_similar_issues(query_text: str = "", jira_ticket_id: Optional[str] =
                 issue = issues_map[issue_id]
                 logger.debug(f"Found issue {issue_id} in issues_map: {issue.model_dump_json(indent=2)}") # Added detailed log
                 # Add similarity score if available from RAG metadata
-                similarity_score = example.get('score') or compute_text_similarity_score(query_text, issue.description)
+                similarity_score = example.get('score')
+                if not similarity_score:
+                    if issue_id in stored_embeddings:
+                        similarity_score = compute_embedding_similarity_score(query_embedding, stored_embeddings[issue_id])
+                    else:
+                        similarity_score = compute_text_similarity_score(query_text, issue.description)
                 issue.similarity_score = similarity_score
                 # Add LLM answer if it's the top result and available
                 if idx == 0 and rag_result.answer:
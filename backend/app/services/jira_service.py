@@ -250,13 +250,16 @@ def log_search_failure(error):
 from app.utils.rag_utils import load_components, index_vector_data, create_bm25_index, create_retrievers, create_rag_pipeline
 from app.services.embedding_service import get_embedding_model
 from app.services.chroma_client import get_vector_db_client
+from app.services.collection_generations import serving_key
 from app.utils.llm_augmentation import llm_summarize
 from app.utils.dspy_utils import get_openrouter_llm
 from app.services.rerank_service import get_reranker
 
-# Cache pipeline at module level to avoid reloading every call
+# Cache pipeline at module level to avoid reloading every call; it is rebuilt once the collection
+# is served by another generation (see collection_generations.serving_key)
 _rag_pipeline = None
 _corpus = None
+_pipeline_key = None
 
 def add_jira_ticket_to_vectordb(ticket_id: str, extra_metadata: Optional[Dict[str, Any]] = None, llm_augment: Optional[Any] = None, augment_metadata: bool = True, normalize_language: bool = True, target_language: str = "en") -> Optional[str]:
     log_ingest_start(ticket_id, extra_metadata)
@@ -303,12 +306,13 @@ def add_jira_ticket_to_vectordb(ticket_id: str, extra_metadata: Optional[Dict[st
         return None
 
 def _get_rag_pipeline(use_llm: bool = False):
-    global _rag_pipeline, _corpus
-    if _rag_pipeline is not None:
+    global _rag_pipeline, _corpus, _pipeline_key
+    client = get_vector_db_client()
+    key = serving_key(client, COLLECTION_NAME)
+    if _rag_pipeline is not None and _pipeline_key == key:
         return _rag_pipeline
     from app.core.config import settings
     import dspy
-    client = get_vector_db_client()
     collection = client.get_collection(COLLECTION_NAME)
     # Load all docs for BM25
     results = collection.get()
@@ -323,6 +327,7 @@ def _get_rag_pipeline(use_llm: bool = False):
     bm25_processor = create_bm25_index(_corpus)
     vector_retriever, bm25_retriever = create_retrievers(collection, embedder, bm25_processor, _corpus)
     _rag_pipeline = create_rag_pipeline(vector_retriever, bm25_retriever, reranker, llm)
+    _pipeline_key = key
     return _rag_pipeline
 
 def search_similar_jira_tickets(query_text: str, limit: int = 10, use_llm: bool = False):
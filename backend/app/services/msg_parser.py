@@ -34,11 +34,13 @@ def log_search_failure(error):
 from app.utils.rag_utils import load_components, index_vector_data, create_bm25_index, create_retrievers, create_rag_pipeline
 from app.services.embedding_service import get_embedding_model
 from app.services.chroma_client import get_vector_db_client
+from app.services.collection_generations import serving_key
 from app.utils.llm_augmentation import llm_summarize
 from app.utils.dspy_utils import get_openrouter_llm
 
 _rag_pipeline = None
 _corpus = None
+_pipeline_key = None # Rebuilt once the collection is served by another generation
 
 def add_msg_file_to_vectordb(file_path: str, extra_metadata: dict = None, llm_augment=None, augment_metadata=True, normalize_language=True, target_language="en") -> str:
     log_ingest_start(file_path, extra_metadata)
@@ -98,11 +100,12 @@ def add_msg_file_to_vectordb(file_path: str, extra_metadata: dict = None, llm_au
         return None
 
 def _get_rag_pipeline(use_llm: bool = False):
-    global _rag_pipeline, _corpus
-    if _rag_pipeline is not None:
+    global _rag_pipeline, _corpus, _pipeline_key
+    client = get_vector_db_client()
+    key = serving_key(client, COLLECTION_NAME)
+    if _rag_pipeline is not None and _pipeline_key == key:
         return _rag_pipeline
     from app.core.config import settings
-    client = get_vector_db_client()
     collection = client.get_collection(COLLECTION_NAME)
     results = collection.get()
     documents = results.get("documents", [])
@@ -117,6 +120,7 @@ def _get_rag_pipeline(use_llm: bool = False):
     bm25_processor = create_bm25_index(_corpus)
     vector_retriever, bm25_retriever = create_retrievers(collection, embedder, bm25_processor, _corpus)
     _rag_pipeline = create_rag_pipeline(vector_retriever, bm25_retriever, reranker, llm)
+    _pipeline_key = key
     return _rag_pipeline
 
 def msg_search(query_text: str, limit: int = 10, use_llm: bool = False) -> list:
@@ -3,6 +3,7 @@ import hashlib
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 from app.services.chroma_client import get_vector_db_client
+from app.services.collection_generations import serving_key
 from app.services.embedding_service import get_embedding_model
 from app.services.rerank_service import get_reranker
 import re
@@ -38,21 +39,25 @@ def log_search_failure(error):
     logger.error(f"[SEARCH][FAILURE] Stack Overflow search failed: {error}")
 # --- LOGGING INSTRUMENTATION END ---
 
-# Cache pipeline at module level to avoid reloading every call
+# Cache pipeline at module level to avoid reloading every call; it is rebuilt once the collection
+# is served by another generation (see collection_generations.serving_key)
 _rag_pipeline = None
 _corpus = None
+_pipeline_key = None
 
 # --- CLEAR CACHE UTILITY FOR TESTING/RESET ---
 def clear_stackoverflow_cache():
-    global _rag_pipeline, _corpus
+    global _rag_pipeline, _corpus, _pipeline_key
     _rag_pipeline = None
     _corpus = None
+    _pipeline_key = None
 
 def _get_rag_pipeline(use_llm: bool = False):
-    global _rag_pipeline, _corpus
-    if _rag_pipeline is not None:
-        return _rag_pipeline
+    global _rag_pipeline, _corpus, _pipeline_key
     client = get_vector_db_client()
+    key = serving_key(client, COLLECTION_NAME)
+    if _rag_pipeline is not None and _pipeline_key == key:
+        return _rag_pipeline
     collection = client.get_collection(COLLECTION_NAME)
     results = collection.get()
     documents = results.get("documents", [])
@@ -68,6 +73,7 @@ def _get_rag_pipeline(use_llm: bool = False):
     bm25_processor = create_bm25_index(_corpus)
     vector_retriever, bm25_retriever = create_retrievers(collection, embedder, bm25_processor, _corpus)
     _rag_pipeline = create_rag_pipeline(vector_retriever, bm25_retriever, reranker, llm)
+    _pipeline_key = key
     return _rag_pipeline
 
 def extract_question_id(stackoverflow_url: str) -> Optional[str]:
@@ -237,11 +243,11 @@ def sanitize_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
             sanitized[k] = v
     return sanitized
 
-def search_similar_stackoverflow_content(query_text: str, limit: int = 10, use_llm: bool = False):
+def search_similar_stackoverflow_content(query_text: str, limit: int = 10, use_llm: bool = False, exact_phrase: bool = False, full_history: bool = False):
     log_search_start(query_text, limit, use_llm)
     try:
         rag_pipeline = _get_rag_pipeline(use_llm=use_llm)
-        rag_result = rag_pipeline.forward(query_text,use_llm=use_llm)
+        rag_result = rag_pipeline.forward(query_text, use_llm=use_llm, exact_phrase=exact_phrase, full_history=full_history)
         # Return as a list of dicts for frontend compatibility
         formatted = []
         for idx, context in enumerate(rag_result.context):
@@ -251,7 +257,7 @@ def search_similar_stackoverflow_content(query_text: str, limit: int = 10, use_l
                 content = getattr(context, 'long_text', context_dict.get('long_text', ''))
                 item_id = context_dict.get('item_id') or context_dict.get('id') or f"rag_{idx}"
                 title = str(content)[:150]+" ..." if content else ""
-                similarity_score = context_dict.get('similarity_score')
+                similarity_score = context_dict.get('similarity_score', context_dict.get('score'))
                 if similarity_score is not None:
                     try:
                         similarity_score = float(similarity_score)
@@ -260,7 +266,7 @@ def search_similar_stackoverflow_content(query_text: str, limit: int = 10, use_l
                 if similarity_score is None:
                     similarity_score = compute_text_similarity_score(query_text, str(content))
                 llm_answer = rag_result.answer if idx == 0 else None
-                metadata = {k: v for k, v in context_dict.items() if k not in ['long_text', 'id', 'item_id', 'title', 'similarity_score']}
+                metadata = {k: v for k, v in context_dict.items() if k not in ['long_text', 'id', 'item_id', 'title', 'similarity_score', 'score']}
                 question_id = context_dict.get('question_id') or metadata.get('question_id')
                 url = (
                     context_dict.get('url')
@@ -282,7 +288,7 @@ def search_similar_stackoverflow_content(query_text: str, limit: int = 10, use_l
                 content = context.get('content', '') or context.get('text', '') or str(context)
                 item_id = context.get('item_id') or context.get('id') or f"rag_{idx}"
                 title = str(content)[:150]+" ..." if content else ""
-                similarity_score = context.get('similarity_score')
+                similarity_score = context.get('similarity_score', context.get('score'))
                 if similarity_score is not None:
                     try:
                         similarity_score = float(similarity_score)
@@ -291,7 +297,7 @@ def search_similar_stackoverflow_content(query_text: str, limit: int = 10, use_l
                 if similarity_score is None:
                     similarity_score = compute_text_similarity_score(query_text, str(content))
                 llm_answer = rag_result.answer if idx == 0 else None
-                metadata = {k: v for k, v in context.items() if k not in ['content', 'text', 'id', 'item_id', 'title', 'similarity_score']}
+                metadata = {k: v for k, v in context.items() if k not in ['content', 'text', 'id', 'item_id', 'title', 'similarity_score', 'score']}
                 question_id = context.get('question_id') or metadata.get('question_id')
                 url = (
                     context.get('url')
@@ -314,6 +320,8 @@ def search_similar_stackoverflow_content(query_text: str, limit: int = 10, use_l
                 item_id = getattr(context, 'item_id', None) or getattr(context, 'id', None) or f"rag_{idx}"
                 title = str(content)[:150]+" ..." if content else ""
                 similarity_score = getattr(context, 'similarity_score', None)
+                if similarity_score is None:
+                    similarity_score = getattr(context, 'score', None)
                 if similarity_score is not None:
                     try:
                         similarity_score = float(similarity_score)
@@ -322,7 +330,7 @@ def search_similar_stackoverflow_content(query_text: str, limit: int = 10, use_l
                 if similarity_score is None:
                     similarity_score = compute_text_similarity_score(query_text, str(content))
                 llm_answer = rag_result.answer if idx == 0 else None
-                metadata = {k: v for k, v in context.__dict__.items() if k not in ['long_text', 'id', 'item_id', 'title', 'similarity_score']}
+                metadata = {k: v for k, v in context.__dict__.items() if k not in ['long_text', 'id', 'item_id', 'title', 'similarity_score', 'score']}
                 question_id = getattr(context, 'question_id', None) or metadata.get('question_id')
                 url = (
                     getattr(context, 'url', None)
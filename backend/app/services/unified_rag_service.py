@@ -1,6 +1,7 @@
 import logging
 from typing import List, Dict, Any, Optional
 from app.services.chroma_client import get_vector_db_client
+from app.services.collection_generations import serving_key
 from app.services.embedding_service import get_embedding_model
 from app.utils.rag_utils import create_bm25_index, create_retrievers, create_rag_pipeline
 from app.utils.llm_augmentation import llm_summarize
@@ -36,11 +37,13 @@ def get_unified_corpus():
 
 _rag_pipeline = None
 _corpus = None
+_pipeline_key = None # Rebuilt once any of the collections is served by another generation
 
 
 def _get_rag_pipeline(use_llm: bool = False):
-    global _rag_pipeline, _corpus
-    if _rag_pipeline is not None:
+    global _rag_pipeline, _corpus, _pipeline_key
+    key = tuple(serving_key(get_vector_db_client(), cname) for cname, _ in COLLECTIONS)
+    if _rag_pipeline is not None and _pipeline_key == key:
         return _rag_pipeline
     from app.core.config import settings
     import dspy
@@ -58,6 +61,7 @@ def _get_rag_pipeline(use_llm: bool = False):
     # SyntheticCollection logic omitted for brevity, keep as is if needed
     vector_retriever, bm25_retriever = create_retrievers(client, embedder, bm25_processor, _corpus)
     _rag_pipeline = create_rag_pipeline(vector_retriever, bm25_retriever, None, llm)
+    _pipeline_key = key
     return _rag_pipeline
 
 
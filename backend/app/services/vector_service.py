@@ -1,5 +1,6 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import logging
+from app.core.config import settings
 from app.models import IssueResponse
 from app.services.chroma_client import get_vector_db_client
 from app.services.vector_issue_service import add_issue_to_vectordb as original_add_issue_to_vectordb
@@ -57,6 +58,72 @@ def get_all_chroma_collections_data() -> list:
         logging.error(f"Error fetching ChromaDB collections data: {str(e)}")
         return []
 
+# Record fields the collection browsing endpoints can project, mapped to Chroma include names (ids are always returned)
+RECORD_FIELDS = {
+    "ids": None,
+    "metadata": "metadatas", "metadatas": "metadatas",
+    "document": "documents", "documents": "documents",
+    "embedding": "embeddings", "embeddings": "embeddings",
+}
+
+def get_collection_summaries() -> list:
+    """
+    Name and record count of every collection, without reading any records.
+    FAISS collections add the details of their manifest (dimension, index type, embedding model, ...).
+    """
+    client = get_vector_db_client()
+    if settings.USE_FAISS:
+        return client.collection_summaries()
+    summaries = []
+    for col in client.list_collections():
+        col_name = col.name if hasattr(col, 'name') else col
+        collection = client.get_collection(col_name)
+        summaries.append({"collection_name": col_name, "record_count": collection.count(), "metadata": collection.metadata or {}})
+    return summaries
+
+def parse_record_fields(fields: str) -> List[str]:
+    """ Translate a comma-separated projection such as 'ids,metadata,documents' into Chroma include names. """
+    include = []
+    for field in (f.strip().lower() for f in fields.split(",") if f.strip()):
+        if field not in RECORD_FIELDS:
+            raise ValueError(f"Unknown record field '{field}'. Expected any of ids, metadata, documents, embeddings.")
+        if RECORD_FIELDS[field] and RECORD_FIELDS[field] not in include:
+            include.append(RECORD_FIELDS[field])
+    return include
+
+def get_collection_records_page(collection_name: str, cursor: Optional[str] = None, limit: int = 100,
+                                include: List[str] = ['metadatas', 'documents']) -> Optional[Tuple[List[Dict[str, Any]], Optional[str]]]:
+    """
+    One cursor-paginated page of a collection's records, projected to the include fields.
+    Returns (records, next_cursor), next_cursor being None after the last page, or None if the collection does not exist.
+    """
+    client = get_vector_db_client()
+    if settings.USE_FAISS:
+        collection = client.get_collection(collection_name)
+        return collection.browse(cursor=cursor, limit=limit, include=include) if collection is not None else None
+    try:
+        collection = client.get_collection(collection_name)
+    except Exception as e:
+        logger.warning(f"ChromaDB collection '{collection_name}' not found: {e}")
+        return None
+    # Chroma pages by offset; the cursor is the offset of the next page
+    offset = int(cursor) if cursor else 0
+    data = collection.get(limit=limit, offset=offset, include=include)
+    ids = data.get("ids") or []
+    records = []
+    for i, doc_id in enumerate(ids):
+        record = {"id": doc_id}
+        if 'metadatas' in include:
+            record["metadata"] = data["metadatas"][i]
+        if 'documents' in include:
+            record["document"] = data["documents"][i]
+        if 'embeddings' in include:
+            embedding = data["embeddings"][i]
+            record["embedding"] = embedding.tolist() if hasattr(embedding, "tolist") else embedding
+        records.append(record)
+    next_cursor = str(offset + len(ids)) if len(ids) == limit else None
+    return records, next_cursor
+
 def add_issue_to_vectordb(msg_data: Optional[Dict[str, Any]] = None, jira_data: Optional[Dict[str, Any]] = None,
                         augment_metadata: bool = True, normalize_language: bool = True, target_language: str = "en") -> str:
     # Defensive patch: if msg_data is an error dict, raise ValueError immediately
@@ -102,7 +169,7 @@ def get_issue(issue_id: str) -> Optional[IssueResponse]:
     """
     return real_get_issue(issue_id)
 
-def search_similar_issues(query_text: str = "", jira_ticket_id: Optional[str] = None, limit: int = 10, use_llm: bool = False) -> List[IssueResponse]:
+def search_similar_issues(query_text: str = "", jira_ticket_id: Optional[str] = None, limit: int = 10, use_llm: bool = False, exact_phrase: bool = False, full_history: bool = False) -> List[IssueResponse]:
     """
     Search for similar support issues / queries based on a query text or Jira ticket ID.
     
@@ -111,10 +178,12 @@ def search_similar_issues(query_text: str = "", jira_ticket_id: Optional[str] =
         jira_ticket_id: Optional Jira ticket ID to filter results
         limit: Maximum number of results to return
         use_llm: Whether to use LLM for similarity search
+        exact_phrase: Only return issues containing the query text itself (case and whitespace aside)
+        full_history: Also search older issues kept in the cold tier of a tiered collection
     Returns:
         List of IssueResponse objects representing similar issues
     """
-    results = real_search_similar_issues(query_text, jira_ticket_id, limit, use_llm)
+    results = real_search_similar_issues(query_text, jira_ticket_id, limit, use_llm, exact_phrase, full_history)
     
     # logger.info(f"Search results Vector Service: {results}")
     # from app.core.config import Settings
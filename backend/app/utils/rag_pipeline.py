@@ -1,4 +1,5 @@
 import dspy
+from app.services.faiss_filters import matches_where_document
 
 class RAGHybridFusedRerank(dspy.Module):
     """
@@ -31,9 +32,15 @@ class RAGHybridFusedRerank(dspy.Module):
         # Return the top K original objects
         return [doc for doc, _ in ranked[:self.rerank_k]]
 
-    def forward(self, question, use_llm=True):
-        vector_results = self.vector_retrieve(question) # List of dspy.Example
-        keyword_results = self.keyword_retrieve(question) # List of dspy.Example
+    def forward(self, question, use_llm=True, exact_phrase=False, full_history=False):
+        if exact_phrase:
+            # Exact-phrase mode: only documents containing the question itself (an error string, a stack trace line),
+            # found through the collection's text index and ranked by the vector search among them
+            vector_results = self.vector_retrieve.forward(question, where_document=self.vector_retrieve.phrase_filter(question), full_history=full_history)
+            keyword_results = [doc for doc in self.keyword_retrieve(question) if matches_where_document(doc.long_text, {'$phrase': question})]
+        else:
+            vector_results = self.vector_retrieve(question, full_history=full_history) # List of dspy.Example
+            keyword_results = self.keyword_retrieve(question) # List of dspy.Example
 
         # Fuse based on a unique identifier if available (e.g., 'id'), otherwise fallback to text
         # Assuming retrievers return dspy.Example objects with an 'id' field
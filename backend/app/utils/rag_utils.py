@@ -5,7 +5,6 @@ from .bm25_utils import BM25Processor
 from .retrievers import VectorRetriever, BM25Retriever
 from .rag_pipeline import RAGHybridFusedRerank
 from app.services.chroma_client import get_vector_db_client
-from app.services.faiss_client import get_faiss_client
 from app.utils.dspy_utils import get_openrouter_llm
 from typing import List, Dict, Any, Optional, Callable
 from app.utils.llm_augmentation import llm_summarize, llm_extract_metadata, llm_normalize_language
@@ -16,7 +15,9 @@ def load_components(db_type, db_path, embedder_model, reranker_model, llm=None):
     if db_type == 'chroma':
         client = get_vector_db_client(db_path)
     elif db_type == 'faiss':
-        client = get_faiss_client(db_path)
+        # The FAISS collection is passed to create_retrievers as is; a second FaissClient on its directory
+        # would open its own SQLite sidecar and write-ahead log on the same files
+        client = None
     else:
         raise ValueError(f"Unknown db_type: {db_type}")
     if llm is None:
@@ -80,7 +81,8 @@ def index_vector_data(
         final_embeddings.append(embedding)
         final_metadatas.append(meta)
     if final_docs:
-        collection.add(
+        # upsert (Chroma and FAISS) replaces re-ingested ids instead of keeping their stale vectors and text
+        collection.upsert(
             ids=final_ids,
             embeddings=final_embeddings,
             metadatas=final_metadatas,
@@ -1,4 +1,7 @@
 import dspy
+import numpy as np
+from app.core.config import settings
+from app.utils.similarity import distance_to_similarity_score, similarity_threshold_to_distance
 
 class VectorRetriever(dspy.Retrieve):
     """DSPy Retriever for either ChromaDB or FAISS collections using SentenceTransformer embeddings."""
@@ -8,27 +11,93 @@ class VectorRetriever(dspy.Retrieve):
         self._k = k
         super().__init__(k=k)
 
-    def forward(self, query, k=None):
+    def forward(self, query, k=None, where_document=None, full_history=False):
+        return self.forward_batch([query], k=k, where_document=where_document, full_history=full_history)[0]
+
+    def forward_batch(self, queries, k=None, where_document=None, full_history=False):
+        """
+        Retrieve for several queries with one encode call and one vectorized collection query.
+        where_document (e.g. from phrase_filter) restricts the search to matching documents, ranked by similarity.
+        full_history makes a tiered FAISS collection search its cold tier too, not only when the hot tier falls short.
+        """
         k = k or self._k
-        query_emb = self._embedder.encode([query], show_progress_bar=False).tolist()
+        if not queries:
+            return []
+        query_embs = self._embedder.encode(list(queries), show_progress_bar=False).tolist()
+        # Cosine/ip collections give the similarity score directly from the distance
+        space = (getattr(self._collection, 'metadata', None) or {}).get('hnsw:space', 'l2')
+        # The similarity threshold becomes a distance cutoff, so documents below it are never fetched or scored;
+        # exact matches of a document filter are kept whatever their similarity
+        max_distance = self._max_distance(query_embs, space) if not where_document else None
         # Only include valid Chroma/FAISS fields
-        results = self._collection.query(query_embeddings=query_emb, n_results=k, include=['documents', 'metadatas'])
+        kwargs = {'where_document': where_document} if where_document else {}
+        if full_history and self._is_faiss_collection():
+            kwargs['full_history'] = True
+        if max_distance is not None and self._is_faiss_collection():
+            results = self._collection.query(query_embeddings=query_embs, n_results=k, include=['documents', 'metadatas', 'distances'], max_distance=max_distance, **kwargs)
+        else:
+            results = self._collection.query(query_embeddings=query_embs, n_results=k, include=['documents', 'metadatas', 'distances'], **kwargs)
+            if max_distance is not None:
+                # Chroma's l2 space reports squared L2 distances (FAISS collections report plain L2)
+                results = _cut_by_distance(results, max_distance ** 2 if space == 'l2' else max_distance)
 
         # Ensure results are not None and contain expected keys
-        if not results or not results.get('documents') or not results['documents'][0]:
-            return [] # Return empty list if no results or malformed
+        if not results or not results.get('documents'):
+            return [[] for _ in queries] # Return empty lists if no results or malformed
 
-        # Construct dspy.Example with document text and metadata (including the ID if available)
-        docs = []
-        docs_ids = results.get('ids', [None])[0] if 'ids' in results and results['ids'] else [str(i) for i in range(len(results['documents'][0]))]
-        for i, doc_text in enumerate(results['documents'][0]):
-            metadata = results['metadatas'][0][i] if results['metadatas'] and results['metadatas'][0] and i < len(results['metadatas'][0]) else {}
-            doc_id = docs_ids[i] if docs_ids and i < len(docs_ids) else None
-            # Add the document ID to the metadata if it's not already there
-            if doc_id and 'id' not in metadata:
-                metadata['id'] = doc_id
-            docs.append(dspy.Example(long_text=doc_text, **metadata)) # Pass metadata as keyword arguments
-        return docs
+        batches = []
+        for q in range(len(queries)):
+            documents = results['documents'][q] if q < len(results['documents']) else []
+            if not documents:
+                batches.append([])
+                continue
+            # Construct dspy.Example with document text and metadata (including the ID if available)
+            docs = []
+            docs_ids = results['ids'][q] if results.get('ids') and q < len(results['ids']) else [str(i) for i in range(len(documents))]
+            metadatas = results['metadatas'][q] if results.get('metadatas') and q < len(results['metadatas']) else []
+            distances = results['distances'][q] if results.get('distances') and q < len(results['distances']) else []
+            for i, doc_text in enumerate(documents):
+                metadata = metadatas[i] if metadatas and i < len(metadatas) and metadatas[i] else {}
+                doc_id = docs_ids[i] if docs_ids and i < len(docs_ids) else None
+                # Add the document ID to the metadata if it's not already there
+                if doc_id and 'id' not in metadata:
+                    metadata['id'] = doc_id
+                if i < len(distances) and 'score' not in metadata:
+                    score = distance_to_similarity_score(distances[i], space)
+                    if score is not None:
+                        metadata['score'] = score
+                docs.append(dspy.Example(long_text=doc_text, **metadata)) # Pass metadata as keyword arguments
+            batches.append(docs)
+        return batches
+
+    def _max_distance(self, query_embs, space):
+        """ Distance cutoff for settings.SIMILARITY_THRESHOLD (read per query, it can change at runtime). """
+        # L2 distances only map to a similarity for unit-length embeddings; the documents share the query's model
+        normalized = bool(query_embs) and np.allclose(np.linalg.norm(np.asarray(query_embs, dtype='float32'), axis=1), 1.0, atol=1e-3)
+        return similarity_threshold_to_distance(settings.SIMILARITY_THRESHOLD, space, normalized=normalized)
+
+    def phrase_filter(self, phrase):
+        """ where_document matching documents that contain phrase: $phrase (case and whitespace aside) on FAISS, $contains on Chroma. """
+        return {'$phrase': phrase} if self._is_faiss_collection() else {'$contains': phrase}
+
+    def _is_faiss_collection(self):
+        """ FAISS collections take max_distance (a range_search) and $phrase; Chroma has neither. """
+        from app.services.faiss_client import is_faiss_collection
+        return is_faiss_collection(self._collection)
+
+def _cut_by_distance(results, max_distance):
+    """ Drop the hits of a Chroma query result that are farther than max_distance, before they are turned into Examples. """
+    if not results or not results.get('distances'):
+        return results
+    cut = dict(results)
+    for field in ('ids', 'documents', 'metadatas', 'distances'):
+        if not results.get(field):
+            continue
+        cut[field] = [
+            [value for value, distance in zip(values, distances) if distance <= max_distance]
+            for values, distances in zip(results[field], results['distances'])
+        ]
+    return cut
 
 from typing import List, Dict, Any, Optional
 
@@ -2,6 +2,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 import numpy as np
+from typing import Optional
 
 def compute_similarity_score(cosine_similarity: float) -> float:
     """
@@ -16,6 +17,42 @@ def compute_similarity_score(cosine_similarity: float) -> float:
     score = (cosine_similarity + 1) / 2
     return min(max(score, 0), 1)
 
+def distance_to_similarity_score(distance: float, space: str) -> Optional[float]:
+    """
+    Compute the similarity score from a vector store distance, without re-embedding any text.
+    Args:
+        distance (float): Distance returned by a Chroma/FAISS query.
+        space (str): Distance space of the collection ("hnsw:space": l2, cosine or ip).
+    Returns:
+        Optional[float]: The similarity score in [0.0, 1.0], or None for L2 distances (not convertible to cosine).
+    """
+    if space in ("cosine", "ip"):
+        # Cosine and inner-product collections report distance = 1 - similarity
+        return compute_similarity_score(1.0 - distance)
+    return None
+
+def similarity_threshold_to_distance(threshold: float, space: str, normalized: bool = False) -> Optional[float]:
+    """
+    Compute the largest vector store distance whose similarity score still reaches the threshold, so the
+    threshold can be applied inside the vector search instead of on the formatted results.
+    Args:
+        threshold (float): Minimum similarity score in [0.0, 1.0] (settings.SIMILARITY_THRESHOLD).
+        space (str): Distance space of the collection ("hnsw:space": l2, cosine or ip).
+        normalized (bool): Whether the embeddings are unit length, which makes L2 distances convertible.
+    Returns:
+        Optional[float]: The distance cutoff, or None if there is none (threshold <= 0, or L2 on unnormalized embeddings).
+    """
+    if threshold <= 0:
+        return None
+    threshold = min(float(threshold), 1.0)
+    if space in ("cosine", "ip"):
+        # score = (2 - distance) / 2, see distance_to_similarity_score
+        return 2.0 * (1.0 - threshold)
+    if normalized:
+        # For unit vectors L2^2 = 2 - 2 * cosine, so score = 1 - L2^2 / 4
+        return 2.0 * float(np.sqrt(1.0 - threshold))
+    return None
+
 def compute_text_similarity_score(text1: str, text2: str, embedder=None) -> float:
     """
     Compute the similarity score between two texts using their embeddings (cosine similarity).
@@ -31,6 +68,20 @@ def compute_text_similarity_score(text1: str, text2: str, embedder=None) -> floa
         embedder = get_embedding_model()
     emb1 = embedder.encode([text1])[0]
     emb2 = embedder.encode([text2])[0]
+    return compute_embedding_similarity_score(emb1, emb2)
+
+def compute_embedding_similarity_score(embedding1, embedding2) -> float:
+    """
+    Compute the similarity score between two embeddings (cosine similarity), e.g. a query embedding and
+    a vector read back from the index with include=['embeddings'], so the document is not re-encoded.
+    Args:
+        embedding1: First embedding.
+        embedding2: Second embedding.
+    Returns:
+        float: Similarity score in [0.0, 1.0]
+    """
+    emb1 = np.asarray(embedding1, dtype='float32')
+    emb2 = np.asarray(embedding2, dtype='float32')
     # Compute cosine similarity
     cosine_sim = float(np.dot(emb1, emb2) / (np.linalg.norm(emb1) * np.linalg.norm(emb2)))
     return compute_similarity_score(cosine_sim)
@@ -147,4 +147,18 @@ class TestRoutes:
         assert response.status_code == 200
         result = response.json()
         assert result["results"][0]["status"] == "success"
-        assert result["results"][0]["ids"] == ["test_qa_1"]
\ No newline at end of file
+        assert result["results"][0]["ids"] == ["test_qa_1"]
+
+    @patch('app.api.routes.get_collection_records_page')
+    def test_stream_collection_records(self, mock_get_page):
+        mock_get_page.return_value = ([{"id": "a", "metadata": {"n": 1}}, {"id": "b", "metadata": {"n": 2}}], "42")
+
+        response = client.get("/api/chroma-collections/issues/records?limit=2&fields=ids,metadata")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines == [{"id": "a", "metadata": {"n": 1}}, {"id": "b", "metadata": {"n": 2}}, {"next_cursor": "42"}]
+        mock_get_page.assert_called_once_with("issues", cursor=None, limit=2, include=["metadatas"])
+
+        assert client.get("/api/chroma-collections/issues/records?fields=vectors").status_code == 400
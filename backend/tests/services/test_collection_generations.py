@@ -0,0 +1,94 @@
+import pytest
+import numpy as np
+
+from app.services.collection_generations import AliasedVectorDBClient, DualWriteCollection, GenerationBuild, GenerationRegistry
+
+DIM = 8
+
+def make_client(backend, tmp_path, mocker):
+    if backend == "faiss":
+        from app.services.faiss_client import FaissClient
+        mocker.patch("app.services.faiss_client.get_embedding_model").return_value.encode.return_value = np.zeros(DIM)
+        raw = FaissClient(base_path=str(tmp_path / "faiss"))
+    else:
+        import chromadb
+        from chromadb.config import Settings
+        raw = chromadb.PersistentClient(path=str(tmp_path / "chroma"), settings=Settings(anonymized_telemetry=False))
+    return AliasedVectorDBClient(raw, GenerationRegistry(str(tmp_path / "collection_aliases.json")))
+
+def listed_names(client):
+    return sorted(c["name"] if isinstance(c, dict) else getattr(c, "name", c) for c in client.list_collections())
+
+@pytest.mark.parametrize("backend", ["chroma", "faiss"])
+def test_generation_build_serves_old_generation_until_swapped(tmp_path, mocker, backend):
+    mocker.patch("app.services.collection_generations.settings.GENERATION_BUILD_BATCH_SIZE", 10)
+    client = make_client(backend, tmp_path, mocker)
+    vectors = np.random.default_rng(0).random((31, DIM), dtype='float32')
+    client.get_or_create_collection("issues").add(ids=[f"doc_{i}" for i in range(30)], embeddings=vectors[:30].tolist(),
+                                                  metadatas=[{"n": i} for i in range(30)], documents=[f"document {i}" for i in range(30)])
+
+    # Writes made while the copy runs reach both generations; records deleted before their page is copied stay deleted
+    original_copy = GenerationBuild._copy
+    def copy_after_writes(job, *args):
+        if job.processed == 0:
+            live = client.get_collection("issues")
+            assert isinstance(live, DualWriteCollection)
+            live.upsert(ids=["new"], embeddings=vectors[30:].tolist(), metadatas=[{"n": 30}], documents=["document new"])
+            live.delete(ids=["doc_25"])
+            live.delete(where={"n": 24}) # Resolved to ids, so the copy does not bring doc_24 back
+            with pytest.raises(ValueError):
+                live.clear()
+        return original_copy(job, *args)
+    mocker.patch.object(GenerationBuild, "_copy", copy_after_writes)
+
+    assert client.build_generation("issues", activate=False)["building"] == 1
+    client._builds["issues"].wait(30)
+    status = client.generation_status("issues")
+    assert status["build"]["status"] == "ready", status["build"]["error"]
+    assert (status["active"], status["building"], status["generations"]["1"]["record_count"]) == (0, None, 29)
+    assert client.get_collection("issues").name == "issues" and listed_names(client) == ["issues"]
+
+    client.activate_generation("issues", 1)
+    live = client.get_collection("issues")
+    assert live.name == "issues__gen1" and listed_names(client) == ["issues"]
+    assert sorted(live.get(include=[])["ids"]) == sorted([f"doc_{i}" for i in range(30) if i not in (24, 25)] + ["new"])
+    hits = live.query(query_embeddings=[vectors[7].tolist()], n_results=1, include=["documents", "distances"])
+    assert hits["ids"] == [["doc_7"]] and hits["documents"] == [["document 7"]]
+
+    assert client.rollback_generation("issues")["active"] == 0 and client.get_collection("issues").name == "issues"
+    assert client.rollback_generation("issues")["active"] == 1
+    client.delete_collection("issues")
+    assert client.raw_client.list_collections() == [] and client.generation_status("issues")["active"] == 0
+
+@pytest.mark.parametrize("backend", ["chroma", "faiss"])
+def test_search_follows_generation_switches(tmp_path, mocker, backend):
+    from app.services import stackoverflow_service
+    from app.services.collection_generations import generation_collection_name
+    from app.utils.rag_utils import create_bm25_index
+    from app.utils.retrievers import VectorRetriever
+    client = make_client(backend, tmp_path, mocker)
+    vector = np.random.default_rng(0).random((1, DIM), dtype='float32')
+    mocker.patch.object(stackoverflow_service, "get_vector_db_client", return_value=client)
+    mocker.patch.object(stackoverflow_service, "get_embedding_model").return_value.encode.return_value = vector
+    mocker.patch.object(stackoverflow_service, "get_reranker").return_value.predict.side_effect = lambda pairs: [0.0] * len(pairs)
+    mocker.patch.object(stackoverflow_service, "compute_text_similarity_score", return_value=1.0)
+    mocker.patch("app.core.config.Settings.SIMILARITY_THRESHOLD", 0.0)
+    # No keyword hits: the vector search alone shows which generation serves the query
+    mocker.patch.object(stackoverflow_service, "create_bm25_index", side_effect=lambda corpus: create_bm25_index([]))
+    stackoverflow_service.clear_stackoverflow_cache()
+    name = stackoverflow_service.COLLECTION_NAME
+    client.get_or_create_collection(name).add(ids=["old"], embeddings=vector.tolist(), metadatas=[{"n": 0}], documents=["old answer"])
+
+    def search():
+        return [item["content"] for item in stackoverflow_service.search_similar_stackoverflow_content("answer")]
+    assert search() == ["old answer"]
+
+    client.build_generation(name, source="empty")
+    # While the generation is built the collection is a DualWriteCollection, still recognized as a FAISS one
+    assert VectorRetriever(client.get_collection(name), None)._is_faiss_collection() == (backend == "faiss")
+    client.raw_client.get_collection(generation_collection_name(name, 1)).add(ids=["new"], embeddings=vector.tolist(), metadatas=[{"n": 1}], documents=["new answer"])
+    assert search() == ["old answer"]
+    client.activate_generation(name, 1)
+    assert search() == ["new answer"]
+    client.rollback_generation(name)
+    assert search() == ["old answer"]
@@ -0,0 +1,814 @@
+import os
+import pickle
+import pytest
+import threading
+import numpy as np
+
+from app.services.faiss_client import FaissClient, FaissCollection
+from app.services.faiss_index_factory import FaissIndexConfig, extract_vectors, load_index_config, index_kind
+from app.services.faiss_filters import matches_where_document
+
+DIM = 8
+
+def make_collection(tmp_path, name="test", **config):
+    collection_path = tmp_path / name
+    collection_path.mkdir(exist_ok=True)
+    index_config = FaissIndexConfig(**config) if config else None
+    return FaissCollection(
+        name,
+        str(collection_path / "index.faiss"),
+        str(collection_path / "metadata.db"),
+        DIM,
+        index_config=index_config,
+    )
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).random((n, DIM), dtype='float32')
+
+class TestFaissCollection:
+    def test_add_and_query_flat(self, tmp_path):
+        collection = make_collection(tmp_path)
+        vectors = random_vectors(20)
+        collection.add(
+            ids=[f"doc_{i}" for i in range(20)],
+            embeddings=vectors.tolist(),
+            metadatas=[{"source": "jira", "n": i} for i in range(20)],
+            documents=[f"document {i}" for i in range(20)],
+        )
+        results = collection.query(query_embeddings=[vectors[3].tolist()], n_results=3)
+        assert results["ids"][0][0] == "doc_3"
+        assert results["documents"][0][0] == "document 3"
+        assert results["metadatas"][0][0]["n"] == 3
+        assert collection.count() == 20
+
+    def test_index_type_is_persisted(self, tmp_path):
+        collection = make_collection(tmp_path, index_type="hnsw", hnsw_m=8, ef_search=32)
+        collection.add(ids=["a", "b"], embeddings=random_vectors(2).tolist())
+        assert index_kind(collection.index) == "hnsw"
+        persisted = load_index_config(str(tmp_path / "test"))
+        assert persisted.index_type == "hnsw"
+        assert persisted.ef_search == 32
+        reloaded = make_collection(tmp_path)
+        assert reloaded.index_config.index_type == "hnsw"
+        assert index_kind(reloaded.index) == "hnsw"
+        assert reloaded.count() == 2
+
+    def test_ivf_trains_once_enough_vectors(self, tmp_path):
+        collection = make_collection(tmp_path, index_type="ivf_flat", nlist=4, nprobe=4, min_train_size=200)
+        vectors = random_vectors(300)
+        collection.add(ids=[f"doc_{i}" for i in range(100)], embeddings=vectors[:100].tolist())
+        assert index_kind(collection.index) == "flat"
+        collection.add(ids=[f"doc_{i}" for i in range(100, 300)], embeddings=vectors[100:].tolist())
+        assert index_kind(collection.index) == "ivf_flat"
+        assert collection.count() == 300
+        results = collection.query(query_embeddings=[vectors[150].tolist()], n_results=1)
+        assert results["ids"][0] == ["doc_150"]
+
+    def test_changing_index_type_rebuilds(self, tmp_path):
+        collection = make_collection(tmp_path)
+        vectors = random_vectors(10)
+        collection.add(ids=[f"doc_{i}" for i in range(10)], embeddings=vectors.tolist())
+        rebuilt = make_collection(tmp_path, index_type="hnsw")
+        assert index_kind(rebuilt.index) == "hnsw"
+        results = rebuilt.query(query_embeddings=[vectors[7].tolist()], n_results=1)
+        assert results["ids"][0] == ["doc_7"]
+
+    def test_unknown_index_type_rejected(self):
+        with pytest.raises(ValueError):
+            FaissIndexConfig.from_metadata({"faiss:index_type": "lsh"})
+
+    def test_metadata_persisted_per_record(self, tmp_path):
+        collection = make_collection(tmp_path)
+        collection.add(ids=["a", "b", "c"], embeddings=random_vectors(3).tolist(),
+                       metadatas=[{"k": 1}, {"k": 2}, {"k": 3}], documents=["A", "B", "C"])
+        collection.delete(ids=["b"])
+        reloaded = make_collection(tmp_path)
+        data = reloaded.get()
+        assert data["ids"] == ["a", "c"]
+        assert data["documents"] == ["A", "C"]
+        assert reloaded.metadata_store.get("c") == {"k": 3}
+        assert reloaded.get(limit=1, offset=1)["ids"] == ["c"]
+        assert reloaded.get(ids=["c", "missing"])["metadatas"] == [{"k": 3}]
+
+    def test_migrates_legacy_pickle(self, tmp_path):
+        seed = make_collection(tmp_path)
+        seed.add(ids=["x", "y"], embeddings=random_vectors(2).tolist())
+        seed.store.clear()
+        with open(tmp_path / "test" / "metadata.pkl", "wb") as f:
+            pickle.dump({
+                "metadata": {"x": {"source": "jira"}, "y": {"source": "confluence"}},
+                "documents": {"x": "doc x", "y": "doc y"},
+                "faiss_map": {0: "x", 1: "y"},
+                "next_id": 2,
+            }, f)
+        migrated = make_collection(tmp_path)
+        assert migrated.next_internal_id == 2
+        assert migrated.get(ids=["y"])["documents"] == ["doc y"]
+        assert not os.path.exists(tmp_path / "test" / "metadata.pkl")
+        assert os.path.exists(tmp_path / "test" / "metadata.pkl.migrated")
+
+    def test_mutations_replayed_from_wal(self, tmp_path):
+        collection = make_collection(tmp_path)
+        vectors = random_vectors(5)
+        collection.add(ids=[f"doc_{i}" for i in range(5)], embeddings=vectors.tolist())
+        collection.delete(ids=["doc_1"])
+        # No checkpoint happened: index.faiss was never written, everything is in the log
+        assert not os.path.exists(collection.index_path)
+        assert collection.wal.record_count == 2
+        reloaded = make_collection(tmp_path)
+        assert reloaded.count() == 4
+        assert reloaded.query(query_embeddings=[vectors[4].tolist()], n_results=1)["ids"][0] == ["doc_4"]
+
+    def test_checkpoint_truncates_wal_and_ignores_torn_tail(self, tmp_path):
+        collection = make_collection(tmp_path)
+        vectors = random_vectors(3)
+        collection.add(ids=["a", "b"], embeddings=vectors[:2].tolist())
+        collection.checkpoint()
+        assert os.path.exists(collection.index_path)
+        assert collection.wal.size_bytes == 0
+        collection.add(ids=["c"], embeddings=vectors[2:].tolist())
+        with open(collection.wal.path, "ab") as f:
+            f.write(b"\x01\x05\x00") # partial record from an interrupted append
+        reloaded = make_collection(tmp_path)
+        assert reloaded.count() == 3
+        assert reloaded.wal.record_count == 1
+
+    def test_get_where_uses_metadata_indexes(self, tmp_path, mocker):
+        collection = make_collection(tmp_path)
+        collection.add(
+            ids=["i1", "i2", "c1"],
+            embeddings=random_vectors(3).tolist(),
+            metadatas=[
+                {"source": "jira", "jira_ticket_id": "PROJ-1", "content_hash": "h1", "priority": 1},
+                {"source": "jira", "jira_ticket_id": "PROJ-2", "content_hash": "h2", "priority": 3},
+                {"source": "confluence", "content_hash": "h3", "priority": 2},
+            ],
+            documents=["one", "two", "three"],
+        )
+        scan = mocker.spy(collection.store, "iter_records")
+        assert collection.get(where={"content_hash": "h2"})["ids"] == ["i2"]
+        where = {"$and": [{"$or": [{"jira_ticket_id": "PROJ-1"}, {"jira_ticket_id": "proj-1"}]}]}
+        assert collection.get(where=where)["ids"] == ["i1"]
+        assert collection.get(where={"source": {"$in": ["jira", "confluence"]}}, limit=2, offset=1)["ids"] == ["i2", "c1"]
+        # Mixed clause: the indexed part narrows candidates, the rest is checked on the fetched metadata
+        assert collection.get(where={"$and": [{"source": "jira"}, {"priority": {"$gte": 2}}]})["ids"] == ["i2"]
+        scan.assert_not_called()
+        # Unindexed keys still work through a scan
+        assert collection.get(where={"priority": {"$lt": 3}})["ids"] == ["i1", "c1"]
+
+        collection.delete(ids=["i2"])
+        assert collection.get(where={"content_hash": "h2"})["ids"] == []
+        reloaded = make_collection(tmp_path)
+        assert reloaded.get(where={"source": "jira"})["ids"] == ["i1"]
+
+
+    def test_compact_id_map_survives_upserts_deletes_and_slot_compaction(self, tmp_path, mocker):
+        mocker.patch("app.services.faiss_idmap.MIN_COMPACT_SLOTS", 16)
+        mocker.patch("app.services.faiss_idmap.MIN_TAIL_SIZE", 8)
+        collection = make_collection(tmp_path)
+        ids = [f"doc_{i}" for i in range(60)]
+        collection.add(ids=ids, embeddings=random_vectors(60).tolist(), metadatas=[{"source": "jira" if i % 3 else "confluence"} for i in range(60)])
+        for round_ in range(3):
+            collection.upsert(ids=ids[:40], embeddings=random_vectors(40, seed=round_ + 1).tolist(), metadatas=[{"source": "stackoverflow"}] * 40)
+        collection.delete(ids=["doc_1", "doc_50"])
+        assert collection.id_map._size < 60 + 3 * 40 # Freed slots were reclaimed
+
+        assert len(collection.doc_id_to_faiss_id) == 58 and "doc_1" not in collection.doc_id_to_faiss_id
+        assert collection.faiss_id_to_doc_id[collection.doc_id_to_faiss_id["doc_7"]] == "doc_7"
+        assert dict(collection.doc_id_to_faiss_id) == {doc_id: internal_id for internal_id, doc_id in collection.faiss_id_to_doc_id.items()}
+        assert collection.get(where={"source": "confluence"})["ids"] == [f"doc_{i}" for i in range(42, 60, 3)]
+        assert len(collection.get(where={"source": {"$in": ["stackoverflow", "jira"]}})["ids"]) == 58 - 6
+        assert collection.query(query_embeddings=random_vectors(1, seed=3).tolist(), n_results=1)["ids"] == [["doc_0"]] # Vector of the last upsert
+
+        reloaded = make_collection(tmp_path)
+        assert dict(reloaded.doc_id_to_faiss_id) == dict(collection.doc_id_to_faiss_id)
+        assert reloaded.metadata_index.stats() == {"content_hash": 0, "jira_ticket_id": 0, "msg_jira_id": 0, "source": 3}
+
+    def test_where_document_uses_trigram_index(self, tmp_path, mocker):
+        mocker.patch("app.services.faiss_trigram.MIN_PURGE_ROWS", 4)
+        collection = make_collection(tmp_path)
+        documents = [
+            "java.lang.NullPointerException at com.acme.Billing.run(Billing.java:42)",
+            "Timeout after 30s: ERR_CONN_RESET while calling payments",
+            "User cannot log in; error code ERR-4031 on the SSO page",
+            "Disk full on node-7, NullPointerException in the cleanup job",
+            None,
+        ]
+        collection.add(ids=[f"doc_{i}" for i in range(5)], embeddings=random_vectors(5).tolist(), documents=documents)
+
+        stored = collection.get()
+        def expected(where_document):
+            return [doc_id for doc_id, document in zip(stored["ids"], stored["documents"])
+                    if document is not None and matches_where_document(document, where_document)]
+
+        scan = mocker.spy(collection.store, "iter_records")
+        clauses = [
+            {"$contains": "NullPointerException"},
+            {"$contains": "nullpointerexception"}, # $contains stays case-sensitive
+            {"$phrase": "nullpointerexception  AT com.acme"},
+            {"$contains": "ERR-4031"},
+            {"$or": [{"$contains": "ERR_CONN_RESET"}, {"$phrase": "disk FULL"}]},
+            {"$and": [{"$contains": "NullPointer"}, {"$contains": "node-7"}]},
+            {"$contains": "no such text"},
+        ]
+        for where_document in clauses:
+            assert collection.get(where_document=where_document)["ids"] == expected(where_document)
+        scan.assert_not_called()
+        assert collection.get(where_document={"$not_contains": "NullPointer"})["ids"] == ["doc_1", "doc_2"] # Not indexable: scanned
+        assert collection.get(where_document={"$contains": "s:"})["ids"] == ["doc_1"] # Shorter than a trigram: scanned
+
+        hits = collection.query(query_embeddings=random_vectors(1, seed=1).tolist(), n_results=5, where_document={"$phrase": "NULLPOINTEREXCEPTION"})
+        assert sorted(hits["ids"][0]) == ["doc_0", "doc_3"]
+
+        # The index follows upserts and deletes, and purges removed rows
+        collection.upsert(ids=["doc_0"], embeddings=random_vectors(1, seed=2).tolist(), documents=["OutOfMemoryError in Billing"])
+        collection.upsert(ids=["doc_1"], metadatas=[{"fixed": True}], documents=["Timeout: ERR_CONN_REFUSED"], embeddings=random_vectors(1, seed=3).tolist())
+        collection.delete(ids=["doc_3"])
+        assert collection.get(where_document={"$contains": "NullPointerException"})["ids"] == []
+        assert collection.get(where_document={"$contains": "ERR_CONN_RE"})["ids"] == ["doc_1"]
+        assert collection.get(where_document={"$phrase": "outofmemoryerror"})["ids"] == ["doc_0"]
+        assert len(collection.trigram_index) == 3
+        assert make_collection(tmp_path).get(where_document={"$phrase": "err-4031 ON the"})["ids"] == ["doc_2"]
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    def test_query_filters_pushed_into_search(self, tmp_path, index_type):
+        collection = make_collection(tmp_path, index_type=index_type)
+        vectors = random_vectors(200)
+        collection.add(
+            ids=[f"doc_{i}" for i in range(200)],
+            embeddings=vectors.tolist(),
+            metadatas=[{"source": "jira" if i % 10 == 0 else "confluence", "n": i} for i in range(200)],
+            documents=[f"document {i}" + (" outage" if i % 7 == 0 else "") for i in range(200)],
+        )
+        results = collection.query(query_embeddings=[vectors[5].tolist()], n_results=5, where={"source": "jira"})
+        assert len(results["ids"][0]) == 5
+        assert all(metadata["source"] == "jira" for metadata in results["metadatas"][0])
+        assert results["distances"][0] == sorted(results["distances"][0])
+
+        # Unindexed keys and document filters resolve through a scan
+        results = collection.query(query_embeddings=[vectors[5].tolist()], n_results=3,
+                                   where={"n": {"$lt": 50}}, where_document={"$contains": "outage"})
+        assert set(results["ids"][0]) <= {f"doc_{i}" for i in range(0, 50, 7)}
+        assert len(results["ids"][0]) == 3
+
+        results = collection.query(query_embeddings=[vectors[5].tolist()], n_results=3, where={"source": "slack"})
+        assert results["ids"] == [[]]
+        assert results["documents"] == [[]]
+
+    def test_query_batches_multiple_embeddings(self, tmp_path):
+        collection = make_collection(tmp_path)
+        vectors = random_vectors(30)
+        collection.add(
+            ids=[f"doc_{i}" for i in range(30)],
+            embeddings=vectors.tolist(),
+            documents=[f"document {i}" for i in range(30)],
+        )
+        results = collection.query(query_embeddings=vectors[[4, 17, 25]].tolist(), n_results=2)
+        assert [ids[0] for ids in results["ids"]] == ["doc_4", "doc_17", "doc_25"]
+        assert [documents[0] for documents in results["documents"]] == ["document 4", "document 17", "document 25"]
+        assert all(len(distances) == 2 for distances in results["distances"])
+
+        filtered = collection.query(query_embeddings=vectors[[4, 17]].tolist(), n_results=2, where_document={"$contains": "document 9"})
+        assert filtered["ids"] == [["doc_9"], ["doc_9"]]
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    def test_mmap_load_copies_index_before_first_write(self, tmp_path, index_type):
+        writer = make_collection(tmp_path, index_type=index_type)
+        vectors = random_vectors(20)
+        writer.add(ids=[f"doc_{i}" for i in range(20)], embeddings=vectors.tolist())
+        writer.checkpoint()
+
+        mapped = FaissCollection("test", str(tmp_path / "test" / "index.faiss"), str(tmp_path / "test" / "metadata.db"), DIM, use_mmap=True)
+        assert mapped._mmapped
+        assert mapped.query(query_embeddings=[vectors[2].tolist()], n_results=1)["ids"] == [["doc_2"]]
+        mapped.add(ids=["extra"], embeddings=random_vectors(1, seed=5).tolist())
+        assert not mapped._mmapped
+        assert mapped.count() == 21
+
+    def test_read_only_collection_serves_writer_checkpoints(self, tmp_path, monkeypatch):
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "FAISS_READ_ONLY_REFRESH_SECONDS", 0)
+        writer = make_collection(tmp_path)
+        vectors = random_vectors(10)
+        writer.add(ids=[f"doc_{i}" for i in range(5)], embeddings=vectors[:5].tolist(), documents=[f"d{i}" for i in range(5)])
+        writer.checkpoint()
+
+        reader = FaissCollection("test", str(tmp_path / "test" / "index.faiss"), str(tmp_path / "test" / "metadata.db"), DIM, read_only=True, use_mmap=True)
+        assert reader._mmapped
+        assert reader.count() == 5
+        with pytest.raises(RuntimeError):
+            reader.add(ids=["x"], embeddings=random_vectors(1).tolist())
+        with pytest.raises(RuntimeError):
+            reader.delete(ids=["doc_0"])
+
+        writer.add(ids=[f"doc_{i}" for i in range(5, 10)], embeddings=vectors[5:].tolist(), documents=[f"d{i}" for i in range(5, 10)])
+        writer.checkpoint()
+        results = reader.query(query_embeddings=[vectors[7].tolist()], n_results=1)
+        assert results["ids"] == [["doc_7"]]
+        assert results["documents"] == [["d7"]]
+        assert reader._mmapped
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    def test_cosine_metric_returns_cosine_distances(self, tmp_path, index_type):
+        collection = make_collection(tmp_path, index_type=index_type, metric="cosine")
+        vectors = random_vectors(10) - 0.5
+        collection.add(ids=[f"doc_{i}" for i in range(10)], embeddings=(vectors * 7).tolist())
+        assert collection.metadata == {"hnsw:space": "cosine"}
+        results = collection.query(query_embeddings=[vectors[4].tolist()], n_results=10)
+        assert results["ids"][0][0] == "doc_4"
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        expected = 1 - normalized @ normalized[4]
+        for doc_id, distance in zip(results["ids"][0], results["distances"][0]):
+            assert distance == pytest.approx(expected[int(doc_id.split("_")[1])], abs=1e-5)
+
+    def test_switching_metric_rebuilds_index(self, tmp_path):
+        vectors = random_vectors(10) - 0.5
+        collection = make_collection(tmp_path)
+        collection.add(ids=[f"doc_{i}" for i in range(10)], embeddings=(vectors * 3).tolist())
+        collection.checkpoint()
+
+        cosine = make_collection(tmp_path, metric="cosine")
+        results = cosine.query(query_embeddings=[vectors[2].tolist()], n_results=1)
+        assert results["ids"] == [["doc_2"]]
+        assert results["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+        assert load_index_config(str(tmp_path / "test")).metric == "cosine"
+
+    def test_unknown_metric_rejected(self):
+        with pytest.raises(ValueError):
+            FaissIndexConfig.from_settings(metric="manhattan")
+        assert FaissIndexConfig.from_metadata({"hnsw:space": "cosine"}).metric == "cosine"
+
+    @pytest.mark.parametrize("index_type,storage", [("flat", "float16"), ("flat", "int8"), ("flat", "binary"), ("hnsw", "int8")])
+    def test_quantized_storage_rescored_from_full_vectors(self, tmp_path, index_type, storage):
+        collection = make_collection(tmp_path, index_type=index_type, storage=storage, rescore_factor=10)
+        vectors = random_vectors(100)
+        collection.add(ids=[f"doc_{i}" for i in range(100)], embeddings=vectors.tolist())
+        assert os.path.exists(collection.vector_store.path)
+        results = collection.query(query_embeddings=vectors[[12, 40]].tolist(), n_results=3)
+        assert [ids[0] for ids in results["ids"]] == ["doc_12", "doc_40"]
+        expected = np.linalg.norm(vectors - vectors[40], axis=1)
+        for doc_id, distance in zip(results["ids"][1], results["distances"][1]):
+            assert distance == pytest.approx(expected[int(doc_id.split("_")[1])], abs=1e-5)
+
+    def test_binary_storage_filters_and_tombstones(self, tmp_path):
+        # IndexLSH takes no ID selector: filters and tombstones are applied to its candidates before rescoring
+        collection = make_collection(tmp_path, storage="binary", rescore_factor=2)
+        vectors = random_vectors(40)
+        collection.add(ids=[f"doc_{i}" for i in range(40)], embeddings=vectors.tolist(),
+                       metadatas=[{"parity": i % 2} for i in range(40)], documents=[f"document {i} {'even' if i % 2 == 0 else 'odd'}" for i in range(40)])
+        results = collection.query(query_embeddings=[vectors[3].tolist()], n_results=5, where={"parity": 0})
+        assert len(results["ids"][0]) == 5 and all(int(doc_id.split("_")[1]) % 2 == 0 for doc_id in results["ids"][0])
+        results = collection.query(query_embeddings=[vectors[4].tolist()], n_results=5, where_document={"$contains": "odd"})
+        assert len(results["ids"][0]) == 5 and all(int(doc_id.split("_")[1]) % 2 == 1 for doc_id in results["ids"][0])
+
+        collection.delete(ids=["doc_12"])
+        collection.upsert(ids=["doc_13"], embeddings=[vectors[14].tolist()], metadatas=[{"parity": 1}], documents=["document 13 odd"])
+        assert collection.compaction_stats()["tombstones"] == 2
+        results = collection.query(query_embeddings=[vectors[12].tolist(), vectors[14].tolist()], n_results=39)
+        assert all(len(ids) == 39 and "doc_12" not in ids for ids in results["ids"])
+        assert sorted(results["ids"][1][:2]) == ["doc_13", "doc_14"]
+        assert collection.query(query_embeddings=[vectors[12].tolist()], n_results=3, where={"parity": 0})["ids"][0][0] != "doc_12"
+
+    def test_switching_storage_rebuilds_from_full_vectors(self, tmp_path):
+        vectors = random_vectors(50)
+        collection = make_collection(tmp_path, storage="int8")
+        collection.add(ids=[f"doc_{i}" for i in range(50)], embeddings=vectors.tolist())
+        collection.checkpoint()
+
+        reloaded = make_collection(tmp_path, storage="float32")
+        restored, _ = extract_vectors(reloaded.index)
+        np.testing.assert_allclose(restored, vectors, atol=1e-6)
+
+    def test_upsert_replaces_existing_records(self, tmp_path):
+        collection = make_collection(tmp_path)
+        vectors = random_vectors(4)
+        collection.add(ids=["a", "b"], embeddings=vectors[:2].tolist(),
+                       metadatas=[{"content_hash": "h1"}, {"content_hash": "h2"}], documents=["old a", "old b"])
+        # add() keeps skipping existing ids
+        collection.add(ids=["a"], embeddings=vectors[2:3].tolist(), documents=["ignored"])
+        assert collection.get(ids=["a"])["documents"] == ["old a"]
+
+        collection.upsert(ids=["a", "c"], embeddings=vectors[2:4].tolist(),
+                          metadatas=[{"content_hash": "h3"}, {"content_hash": "h4"}], documents=["new a", "c"])
+        assert collection.count() == 3
+        assert collection.get(ids=["a"])["documents"] == ["new a"]
+        assert collection.get(where={"content_hash": "h1"})["ids"] == []
+        assert collection.get(where={"content_hash": "h3"})["ids"] == ["a"]
+        assert collection.query(query_embeddings=[vectors[2].tolist()], n_results=1)["ids"] == [["a"]]
+        assert collection.query(query_embeddings=[vectors[0].tolist()], n_results=3)["ids"][0].count("a") == 1
+
+        # Metadata-only upsert keeps the vector and the stored document
+        collection.upsert(ids=["b"], metadatas=[{"content_hash": "h5"}])
+        assert collection.get(ids=["b"]) == {"ids": ["b"], "metadatas": [{"content_hash": "h5"}], "documents": ["old b"]}
+        with pytest.raises(ValueError):
+            collection.upsert(ids=["new"], metadatas=[{}])
+
+        reloaded = make_collection(tmp_path)
+        assert reloaded.count() == 3
+        assert reloaded.query(query_embeddings=[vectors[2].tolist()], n_results=1)["documents"] == [["new a"]]
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    def test_deletes_are_tombstoned_until_compaction(self, tmp_path, monkeypatch, index_type):
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "FAISS_COMPACTION_MIN_TOMBSTONES", 10)
+        monkeypatch.setattr(settings, "FAISS_COMPACTION_TOMBSTONE_RATIO", 0.5)
+        vectors = random_vectors(40)
+        collection = make_collection(tmp_path, index_type=index_type)
+        collection.add(ids=[f"doc_{i}" for i in range(40)], embeddings=vectors.tolist())
+
+        collection.delete(ids=[f"doc_{i}" for i in range(10)])
+        assert collection.index.ntotal == 40 # Only tombstoned, below the compaction ratio
+        assert collection.count() == 30
+        results = collection.query(query_embeddings=vectors[:3].tolist(), n_results=40)
+        assert all(len(ids) == 30 and not {f"doc_{i}" for i in range(10)} & set(ids) for ids in results["ids"])
+
+        # Tombstones are derived again after a restart (the HNSW index cannot remove ids at all)
+        reloaded = make_collection(tmp_path, index_type=index_type)
+        assert reloaded.compaction_stats()["tombstones"] == 10
+        assert "doc_0" not in reloaded.query(query_embeddings=[vectors[0].tolist()], n_results=5)["ids"][0]
+
+        collection.delete(ids=[f"doc_{i}" for i in range(10, 20)])
+        collection._compaction_thread.join(timeout=10)
+        stats = collection.compaction_stats()
+        assert stats["vectors"] == 20 and stats["tombstones"] == 0 and stats["compactions"] == 1
+        assert collection.query(query_embeddings=[vectors[25].tolist()], n_results=1)["ids"] == [["doc_25"]]
+        assert make_collection(tmp_path, index_type=index_type).index.ntotal == 20
+
+    def test_concurrent_queries_and_writes(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+        collection = make_collection(tmp_path)
+        vectors = random_vectors(400)
+        collection.add(ids=[f"doc_{i}" for i in range(100)], embeddings=vectors[:100].tolist(), documents=[f"d{i}" for i in range(100)])
+
+        def write(batch):
+            start = 100 + batch * 20
+            collection.add(ids=[f"doc_{i}" for i in range(start, start + 20)], embeddings=vectors[start:start + 20].tolist(),
+                           documents=[f"d{i}" for i in range(start, start + 20)])
+            collection.delete(ids=[f"doc_{i}" for i in range(batch * 5, batch * 5 + 5)])
+
+        def read(i):
+            results = collection.query(query_embeddings=[vectors[i % 400].tolist()], n_results=10)
+            # Every hit is hydrated from the same version of the id maps and store
+            assert all(document == f"d{doc_id.split('_')[1]}" for doc_id, document in zip(results["ids"][0], results["documents"][0]))
+            return len(collection.get(limit=5)["ids"])
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            writes = [pool.submit(write, batch) for batch in range(15)]
+            reads = [pool.submit(read, i) for i in range(200)]
+            for future in writes + reads:
+                future.result()
+        assert collection.count() == 100 + 15 * 20 - 15 * 5
+
+    def test_client_lists_collections_from_manifests(self, tmp_path, mocker):
+        collection = make_collection(tmp_path, "issues")
+        collection.add(ids=[f"doc_{i}" for i in range(5)], embeddings=random_vectors(5).tolist())
+        collection.delete(ids=["doc_0"])
+        assert collection.manifest.count == 4 and collection.manifest.dimension == DIM
+
+        model = mocker.patch("app.services.faiss_client.get_embedding_model")
+        client = FaissClient(base_path=str(tmp_path))
+        assert client.list_collections() == [{"name": "issues", "record_count": 4}]
+        assert client.collections == {} # Nothing was loaded to list or count
+        assert client.dimension == DIM
+        model.assert_not_called()
+        assert client.get_collection("issues").count() == 4
+
+    @pytest.mark.parametrize("config", [{}, {"index_type": "ivf_flat", "min_train_size": 100, "nlist": 4}, {"storage": "int8"}])
+    def test_browse_pages_records_with_embeddings(self, tmp_path, config):
+        collection = make_collection(tmp_path, **config)
+        vectors = random_vectors(250)
+        collection.add(ids=[f"doc_{i}" for i in range(250)], embeddings=vectors.tolist(), documents=[f"d{i}" for i in range(250)])
+        collection.delete(ids=["doc_1"])
+
+        seen, cursor = [], None
+        while True:
+            records, cursor = collection.browse(cursor=cursor, limit=100, include=["documents", "embeddings"])
+            seen.extend(records)
+            if cursor is None:
+                break
+        assert [record["id"] for record in seen] == [f"doc_{i}" for i in range(250) if i != 1]
+        assert "metadata" not in seen[0] and seen[0]["document"] == "d0"
+        np.testing.assert_allclose([record["embedding"] for record in seen[:5]], vectors[[0, 2, 3, 4, 5]], atol=1e-5)
+
+    @pytest.mark.parametrize("config", [{}, {"index_type": "hnsw"}, {"index_type": "ivf_flat", "min_train_size": 100, "nlist": 4}, {"storage": "int8"}, {"shards": 3}])
+    def test_get_and_query_return_stored_embeddings(self, tmp_path, config):
+        if config.get("shards"):
+            from app.services.faiss_sharded import ShardedFaissCollection
+            collection = ShardedFaissCollection("test", str(tmp_path / "test"), DIM, FaissIndexConfig(**config))
+        else:
+            collection = make_collection(tmp_path, **config)
+        vectors = random_vectors(150)
+        collection.add(ids=[f"doc_{i}" for i in range(150)], embeddings=vectors.tolist())
+
+        got = collection.get(ids=["doc_7", "doc_3"], include=["embeddings"])
+        assert got["ids"] == ["doc_7", "doc_3"] and isinstance(got["embeddings"], np.ndarray)
+        np.testing.assert_allclose(got["embeddings"], vectors[[7, 3]], atol=1e-5)
+        assert collection.get(ids=["missing"], include=["embeddings"])["embeddings"].shape == (0, DIM)
+
+        results = collection.query(query_embeddings=vectors[[10, 20]].tolist(), n_results=3, include=["distances", "embeddings"])
+        assert [ids[0] for ids in results["ids"]] == ["doc_10", "doc_20"]
+        assert [embeddings.shape for embeddings in results["embeddings"]] == [(3, DIM), (3, DIM)]
+        for ids, embeddings in zip(results["ids"], results["embeddings"]):
+            np.testing.assert_allclose(embeddings, vectors[[int(doc_id[4:]) for doc_id in ids]], atol=1e-5)
+
+    @pytest.mark.parametrize("config", [{}, {"metric": "cosine"}, {"index_type": "hnsw"}, {"index_type": "ivf_flat", "min_train_size": 100, "nlist": 4, "nprobe": 4}, {"storage": "int8"}, {"shards": 3}])
+    def test_query_max_distance_cuts_off_inside_the_search(self, tmp_path, config):
+        if config.get("shards"):
+            from app.services.faiss_sharded import ShardedFaissCollection
+            collection = ShardedFaissCollection("test", str(tmp_path / "test"), DIM, FaissIndexConfig(**config))
+        else:
+            collection = make_collection(tmp_path, **config)
+        vectors = random_vectors(150)
+        collection.add(ids=[f"doc_{i}" for i in range(150)], embeddings=vectors.tolist(), metadatas=[{"even": i % 2 == 0} for i in range(150)])
+        collection.delete(ids=["doc_11"])
+        queries = random_vectors(3, seed=1).tolist()
+
+        for where in (None, {"even": True}):
+            full = collection.query(query_embeddings=queries, n_results=150, include=["distances"], where=where)
+            max_distance = float(full["distances"][0][5])
+            cut = collection.query(query_embeddings=queries, n_results=10, include=["distances", "metadatas"], where=where, max_distance=max_distance)
+            for ids, distances, all_ids, all_distances in zip(cut["ids"], cut["distances"], full["ids"], full["distances"]):
+                expected = [doc_id for doc_id, distance in zip(all_ids, all_distances) if distance <= max_distance][:10]
+                assert ids == expected and all(distance <= max_distance for distance in distances)
+            assert 0 < len(cut["ids"][0]) < 10 and len(cut["metadatas"][0]) == len(cut["ids"][0])
+
+        assert collection.query(query_embeddings=queries, n_results=5, max_distance=-1.0)["ids"] == [[], [], []]
+
+    def test_sharded_collection_fans_out_and_merges(self, tmp_path, mocker):
+        mocker.patch("app.services.faiss_client.get_embedding_model").return_value.encode.return_value = np.zeros(DIM)
+        client = FaissClient(base_path=str(tmp_path / "faiss"))
+        sharded = client.get_or_create_collection("issues", metadata={"faiss:shards": 3})
+        single = make_collection(tmp_path, "single")
+        vectors = random_vectors(90)
+        ids = [f"doc_{i}" for i in range(90)]
+        documents = [f"d{i}" for i in range(90)]
+        sharded.add(ids=ids, embeddings=vectors.tolist(), documents=documents)
+        single.add(ids=ids, embeddings=vectors.tolist(), documents=documents)
+        assert all(shard.count() > 0 for shard in sharded.shards) and sharded.count() == 90
+
+        queries = random_vectors(4, seed=1).tolist()
+        merged, expected = sharded.query(query_embeddings=queries, n_results=7), single.query(query_embeddings=queries, n_results=7)
+        assert merged["ids"] == expected["ids"] and merged["documents"] == expected["documents"]
+        np.testing.assert_allclose(merged["distances"], expected["distances"], rtol=1e-5)
+
+        assert sharded.get(ids=["doc_5", "doc_1", "missing"])["documents"] == ["d5", "d1"]
+        assert sorted(sharded.delete(ids=["doc_5", "doc_6"])) == ["doc_5", "doc_6"]
+        single.delete(ids=["doc_5", "doc_6"])
+        assert sharded.count() == 88 and len(sharded.get(limit=50, offset=40)["ids"]) == 48
+
+        reloaded = FaissClient(base_path=str(tmp_path / "faiss"))
+        assert reloaded.list_collections() == [{"name": "issues", "record_count": 88}]
+        assert reloaded.get_collection("issues").query(query_embeddings=queries, n_results=7)["ids"] == single.query(query_embeddings=queries, n_results=7)["ids"]
+        client.delete_collection("issues")
+        assert not (tmp_path / "faiss" / "issues").exists()
+
+    def test_time_sharded_upsert_moves_records(self, tmp_path):
+        from app.services.faiss_sharded import ShardedFaissCollection
+        config = FaissIndexConfig(shards=2, shard_by="time", shard_time_span_days=1)
+        collection = ShardedFaissCollection("events", str(tmp_path / "events"), DIM, config)
+        vectors = random_vectors(2)
+        collection.add(ids=["a"], embeddings=vectors[:1].tolist(), metadatas=[{"created_at": "2024-01-01T10:00:00Z"}], documents=["doc a"])
+        assert collection.shards[collection._shard_for("a", {"created_at": "2024-01-01T10:00:00Z"})].count() == 1
+
+        collection.upsert(ids=["a"], embeddings=vectors[1:].tolist(), metadatas=[{"created_at": "2024-01-02T10:00:00Z"}])
+        assert [shard.count() for shard in collection.shards].count(1) == 1 and collection.count() == 1
+        assert collection.get(ids=["a"]) == {"ids": ["a"], "metadatas": [{"created_at": "2024-01-02T10:00:00Z"}], "documents": ["doc a"]}
+
+    def test_remote_client_round_trips_through_index_server(self, tmp_path, mocker):
+        import threading
+        from app.services.faiss_server import FaissIndexServer
+        from app.services.faiss_remote import RemoteFaissClient
+        mocker.patch("app.services.faiss_client.get_embedding_model").return_value.encode.return_value = np.zeros(DIM)
+        url = f"unix://{tmp_path / 'faiss.sock'}"
+        server = FaissIndexServer(FaissClient(base_path=str(tmp_path / "faiss")), url)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            client = RemoteFaissClient(url, timeout=10)
+            collection = client.get_or_create_collection("issues")
+            vectors = random_vectors(20)
+            collection.add(ids=[f"doc_{i}" for i in range(20)], embeddings=vectors, metadatas=[{"n": i} for i in range(20)], documents=[f"document {i}" for i in range(20)])
+            results = collection.query(query_embeddings=[vectors[3].tolist(), vectors[7].tolist()], n_results=2, where={"n": {"$gte": 5}}, include=["metadatas", "distances", "embeddings"])
+            assert results["ids"][1][0] == "doc_7" and all(m["n"] >= 5 for row in results["metadatas"] for m in row)
+            np.testing.assert_allclose(results["distances"][1][0], 0.0, atol=1e-5)
+            np.testing.assert_allclose(results["embeddings"][1][0], vectors[7], atol=1e-6)
+            assert collection.get(ids=["doc_2"]) == {"ids": ["doc_2"], "metadatas": [{"n": 2}], "documents": ["document 2"]}
+            np.testing.assert_allclose(collection.get(ids=["doc_4", "doc_2"], include=["embeddings"])["embeddings"], vectors[[4, 2]], atol=1e-6)
+            assert collection.delete(ids=["doc_2"]) == ["doc_2"] and collection.count() == 19
+            assert client.list_collections() == [{"name": "issues", "record_count": 19}]
+            assert client.get_collection("missing") is None
+            with pytest.raises(ValueError, match="dimension mismatch"):
+                collection.add(ids=["bad"], embeddings=np.zeros((1, DIM + 1)))
+
+            # A restarted worker connection is transparently re-established
+            client._local.sock.close()
+            assert collection.count() == 19
+        finally:
+            server.shutdown()
+
+    def test_load_keeps_vectors_on_dimension_mismatch(self, tmp_path):
+        collection = make_collection(tmp_path)
+        collection.add(ids=["a", "b"], embeddings=random_vectors(2).tolist(), documents=["doc a", "doc b"])
+        collection.checkpoint()
+        reopened = FaissCollection("test", str(tmp_path / "test" / "index.faiss"), str(tmp_path / "test" / "metadata.db"), DIM + 4)
+        assert reopened.dimension == DIM and reopened.count() == 2
+        assert reopened.get(ids=["b"])["documents"] == ["doc b"]
+
+    @pytest.mark.parametrize("shards", [1, 2])
+    def test_reindex_re_embeds_with_new_model_and_catches_up(self, tmp_path, mocker, shards):
+        class FakeModel:
+            def __init__(self, dimension, on_encode=None):
+                self.dimension, self.on_encode = dimension, on_encode
+            def encode(self, texts):
+                if self.on_encode:
+                    self.on_encode, hook = None, self.on_encode
+                    hook()
+                if isinstance(texts, str):
+                    return self.encode([texts])[0]
+                return np.array([np.random.default_rng(sum(map(ord, text))).random(self.dimension, dtype='float32') for text in texts])
+
+        mocker.patch("app.services.faiss_client.get_embedding_model", return_value=FakeModel(DIM))
+        client = FaissClient(base_path=str(tmp_path / "faiss"))
+        live = client.get_or_create_collection("issues", metadata={"faiss:shards": shards} if shards > 1 else None)
+        live.add(ids=[f"doc_{i}" for i in range(30)], embeddings=random_vectors(30).tolist(),
+                 metadatas=[{"n": i} for i in range(30)], documents=[f"document {i}" for i in range(30)])
+
+        def write_during_reindex():
+            live.add(ids=["late"], embeddings=random_vectors(1).tolist(), metadatas=[{"n": 99}], documents=["late document"])
+            live.delete(ids=["doc_0"])
+            live.upsert(ids=["doc_1"], metadatas=[{"n": -1}])
+
+        mocker.patch("app.services.faiss_reindex.get_embedding_model", return_value=FakeModel(DIM + 4, on_encode=write_during_reindex))
+        for module in ("faiss_client", "faiss_reindex", "faiss_sharded"):
+            mocker.patch(f"app.services.{module}.current_model_name", return_value="new-model")
+        assert client.collection_summaries()[0]["needs_reindex"]
+
+        # Reads keep going through the swap
+        read_errors = []
+        def read_until_done():
+            while client.reindex_status("issues")["status"] in ("pending", "running"):
+                try:
+                    assert live.get(ids=["doc_5"])["ids"] == ["doc_5"] and live.count() >= 30
+                except Exception as e:
+                    read_errors.append(e)
+
+        status = client.reindex_collection("issues")
+        assert status["status"] in ("pending", "running", "completed")
+        reader = threading.Thread(target=read_until_done)
+        reader.start()
+        client._reindex_jobs["issues"].wait(30)
+        reader.join()
+        assert read_errors == []
+        status = client.reindex_status("issues")
+        assert status["status"] == "completed", status["error"]
+        assert (status["model_name"], status["dimension"], status["previous_dimension"]) == ("new-model", DIM + 4, DIM)
+
+        # The reference taken before the job serves the reindexed collection
+        assert client.get_collection("issues") is live and live.dimension == DIM + 4 and live.count() == 30
+        assert live.get(ids=["doc_0"])["ids"] == []
+        assert live.get(ids=["doc_1", "late"]) == {"ids": ["doc_1", "late"], "metadatas": [{"n": -1}, {"n": 99}], "documents": ["document 1", "late document"]}
+        query = FakeModel(DIM + 4).encode(["document 7"])
+        assert live.query(query_embeddings=query.tolist(), n_results=1)["ids"] == [["doc_7"]]
+        live.add(ids=["after"], embeddings=query.tolist(), documents=["added after the swap"])
+        assert sorted(live.query(query_embeddings=query.tolist(), n_results=2)["ids"][0]) == ["after", "doc_7"]
+        assert client.collection_summaries()[0]["model_name"] == "new-model" and not client.collection_summaries()[0]["needs_reindex"]
+        assert os.listdir(tmp_path / "faiss" / ".reindex") == []
+        assert FaissClient(base_path=str(tmp_path / "faiss")).get_collection("issues").count() == 31
+
+    def test_interrupted_reindex_swap_is_completed_on_start(self, tmp_path):
+        from app.services.faiss_reindex import REINDEX_DIRNAME, READY_SUFFIX
+        (tmp_path / "faiss" / REINDEX_DIRNAME).mkdir(parents=True)
+        staging = make_collection(tmp_path / "faiss" / REINDEX_DIRNAME, "issues")
+        staging.add(ids=["a"], embeddings=random_vectors(1).tolist())
+        staging.checkpoint()
+        staging.close()
+        (tmp_path / "faiss" / REINDEX_DIRNAME / ("issues" + READY_SUFFIX)).touch()
+        make_collection(tmp_path / "faiss" / REINDEX_DIRNAME, "unfinished").close()
+
+        client = FaissClient(base_path=str(tmp_path / "faiss"))
+        assert client.get_collection("issues").count() == 1
+        assert os.listdir(tmp_path / "faiss" / REINDEX_DIRNAME) == []
+
+    def test_embedding_archive_rebuilds_other_layouts_without_the_model(self, tmp_path, mocker):
+        from app.services.faiss_sharded import ShardedFaissCollection
+        mocker.patch("app.services.faiss_embedding_archive.MIN_COMPACT_ROWS", 4)
+        model = mocker.MagicMock()
+        model.encode.side_effect = lambda texts: np.zeros((len(texts), DIM), dtype='float32') if not isinstance(texts, str) else np.zeros(DIM)
+        mocker.patch("app.services.faiss_client.get_embedding_model", return_value=model)
+        client = FaissClient(base_path=str(tmp_path / "faiss"))
+        live = client.get_or_create_collection("issues", metadata={"hnsw:space": "cosine"})
+        # Norms differ, so only the archived originals (not the normalized cosine copies) answer l2 queries exactly
+        vectors = random_vectors(40) * np.arange(1, 41, dtype='float32')[:, None]
+        live.add(ids=[f"doc_{i}" for i in range(40)], embeddings=vectors.tolist(), documents=[f"document {i}" for i in range(40)])
+        model.encode.reset_mock()
+
+        # Upserting an already embedded document reuses its archived vector
+        live.upsert(ids=["copy"], documents=["document 3"])
+        model.encode.assert_not_called()
+        np.testing.assert_allclose(live.get(ids=["copy"], include=['embeddings'])["embeddings"][0], vectors[3] / np.linalg.norm(vectors[3]), rtol=1e-5)
+
+        # Superseded and deleted rows are dropped when the collection is compacted
+        live.upsert(ids=[f"doc_{i}" for i in range(10)], embeddings=(vectors[:10] * 2).tolist(), documents=[f"document {i}" for i in range(10)])
+        live.delete(ids=[f"doc_{i}" for i in range(10, 36)])
+        live.compact()
+        assert live.compaction_stats()["embedding_archive"] == {"rows": 15, "live": 15, "bytes": 15 * DIM * 4}
+
+        mocker.patch("app.services.faiss_reindex.get_embedding_model", side_effect=AssertionError("the model must not run"))
+        with pytest.raises(ValueError):
+            client.rebuild_collection("issues", {"no_such_option": 1})
+        client.rebuild_collection("issues", {"metric": "l2", "index_type": "hnsw", "shards": 2})
+        client._reindex_jobs["issues"].wait(30)
+        status = client.reindex_status("issues")
+        assert status["status"] == "completed", status["error"]
+        assert (status["mode"], status["processed"], status["archive_misses"]) == ("rebuild", 15, 0)
+
+        # The reference taken before the rebuild becomes the sharded collection
+        assert client.get_collection("issues") is live
+        assert isinstance(live, ShardedFaissCollection) and len(live.shards) == 2 and live.index_config.metric == "l2"
+        hits = live.query(query_embeddings=[vectors[38].tolist(), (vectors[4] * 2).tolist()], n_results=1)
+        assert hits["ids"] == [["doc_38"], ["doc_4"]]
+        np.testing.assert_allclose(hits["distances"], [[0.0], [0.0]], atol=1e-3)
+        assert live.count() == 15 and client.collection_summaries()[0]["model_name"] == live.manifest.model_name
+        live.add(ids=["after"], embeddings=[(vectors[0] * 3).tolist()], documents=["added after the rebuild"])
+        assert live.query(query_embeddings=[(vectors[0] * 3).tolist()], n_results=1)["ids"] == [["after"]]
+        assert FaissClient(base_path=str(tmp_path / "faiss")).get_collection("issues").count() == 16
+
+    def test_tiered_collection_searches_cold_tier_only_when_needed(self, tmp_path, mocker):
+        from datetime import datetime, timedelta, timezone
+        from app.services.faiss_tiered import TieredFaissCollection
+        mocker.patch("app.services.faiss_client.get_embedding_model").return_value.encode.return_value = np.zeros(DIM)
+        client = FaissClient(base_path=str(tmp_path / "faiss"))
+        tiered = client.get_or_create_collection("issues", metadata={"faiss:tiering": True, "faiss:hot_days": 30, "faiss:promote_hits": 2})
+        assert isinstance(tiered, TieredFaissCollection)
+        # Even-numbered records are a day old, odd-numbered ones a year old
+        now = datetime.now(timezone.utc)
+        vectors = random_vectors(40)
+        metadatas = [{"created_at": (now - timedelta(days=1 if i % 2 == 0 else 365)).isoformat()} for i in range(40)]
+        tiered.add(ids=[f"doc_{i}" for i in range(40)], embeddings=vectors.tolist(), metadatas=metadatas, documents=[f"d{i}" for i in range(40)])
+        hot, cold = tiered.shards
+        assert (hot.count(), cold.count()) == (20, 20)
+
+        cold_query = mocker.spy(cold, "query")
+        results = tiered.query(query_embeddings=[vectors[3].tolist()], n_results=5)
+        assert len(results["ids"][0]) == 5 and "doc_3" not in results["ids"][0] and cold_query.call_count == 0
+        for _ in range(2):
+            assert tiered.query(query_embeddings=[vectors[3].tolist()], n_results=1, full_history=True)["ids"] == [["doc_3"]]
+        # The hot tier cannot fill 25 results, so the cold tier tops them up
+        results = tiered.query(query_embeddings=[vectors[3].tolist()], n_results=25, include=["documents"])
+        assert len(results["ids"][0]) == 25 and results["ids"][0][0] == "doc_3" and results["documents"][0][0] == "d3"
+        assert cold_query.call_count == 3 and "distances" not in results
+
+        # doc_3 was hit three times and is promoted; its hits halve at every rebalance, and below one it is demoted
+        assert tiered.rebalance()["promoted"] == 1 and "doc_3" in hot.doc_id_to_faiss_id and cold._mmapped
+        assert tiered.query(query_embeddings=[vectors[3].tolist()], n_results=1)["ids"] == [["doc_3"]] and cold_query.call_count == 3
+        assert [tiered.rebalance()["demoted"] for _ in range(3)] == [0, 0, 1] and (hot.count(), cold.count()) == (20, 20)
+        np.testing.assert_allclose(tiered.get(ids=["doc_3"], include=["embeddings"])["embeddings"][0], vectors[3], atol=1e-6)
+        assert tiered.compaction_stats()["tiering"]["cold_queries"] == 3
+
+    def test_optimizer_retrains_ivf_index_as_collection_grows(self, tmp_path, monkeypatch):
+        from app.core.config import settings
+        from app.services.faiss_optimizer import TRAINED_ON_INFO_KEY, ivf_of
+        monkeypatch.setattr(settings, "FAISS_RETRAIN_MIN_RECALL", 0.5)
+        collection = make_collection(tmp_path, index_type="ivf_flat", nlist=64, nprobe=16, min_train_size=200)
+        # Centroids are trained on 200 vectors bunched in one corner, then the collection grows elevenfold around them
+        collection.add(ids=[f"doc_{i}" for i in range(200)], embeddings=(random_vectors(200) * 0.1).tolist())
+        assert ivf_of(collection.index).nlist == 5 and collection.store.get_info(TRAINED_ON_INFO_KEY) == "200"
+        vectors = random_vectors(2000, seed=1)
+        collection.add(ids=[f"doc_{i}" for i in range(200, 2200)], embeddings=vectors.tolist())
+
+        decision = collection.optimizer.check()
+        assert decision["action"] == "retrain" and decision["trained_on"] == 200 and decision["nlist"] == 5
+        assert any("grew from 200 to 2200" in reason for reason in decision["reasons"]) and decision["imbalance"] > settings.FAISS_RETRAIN_IMBALANCE
+        assert ivf_of(collection.index).nlist == 56 and collection.store.get_info(TRAINED_ON_INFO_KEY) == "2200"
+        assert collection.query(query_embeddings=[vectors[7].tolist()], n_results=1)["ids"] == [["doc_207"]]
+
+        assert collection.optimizer.check()["action"] == "none"
+        stats = collection.compaction_stats()
+        assert stats["last_compaction"]["retrained"] and stats["optimizer"]["retrains"] == 1
+        assert [d["action"] for d in stats["optimizer"]["decisions"]] == ["retrain", "none"]
+
+    def test_optimizer_reads_vectors_without_blocking_queries(self, tmp_path, mocker):
+        collection = make_collection(tmp_path, index_type="ivf_flat", nlist=4, min_train_size=50)
+        vectors = random_vectors(300)
+        collection.add(ids=[f"doc_{i}" for i in range(300)], embeddings=vectors.tolist())
+        read_vectors = collection._vectors_of
+
+        def query_while_reading(ids):
+            # A query from another thread runs while the check copies the vectors
+            reader = threading.Thread(target=collection.query, kwargs={"query_embeddings": [vectors[0].tolist()], "n_results": 1})
+            reader.start()
+            reader.join(5)
+            assert not reader.is_alive()
+            return read_vectors(ids)
+
+        mocker.patch.object(collection, "_vectors_of", side_effect=query_while_reading)
+        decision = collection.optimizer.check(retrain=False)
+        assert decision["vectors"] == 300 and decision["recall"] is not None
+
+        # An index replaced between the snapshot and the read is left for the next check
+        live_ids = collection._live_ids
+        def replaced_after_snapshot():
+            ids = live_ids()
+            collection._index_generation += 1 # As a compaction swapping its index in right after the snapshot would
+            return ids
+        mocker.patch.object(collection, "_live_ids", side_effect=replaced_after_snapshot)
+        assert collection.optimizer.check(retrain=False) is None
@@ -0,0 +1,59 @@
+import uuid
+import pytest
+import numpy as np
+
+from app.services.faiss_client import FaissClient
+from app.utils.retrievers import VectorRetriever, _cut_by_distance
+
+DIM = 4
+# Unit vectors at these cosines from the query score (1 + cosine) / 2: 0.95, 0.7875 and 0.6.
+# "edge" is 0.85 squared L2 away: inside the plain L2 cutoff for 0.8 (0.894), outside its square (0.8).
+COSINES = {"near": 0.9, "edge": 0.575, "far": 0.2}
+
+def unit_vector(cosine):
+    return [cosine, float(np.sqrt(1 - cosine ** 2)), 0.0, 0.0]
+
+class FakeEmbedder:
+    def encode(self, texts, show_progress_bar=False):
+        return np.array([unit_vector(1.0) for _ in texts], dtype='float32')
+
+def test_cut_by_distance_drops_farther_hits_of_every_query():
+    results = {
+        "ids": [["a", "b"], ["c"]],
+        "documents": [["doc a", "doc b"], ["doc c"]],
+        "metadatas": [[{"n": 1}, {"n": 2}], [{"n": 3}]],
+        "distances": [[0.1, 0.5], [0.3]],
+    }
+    assert _cut_by_distance(results, 0.3) == {
+        "ids": [["a"], ["c"]],
+        "documents": [["doc a"], ["doc c"]],
+        "metadatas": [[{"n": 1}], [{"n": 3}]],
+        "distances": [[0.1], [0.3]],
+    }
+    assert _cut_by_distance({"ids": [[]], "distances": None}, 0.3) == {"ids": [[]], "distances": None}
+
+@pytest.fixture
+def faiss_collection(tmp_path, mocker):
+    mocker.patch("app.services.faiss_client.get_embedding_model").return_value.encode.return_value = np.zeros(DIM)
+    return FaissClient(base_path=str(tmp_path / "faiss")).get_or_create_collection("issues")
+
+@pytest.fixture
+def chroma_collection():
+    chromadb = pytest.importorskip("chromadb")
+    client = chromadb.EphemeralClient()
+    name = f"issues_{uuid.uuid4().hex[:8]}"
+    yield client.create_collection(name, embedding_function=None)
+    client.delete_collection(name)
+
+@pytest.mark.parametrize("backend", ["faiss_collection", "chroma_collection"])
+def test_l2_similarity_threshold_keeps_the_same_hits_on_both_backends(backend, request, mocker):
+    collection = request.getfixturevalue(backend)
+    collection.add(ids=list(COSINES), embeddings=[unit_vector(cosine) for cosine in COSINES.values()], documents=[f"{name} document" for name in COSINES])
+    retriever = VectorRetriever(collection, FakeEmbedder(), k=3)
+
+    mocker.patch("app.core.config.Settings.SIMILARITY_THRESHOLD", 0.8)
+    assert [doc.id for doc in retriever.forward("query")] == ["near"]
+    mocker.patch("app.core.config.Settings.SIMILARITY_THRESHOLD", 0.7)
+    assert [doc.id for doc in retriever.forward("query")] == ["near", "edge"]
+    mocker.patch("app.core.config.Settings.SIMILARITY_THRESHOLD", 0.0)
+    assert [doc.id for doc in retriever.forward("query")] == ["near", "edge", "far"]
@@ -0,0 +1,27 @@
+import math
+import pytest
+
+from app.utils.similarity import distance_to_similarity_score, similarity_threshold_to_distance
+
+class TestSimilarityThresholdToDistance:
+    @pytest.mark.parametrize("space", ["cosine", "ip"])
+    def test_cosine_and_ip_cutoff_is_the_distance_of_the_threshold_score(self, space):
+        cutoff = similarity_threshold_to_distance(0.8, space)
+        assert cutoff == pytest.approx(0.4)
+        assert distance_to_similarity_score(cutoff, space) == pytest.approx(0.8)
+
+    def test_l2_cutoff_is_a_plain_l2_distance_for_unit_vectors(self):
+        cutoff = similarity_threshold_to_distance(0.8, "l2", normalized=True)
+        assert cutoff == pytest.approx(2 * math.sqrt(0.2))
+        # Unit vectors at cosine c are sqrt(2 - 2c) apart and score (1 + c) / 2
+        cosine = 1 - cutoff ** 2 / 2
+        assert (1 + cosine) / 2 == pytest.approx(0.8)
+
+    def test_no_cutoff_without_threshold_or_for_unnormalized_l2(self):
+        assert similarity_threshold_to_distance(0, "cosine") is None
+        assert similarity_threshold_to_distance(-0.5, "l2", normalized=True) is None
+        assert similarity_threshold_to_distance(0.8, "l2") is None
+
+    def test_threshold_is_capped_at_one(self):
+        assert similarity_threshold_to_distance(1.5, "cosine") == 0.0
+        assert similarity_threshold_to_distance(1.5, "l2", normalized=True) == 0.0
@@ -16,17 +16,31 @@ import {
   Paper,
   Chip,
   Tooltip,
-  IconButton
+  IconButton,
+  Button
 } from '@mui/material';
 import { useTheme } from '@mui/material/styles';
 import ExpandMoreIcon from '@mui/icons-material/ExpandMore';
 import ContentCopyIcon from '@mui/icons-material/ContentCopy';
 
 const API_URL = 'http://localhost:9000/api/chroma-collections';
+const PAGE_SIZE = 100;
+
+// Records are streamed as NDJSON: one record per line, then a final {"next_cursor": ...} line
+const fetchRecordsPage = async (collectionName, cursor) => {
+  const params = new URLSearchParams({ limit: PAGE_SIZE, fields: 'ids,metadata,documents' });
+  if (cursor) params.set('cursor', cursor);
+  const res = await fetch(`${API_URL}/${encodeURIComponent(collectionName)}/records?${params}`);
+  if (!res.ok) throw new Error(`Failed to fetch records of ${collectionName}`);
+  const lines = (await res.text()).split('\n').filter(Boolean).map(line => JSON.parse(line));
+  const last = lines.pop() || {};
+  return { records: lines, nextCursor: last.next_cursor || null };
+};
 
 const AdminChromaPage = () => {
   const theme = useTheme();
   const [collections, setCollections] = useState([]);
+  const [pages, setPages] = useState({});
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
 
@@ -35,23 +49,12 @@ const AdminChromaPage = () => {
       try {
         setLoading(true);
         setError('');
-        const res = await fetch(API_URL);
+        const res = await fetch(`${API_URL}/summary`);
         if (!res.ok) throw new Error('Failed to fetch collections');
         const data = await res.json();
-        let safeCollections = [];
-        if (data && Array.isArray(data.collections)) {
-          safeCollections = data.collections.map(col => {
-            if (col.collection_name && Array.isArray(col.records)) {
-              return col;
-            } else if (col.name) {
-              return {
-                collection_name: col.name,
-                records: [] 
-              };
-            }
-            return null;
-          }).filter(Boolean);
-        }
+        const safeCollections = data && Array.isArray(data.collections)
+          ? data.collections.filter(col => col.collection_name)
+          : [];
         setCollections(safeCollections);
       } catch (err) {
         setError(err.message || 'Unknown error');
@@ -62,6 +65,24 @@ const AdminChromaPage = () => {
     fetchCollections();
   }, []);
 
+  const loadRecords = async (collectionName) => {
+    const current = pages[collectionName] || { records: [], nextCursor: null };
+    setPages(prev => ({ ...prev, [collectionName]: { ...current, loading: true, error: '' } }));
+    try {
+      const page = await fetchRecordsPage(collectionName, current.nextCursor);
+      setPages(prev => ({
+        ...prev,
+        [collectionName]: { records: [...current.records, ...page.records], nextCursor: page.nextCursor, loaded: true, loading: false }
+      }));
+    } catch (err) {
+      setPages(prev => ({ ...prev, [collectionName]: { ...current, loading: false, error: err.message || 'Unknown error' } }));
+    }
+  };
+
+  const handleExpand = (collectionName) => (event, expanded) => {
+    if (expanded && !pages[collectionName]) loadRecords(collectionName);
+  };
+
   const handleCopy = (text) => {
     navigator.clipboard.writeText(text);
   };
@@ -83,15 +104,20 @@ const AdminChromaPage = () => {
       {!loading && !error && collections.length === 0 && (
         <Alert severity="info">No collections found.</Alert>
       )}
-      {!loading && !error && collections.map((col) => (
-        <Accordion key={col.collection_name} defaultCollapsed>
+      {!loading && !error && collections.map((col) => {
+        const page = pages[col.collection_name] || { records: [] };
+        return (
+        <Accordion key={col.collection_name} onChange={handleExpand(col.collection_name)} TransitionProps={{ unmountOnExit: true }}>
           <AccordionSummary expandIcon={<ExpandMoreIcon />}>
             <Typography variant="h6">
-              {col.collection_name} ({col.records.length} records)
+              {col.collection_name} ({col.record_count} records)
             </Typography>
           </AccordionSummary>
           <AccordionDetails>
-            {col.records.length === 0 ? (
+            {page.error && <Alert severity="error">{page.error}</Alert>}
+            {!page.loaded && page.loading ? (
+              <CircularProgress size={24} />
+            ) : page.records.length === 0 ? (
               <Alert severity="info">No records in this collection.</Alert>
             ) : (
               <TableContainer component={Paper}>
@@ -105,7 +131,7 @@ const AdminChromaPage = () => {
                     </TableRow>
                   </TableHead>
                   <TableBody>
-                    {col.records.map((rec, idx) => (
+                    {page.records.map((rec, idx) => (
                       <TableRow key={rec.id || idx}>
                         <TableCell>
                           <Box sx={{ display: 'flex', alignItems: 'center' }}>
@@ -155,9 +181,15 @@ const AdminChromaPage = () => {
                 </Table>
               </TableContainer>
             )}
+            {page.nextCursor && (
+              <Button sx={{ mt: 1 }} disabled={page.loading} onClick={() => loadRecords(col.collection_name)}>
+                {page.loading ? 'Loading...' : `Load more (${page.records.length} of ${col.record_count})`}
+              </Button>
+            )}
           </AccordionDetails>
         </Accordion>
-      ))}
+        );
+      })}
     </Box>
   );
 };